@@ -0,0 +1,108 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from app.core.logging_config import logger
+from app.dependencies.models import (
+    get_embedding_store,
+    get_faiss_index,
+    get_ingestion_log,
+    get_lexical_index,
+    get_tag_index,
+)
+from app.schemas.ingestion import IngestRequest, IngestResponse
+from app.services.ingestion_service import IngestionService
+
+router = APIRouter(
+    prefix="/images",
+    tags=["images"],
+    responses={404: {"description": "Not found"}},
+)
+
+ingestion_service = IngestionService()
+
+
+@router.post(
+    "",
+    response_model=IngestResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+async def add_images(
+    request: IngestRequest,
+    faiss_index=Depends(get_faiss_index),
+    ingestion_log=Depends(get_ingestion_log),
+    tag_index=Depends(get_tag_index),
+    embedding_store=Depends(get_embedding_store),
+    lexical_index=Depends(get_lexical_index),
+) -> IngestResponse:
+    """Add images to the index without rerunning the pipeline.
+
+    Args
+    ----------
+        request (IngestRequest): Base64 encoded images, or data URLs, with
+            their tags
+        faiss_index: The online index the images are added to
+        ingestion_log: The log the images are recorded in
+        tag_index: The tag index the image tags are added to
+        embedding_store: Full precision embeddings used for re-ranking
+        lexical_index: The BM25 index the tags and captions are added to
+
+    Returns
+    -------
+        IngestResponse: Ids of the new images, in request order
+
+    Raises
+    ------
+        HTTPException: If ingestion is not enabled, an image is invalid or
+        other errors occur during ingestion
+    """
+    try:
+        return await ingestion_service.add_images(
+            request.images,
+            faiss_index,
+            ingestion_log,
+            tag_index=tag_index,
+            embedding_store=embedding_store,
+            lexical_index=lexical_index,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error ingesting images: {e!s}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@router.delete("/{image_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_image(
+    image_id: int,
+    faiss_index=Depends(get_faiss_index),
+    ingestion_log=Depends(get_ingestion_log),
+    embedding_store=Depends(get_embedding_store),
+    lexical_index=Depends(get_lexical_index),
+) -> None:
+    """Remove an image from search results.
+
+    Args
+    ----------
+        image_id (int): Id of the image, as returned in search results
+        faiss_index: The online index the image is removed from
+        ingestion_log: The log the deletion is recorded in
+        embedding_store: Full precision embeddings used for re-ranking
+        lexical_index: The BM25 index the image is removed from
+
+    Raises
+    ------
+        HTTPException: If ingestion is not enabled, the image is not in the
+        index or other errors occur during deletion
+    """
+    try:
+        await ingestion_service.delete_image(
+            image_id,
+            faiss_index,
+            ingestion_log,
+            embedding_store=embedding_store,
+            lexical_index=lexical_index,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting image: {e!s}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
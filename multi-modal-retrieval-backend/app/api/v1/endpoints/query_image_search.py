@@ -1,7 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 
 from app.core.logging_config import logger
-from app.dependencies.models import get_faiss_index
+from app.dependencies.models import (
+    get_embedding_store,
+    get_faiss_index,
+    get_index_version,
+    get_lexical_index,
+    get_tag_index,
+)
 from app.schemas.search import SearchResponse
 from app.services.feast_service import FeastService
 from app.services.search_service import SearchService
@@ -21,7 +27,17 @@ async def search_images_by_text(
     query: str = Query(...),
     k: int = Query(default=3, ge=1),
     sort: bool = Query(default=True),
+    tag: list[str] | None = Query(default=None),
+    tag_prefix: list[str] | None = Query(default=None),
+    cursor: str | None = Query(default=None),
+    min_score: float | None = Query(default=None),
+    hybrid: bool = Query(default=False),
+    rerank_candidates: int | None = Query(default=None, ge=0),
     faiss_index=Depends(get_faiss_index),
+    tag_index=Depends(get_tag_index),
+    lexical_index=Depends(get_lexical_index),
+    index_version=Depends(get_index_version),
+    embedding_store=Depends(get_embedding_store),
 ) -> SearchResponse:
     """Search for images using a text query.
 
@@ -29,12 +45,31 @@ async def search_images_by_text(
     ----------
         query (str): The text query to search for
         k (int, optional): Number of results to return. Defaults to 3.
+        tag (List[str], optional): Restrict results to images with these tags
+        tag_prefix (List[str], optional): Restrict results to images whose tag
+            starts with one of these prefixes, e.g. a partition directory
+        cursor (str, optional): The next_cursor of a previous response, used
+            to fetch the following page of the same search
+        min_score (float, optional): Return every image whose cosine
+            similarity is above this threshold, k at a time, instead of a
+            fixed top-k
+        hybrid (bool, optional): Fuse a BM25 search over image tags and
+            captions with the vector search. With min_score, only images
+            above the threshold are returned. Defaults to False.
+        rerank_candidates (int, optional): Fetch this many candidates from
+            the index and re-rank them with exact scores against the full
+            precision embeddings, 0 to disable. Defaults to the configured
+            number.
         faiss_index: The FAISS index for vector search
+        tag_index: The tag index used to resolve tag filters
+        lexical_index: The BM25 index used by hybrid search
+        index_version: Version of the loaded index that cursors are tied to
+        embedding_store: Full precision embeddings used for re-ranking
 
     Returns
     -------
         SearchResponse: Object containing search results with image data,
-        similarity scores, and captions
+        similarity scores, captions and the cursor of the next page
 
     Raises
     ------
@@ -42,7 +77,92 @@ async def search_images_by_text(
         during search
     """
     try:
-        return await search_service.search_by_text(query, k, sort, faiss_index)
+        return await search_service.search_by_text(
+            query,
+            k,
+            sort,
+            faiss_index,
+            tags=tag,
+            tag_prefixes=tag_prefix,
+            tag_index=tag_index,
+            cursor=cursor,
+            index_version=index_version,
+            min_score=min_score,
+            hybrid=hybrid,
+            lexical_index=lexical_index,
+            rerank_candidates=rerank_candidates,
+            embedding_store=embedding_store,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in text search: {e!s}")
         raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@router.get("/similar/{image_id}", response_model=SearchResponse)
+async def search_similar_images(
+    image_id: int,
+    k: int = Query(default=3, ge=1),
+    sort: bool = Query(default=True),
+    tag: list[str] | None = Query(default=None),
+    tag_prefix: list[str] | None = Query(default=None),
+    cursor: str | None = Query(default=None),
+    rerank_candidates: int | None = Query(default=None, ge=0),
+    faiss_index=Depends(get_faiss_index),
+    tag_index=Depends(get_tag_index),
+    index_version=Depends(get_index_version),
+    embedding_store=Depends(get_embedding_store),
+) -> SearchResponse:
+    """Search for images similar to an indexed image.
+
+    The stored vector of the image is searched, so no model encodes a
+    query. Pages chain through the cursor as for a text search.
+
+    Args
+    ----------
+        image_id (int): Id of the image, as returned in search results
+        k (int, optional): Number of results to return. Defaults to 3.
+        tag (List[str], optional): Restrict results to images with these tags
+        tag_prefix (List[str], optional): Restrict results to images whose tag
+            starts with one of these prefixes
+        cursor (str, optional): The next_cursor of a previous response, used
+            to fetch the following page of the same search
+        rerank_candidates (int, optional): Fetch this many candidates from
+            the index and re-rank them with exact scores, 0 to disable.
+            Defaults to the configured number.
+        faiss_index: The FAISS index for vector search
+        tag_index: The tag index used to resolve tag filters
+        index_version: Version of the loaded index that cursors are tied to
+        embedding_store: Full precision embeddings the image vector is read
+            from and re-ranked against
+
+    Returns
+    -------
+        SearchResponse: Object containing search results with image data,
+        similarity scores, captions and the cursor of the next page
+
+    Raises
+    ------
+        HTTPException: If the image is not in the index, if search index is
+        not available or other errors occur during search
+    """
+    try:
+        return await search_service.search_similar(
+            image_id,
+            k,
+            sort,
+            faiss_index,
+            tags=tag,
+            tag_prefixes=tag_prefix,
+            tag_index=tag_index,
+            cursor=cursor,
+            index_version=index_version,
+            rerank_candidates=rerank_candidates,
+            embedding_store=embedding_store,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in similar image search: {e!s}")
+        raise HTTPException(status_code=500, detail=str(e)) from e
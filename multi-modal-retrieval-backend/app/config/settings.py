@@ -36,11 +36,38 @@ class ModelSettings(BaseSettings):
     ml_models_registry: Path = Field(
         default="../multi-modal-retrieval-pipeline/data/06_models",
     )
+    # Query embeddings of clip-ViT-B-32, an index must match them
+    embedding_dimension: int = Field(default=512)
+    embedding_metric: str = Field(default="inner_product")
+    # Load the index shards saved by ShardedFaissDataset instead of a single
+    # index, searched on one thread per shard unless set
+    sharded_index: bool = Field(default=False)
+    shard_search_threads: int | None = Field(default=None)
 
     @property
     def faiss_index_path(self) -> Path:
         return self.ml_models_registry / "faiss_index.idx"
 
+    @property
+    def faiss_shards_path(self) -> Path:
+        return self.ml_models_registry / "faiss_shards"
+
+    @property
+    def tag_index_path(self) -> Path:
+        return self.ml_models_registry / "tag_index.json"
+
+    @property
+    def lexical_index_path(self) -> Path:
+        return self.ml_models_registry / "lexical_index.json"
+
+    @property
+    def embedding_matrix_path(self) -> Path:
+        return self.ml_models_registry / "embedding_matrix"
+
+    @property
+    def ingestion_log_path(self) -> Path:
+        return self.ml_models_registry / "online"
+
     model_config = ConfigDict(
         env_prefix="MODEL_",
         env_file=".env",
@@ -49,6 +76,43 @@ class ModelSettings(BaseSettings):
     )
 
 
+class SearchSettings(BaseSettings):
+    max_candidates: int = Field(default=100)
+    max_range_results: int = Field(default=1000)
+    rrf_k: int = Field(default=60)
+    # Candidates re-ranked with exact scores, 0 keeps the index ranking
+    rerank_candidates: int = Field(default=0)
+    max_rerank_candidates: int = Field(default=2000)
+    # Inverted lists an IVF index searches, None for the saved nprobe
+    nprobe: int | None = Field(default=None)
+    cursor_ttl_seconds: int = Field(default=600)
+    cursor_cache_size: int = Field(default=1024)
+
+    model_config = ConfigDict(
+        env_prefix="SEARCH_",
+        env_file=".env",
+        env_file_encoding="utf-8",
+        extra="allow",
+    )
+
+
+class IngestionSettings(BaseSettings):
+    # Images are added and deleted through the API only when enabled
+    enabled: bool = Field(default=False)
+    batch_size: int = Field(default=32)
+    max_images: int = Field(default=256)
+    compaction_interval_seconds: int = Field(default=300)
+    # Ingested images are numbered from here, above the pipeline ids
+    first_id: int = Field(default=1_000_000_000)
+
+    model_config = ConfigDict(
+        env_prefix="INGEST_",
+        env_file=".env",
+        env_file_encoding="utf-8",
+        extra="allow",
+    )
+
+
 class APISettings(BaseSettings):
     project_name: str = Field(default="Multi-Modal Image Retrieval API")
     project_version: str = Field(default="1.0.0")
@@ -75,6 +139,16 @@ def get_model_settings() -> ModelSettings:
     return ModelSettings()
 
 
+@lru_cache
+def get_search_settings() -> SearchSettings:
+    return SearchSettings()
+
+
+@lru_cache
+def get_ingestion_settings() -> IngestionSettings:
+    return IngestionSettings()
+
+
 @lru_cache
 def get_api_settings() -> APISettings:
     return APISettings()
@@ -0,0 +1,99 @@
+import base64
+import binascii
+import json
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Cursor:
+    """Position in a cached candidate list, tied to one index version."""
+
+    candidates_id: str
+    offset: int
+    index_version: str
+
+
+@dataclass(frozen=True)
+class Candidates:
+    """Ranked FAISS ids and distances computed for the first page."""
+
+    distances: np.ndarray
+    indices: np.ndarray
+    index_version: str
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    """Serialise a cursor into an opaque URL-safe token."""
+    payload = json.dumps(
+        {
+            "c": cursor.candidates_id,
+            "o": cursor.offset,
+            "v": cursor.index_version,
+        },
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token: str) -> Cursor:
+    """Parse a token produced by :func:`encode_cursor`.
+
+    Raises
+    ------
+        ValueError: If the token is malformed.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        return Cursor(
+            candidates_id=str(payload["c"]),
+            offset=int(payload["o"]),
+            index_version=str(payload["v"]),
+        )
+    except (
+        binascii.Error,
+        UnicodeError,
+        TypeError,
+        KeyError,
+        ValueError,
+    ) as e:
+        msg = "Invalid cursor"
+        raise ValueError(msg) from e
+
+
+class CandidateCache:
+    """Bounded LRU cache of candidate lists with a time to live."""
+
+    def __init__(self, max_size: int, ttl_seconds: float) -> None:
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, Candidates]] = (
+            OrderedDict()
+        )
+
+    def put(self, candidates: Candidates) -> str:
+        """Store a candidate list and return the id to reference it by."""
+        candidates_id = uuid.uuid4().hex
+        self._entries[candidates_id] = (time.monotonic(), candidates)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        return candidates_id
+
+    def get(self, candidates_id: str) -> Candidates | None:
+        """Return a cached candidate list, or None if evicted or expired."""
+        entry = self._entries.get(candidates_id)
+        if entry is None:
+            return None
+        created_at, candidates = entry
+        if time.monotonic() - created_at > self._ttl_seconds:
+            del self._entries[candidates_id]
+            return None
+        self._entries.move_to_end(candidates_id)
+        return candidates
@@ -1,3 +1,5 @@
+import numpy as np
+from PIL import Image
 from sentence_transformers import SentenceTransformer
 from torch import Tensor
 
@@ -5,9 +7,21 @@ from app.core.logging_config import logger
 
 
 class QueryProcessor:
+    _instance = None
+
+    def __new__(cls):
+        # Searches and ingestion share one copy of the model
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
     def __init__(self) -> None:
+        if self._initialized:
+            return
         logger.info("Initialising QueryProcessor with CLIP model...")
         self.model = SentenceTransformer("clip-ViT-B-32")
+        self._initialized = True
 
     def get_text_embedding(self, text: str) -> Tensor:
         """Generate embedding for a text query using CLIP model."""
@@ -17,3 +31,19 @@ class QueryProcessor:
         except Exception as e:
             logger.error(f"Error generating text embedding: {e}")
             raise
+
+    def get_image_embeddings(
+        self,
+        images: list[Image.Image],
+        batch_size: int = 32,
+    ) -> np.ndarray:
+        """Generate embeddings for RGB images with the CLIP model."""
+        try:
+            logger.info(f"Generating embeddings for {len(images)} images")
+            return np.asarray(
+                self.model.encode(images, batch_size=batch_size),
+                dtype=np.float32,
+            )
+        except Exception as e:
+            logger.error(f"Error generating image embeddings: {e}")
+            raise
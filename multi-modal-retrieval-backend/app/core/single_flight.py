@@ -0,0 +1,114 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable, Sequence
+from typing import Any, TypeVar
+
+from app.core.logging_config import logger
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one computation.
+
+    The first caller for a key starts the work and every caller that arrives
+    while it is still running awaits the same result. Nothing is cached once
+    the work completes, so later calls always recompute.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Run ``func`` once for all concurrent callers of ``key``.
+
+        Args:
+        ----
+            key: Identifies calls that can share a result.
+            func: Coroutine factory that computes the result.
+
+        Returns:
+        -------
+            The result of the single in-flight computation.
+        """
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._register(key, future)
+        else:
+            logger.info("Joining in-flight %s request", self.name)
+        # Shield so a cancelled caller does not cancel the shared work
+        return await asyncio.shield(future)
+
+    async def do_many(
+        self,
+        keys: Sequence[Hashable],
+        func: Callable[[list[Hashable]], Awaitable[Sequence[T]]],
+    ) -> list[T]:
+        """Batch variant of :meth:`do` resolving one result per key.
+
+        Keys already in flight are awaited, the remaining keys are computed
+        together with a single call to ``func``.
+
+        Args:
+        ----
+            keys: Keys to resolve, duplicates are allowed.
+            func: Coroutine factory that receives the keys not yet in flight
+                and returns their results in the same order.
+
+        Returns:
+        -------
+            Results aligned with ``keys``.
+        """
+        missing = [
+            key for key in dict.fromkeys(keys) if key not in self._in_flight
+        ]
+        if len(missing) < len(set(keys)):
+            logger.info("Joining in-flight %s request", self.name)
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in missing}
+            for key, future in futures.items():
+                self._register(key, future)
+            batch = asyncio.ensure_future(func(missing))
+            batch.add_done_callback(
+                lambda task: self._resolve_batch(task, futures),
+            )
+
+        waiters = [asyncio.shield(self._in_flight[key]) for key in keys]
+        return list(await asyncio.gather(*waiters))
+
+    def _register(self, key: Hashable, future: asyncio.Future) -> None:
+        self._in_flight[key] = future
+
+        def _release(done: asyncio.Future) -> None:
+            if self._in_flight.get(key) is done:
+                del self._in_flight[key]
+
+        future.add_done_callback(_release)
+
+    @staticmethod
+    def _resolve_batch(
+        task: asyncio.Future,
+        futures: dict[Hashable, asyncio.Future[Any]],
+    ) -> None:
+        if task.cancelled():
+            for future in futures.values():
+                future.cancel()
+            return
+
+        error = task.exception()
+        if error is not None:
+            for future in futures.values():
+                future.set_exception(error)
+            return
+
+        results = task.result()
+        if len(results) != len(futures):
+            msg = f"Expected {len(futures)} results, got {len(results)}"
+            for future in futures.values():
+                future.set_exception(RuntimeError(msg))
+            return
+
+        for future, result in zip(futures.values(), results, strict=True):
+            future.set_result(result)
@@ -14,3 +14,26 @@ async def get_faiss_index(request: Request):
     except AttributeError:
         msg = "Application state not properly initialized"
         raise RuntimeError(msg)
+
+
+async def get_tag_index(request: Request):
+    # Tag filtering is optional, so a missing tag index is not an error here
+    return getattr(request.app.state, "tag_index", None)
+
+
+async def get_lexical_index(request: Request):
+    return getattr(request.app.state, "lexical_index", None)
+
+
+async def get_index_version(request: Request):
+    return getattr(request.app.state, "index_version", None)
+
+
+async def get_embedding_store(request: Request):
+    # Re-ranking is optional, so a missing embedding store is not an error
+    return getattr(request.app.state, "embedding_store", None)
+
+
+async def get_ingestion_log(request: Request):
+    # Online ingestion is optional, the service reports when it is disabled
+    return getattr(request.app.state, "ingestion_log", None)
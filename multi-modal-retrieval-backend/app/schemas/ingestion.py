@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+
+
+class ImageUpload(BaseModel):
+    """Schema for an image to ingest."""
+
+    image_data: str
+    image_tag: str
+
+
+class IngestRequest(BaseModel):
+    """Schema for an ingestion request."""
+
+    images: list[ImageUpload]
+
+
+class IngestResponse(BaseModel):
+    """Schema for ingestion response."""
+
+    image_ids: list[int]
@@ -4,12 +4,14 @@ from pydantic import BaseModel
 class SearchResult(BaseModel):
     """Schema for a single search result."""
 
+    image_id: int
     image_data: str
     distance: float
-    caption: str
+    caption: str | None = None
 
 
 class SearchResponse(BaseModel):
     """Schema for search response."""
 
     results: list[SearchResult]
+    next_cursor: str | None = None
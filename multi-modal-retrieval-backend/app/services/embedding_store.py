@@ -0,0 +1,125 @@
+from pathlib import Path
+
+import numpy as np
+
+from app.core.logging_config import logger
+from app.core.read_write_lock import ReadWriteLock
+
+
+class EmbeddingStore:
+    """Full precision image embeddings used to re-rank search candidates.
+
+    The pipeline writes the vectors of every indexed image as ``vectors.npy``
+    with their ids in ``ids.npy``. Both are memory-mapped, so only the rows
+    of the candidates being re-ranked are read from disk. Vectors of images
+    ingested through the API since are kept in memory next to them.
+
+    Re-ranking runs in worker threads while ingestion adds and removes
+    vectors, so readers work on a snapshot of the ingested vectors.
+    """
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        self._vectors = vectors
+        self._rows = np.argsort(ids, kind="stable")
+        self._sorted_ids = np.asarray(ids)[self._rows]
+        self._added: dict[int, np.ndarray] = {}
+        self._lock = ReadWriteLock()
+
+    @classmethod
+    def from_directory(cls, path: Path) -> "EmbeddingStore":
+        """Memory-map the embedding matrix written by the pipeline."""
+        return cls(
+            ids=np.load(path / "ids.npy", mmap_mode="r"),
+            vectors=np.load(path / "vectors.npy", mmap_mode="r"),
+        )
+
+    def __len__(self) -> int:
+        with self._lock.read():
+            return len(self._sorted_ids) + len(self._added)
+
+    @property
+    def dimension(self) -> int:
+        return self._vectors.shape[1]
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Keep the vectors of images ingested after the matrix was written."""
+        with self._lock.write():
+            for image_id, vector in zip(ids, vectors, strict=True):
+                self._added[int(image_id)] = np.asarray(
+                    vector,
+                    dtype=np.float32,
+                )
+
+    def remove(self, ids: np.ndarray) -> None:
+        """Forget the vectors of deleted ingested images."""
+        with self._lock.write():
+            for image_id in ids:
+                self._added.pop(int(image_id), None)
+
+    def vector(self, image_id: int) -> np.ndarray | None:
+        """Stored embedding of an image, or None if it has none."""
+        with self._lock.read():
+            added = self._added.get(int(image_id))
+        if added is not None:
+            return added
+        if not len(self._sorted_ids):
+            return None
+        found, rows = self._find(np.array([image_id], dtype=np.int64))
+        if not found[0]:
+            return None
+        return np.asarray(self._vectors[rows[0]], dtype=np.float32)
+
+    def rerank(
+        self,
+        query: np.ndarray,
+        ids: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Score candidates with exact inner products against the query.
+
+        Args:
+        ----
+            query: Query embedding, normalized like the stored vectors
+            ids: Ids of the candidates found by an approximate search
+
+        Returns:
+        -------
+            Tuple of exact scores and ids, best match first. Candidates
+            without a stored vector are dropped.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock.read():
+            stored = dict(self._added)
+        if not (len(self._sorted_ids) or stored):
+            return np.empty(0, dtype=np.float32), ids[:0]
+        added = np.isin(ids, list(stored))
+        found, rows = self._find(ids[~added])
+        if not found.all():
+            logger.warning(
+                "%d candidates have no stored embedding and were dropped",
+                int((~found).sum()),
+            )
+
+        added_ids = ids[added]
+        ids = ids[~added][found]
+        # Reading rows in file order keeps the memory-mapped reads sequential
+        order = np.argsort(rows)
+        vectors = np.empty((len(rows), self.dimension), dtype=np.float32)
+        vectors[order] = self._vectors[rows[order]]
+
+        if len(added_ids):
+            ids = np.concatenate([ids, added_ids])
+            vectors = np.concatenate(
+                [vectors, [stored[int(i)] for i in added_ids]],
+            )
+        scores = vectors @ np.asarray(query, dtype=np.float32).ravel()
+        best = np.argsort(-scores, kind="stable")
+        return scores[best], ids[best]
+
+    def _find(self, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Which ids have a stored vector, and the matrix rows of those."""
+        if not len(self._sorted_ids):
+            return np.zeros(len(ids), dtype=bool), ids[:0]
+        positions = np.searchsorted(self._sorted_ids, ids)
+        positions = np.minimum(positions, len(self._sorted_ids) - 1)
+        found = self._sorted_ids[positions] == ids
+        return found, self._rows[positions[found]]
@@ -1,40 +1,269 @@
+import faiss
 import numpy as np
 
+from app.config.settings import get_search_settings
 from app.core.logging_config import logger
 from app.core.query_processor import QueryProcessor
+from app.services.embedding_store import EmbeddingStore
+from app.services.online_index import OnlineIndex
+from app.services.sharded_index import ShardedIndex
 
 
 class FaissService:
     def __init__(self) -> None:
         self.query_processor = QueryProcessor()
+        self.settings = get_search_settings()
 
     def search(
         self,
         index,
         query: str,
         top_k: int = 3,
+        allowed_ids: np.ndarray | None = None,
+        rerank_candidates: int = 0,
+        embedding_store: EmbeddingStore | None = None,
     ) -> tuple[list[float], list[int]]:
         """Retrieve images based on a text query using FAISS index.
 
+        With ``rerank_candidates`` and an ``embedding_store``, the search
+        runs in two stages. The index, typically compressed, returns
+        ``rerank_candidates`` candidates, or ``top_k`` if that is more, which
+        are then re-ranked with exact inner products against their full
+        precision vectors. The best ``top_k`` of them are returned.
+
         Args:
         ----
             query: Text query to search for
             index: FAISS index for similarity search
             top_k: Number of similar images to retrieve
+            allowed_ids: If given, only these ids are considered. The filter
+                is applied inside FAISS through an ID selector rather than
+                on the returned results.
+            rerank_candidates: Number of candidates to re-rank, 0 to return
+                the index ranking as is
+            embedding_store: Full precision vectors to re-rank against
 
         Returns:
         -------
             Tuple containing the query and numpy array of similar indices
         """
         try:
-            query_embeddings = self.query_processor.get_text_embedding(query)
+            return self._search_vector(
+                index,
+                self._embed_query(query),
+                top_k,
+                allowed_ids,
+                rerank_candidates,
+                embedding_store,
+            )
+        except Exception as e:
+            logger.error(f"Error in retrieve_similar_images: {e}")
+            raise
 
-            query_features = query_embeddings.astype(np.float32).reshape(1, -1)
+    def search_similar(
+        self,
+        index,
+        image_id: int,
+        top_k: int = 3,
+        allowed_ids: np.ndarray | None = None,
+        rerank_candidates: int = 0,
+        embedding_store: EmbeddingStore | None = None,
+    ) -> tuple[list[float], list[int]] | None:
+        """Retrieve images similar to an indexed image.
 
-            distances, indices = index.search(query_features, top_k)
+        The stored vector of the image is the query, so no model runs. It
+        is read from the full precision ``embedding_store`` when loaded and
+        reconstructed from the index otherwise. The image itself is left
+        out of the results.
 
-            return distances[0], indices[0]
+        Args:
+        ----
+            index: FAISS index for similarity search
+            image_id: Id of the image to find similar images to
+            top_k: Number of similar images to retrieve
+            allowed_ids: If given, only these ids are considered
+            rerank_candidates: Number of candidates to re-rank, 0 to return
+                the index ranking as is
+            embedding_store: Full precision vectors to read the query from
+                and re-rank against
 
+        Returns:
+        -------
+            Tuple of similarity scores and indices, best match first, or
+            None if no vector is stored for the image
+        """
+        try:
+            query_features = self._image_vector(
+                index, image_id, embedding_store
+            )
+            if query_features is None:
+                return None
+
+            # One more result than asked for, as the image finds itself
+            distances, indices = self._search_vector(
+                index,
+                query_features,
+                top_k + 1,
+                allowed_ids,
+                rerank_candidates,
+                embedding_store,
+            )
+            other = indices != image_id
+            return distances[other][:top_k], indices[other][:top_k]
         except Exception as e:
-            logger.error(f"Error in retrieve_similar_images: {e}")
+            logger.error(f"Error in similar image search: {e}")
+            raise
+
+    def _search_vector(
+        self,
+        index,
+        query_features: np.ndarray,
+        top_k: int,
+        allowed_ids: np.ndarray | None,
+        rerank_candidates: int,
+        embedding_store: EmbeddingStore | None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        rerank = embedding_store is not None and rerank_candidates > 0
+        distances, indices = index.search(
+            query_features,
+            max(rerank_candidates, top_k) if rerank else top_k,
+            params=self._search_params(index, allowed_ids),
+        )
+
+        # FAISS pads with -1 when fewer than top_k vectors match
+        found = indices[0] >= 0
+        distances, indices = distances[0][found], indices[0][found]
+        if not rerank:
+            return distances, indices
+
+        distances, indices = embedding_store.rerank(
+            query_features[0],
+            indices,
+        )
+        logger.info(
+            "Re-ranked %d candidates with exact scores",
+            len(indices),
+        )
+        return distances[:top_k], indices[:top_k]
+
+    def range_search(
+        self,
+        index,
+        query: str,
+        min_score: float,
+        max_results: int,
+        allowed_ids: np.ndarray | None = None,
+    ) -> tuple[list[float], list[int]]:
+        """Retrieve all images scoring above a threshold for a text query.
+
+        Args:
+        ----
+            index: FAISS index for similarity search
+            query: Text query to search for
+            min_score: Only images with a similarity above this are returned
+            max_results: Hard cap on the number of images returned
+            allowed_ids: If given, only these ids are considered
+
+        Returns:
+        -------
+            Tuple of similarity scores and indices, best match first
+        """
+        try:
+            query_features = self._embed_query(query)
+
+            if allowed_ids is not None and len(allowed_ids) == 0:
+                return [], []
+
+            _, distances, indices = index.range_search(
+                query_features,
+                min_score,
+                params=self._search_params(index, allowed_ids),
+            )
+
+            # Range search results are unordered, keep the best max_results
+            if len(indices) > max_results:
+                best = np.argpartition(-distances, max_results - 1)
+                best = best[:max_results]
+                distances, indices = distances[best], indices[best]
+            order = np.argsort(-distances, kind="stable")
+            logger.info(
+                "Range search above %.3f matched %d images",
+                min_score,
+                len(order),
+            )
+            return distances[order], indices[order]
+
+        except Exception as e:
+            logger.error(f"Error in range search: {e}")
             raise
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        query_embeddings = self.query_processor.get_text_embedding(query)
+        query_features = np.array(
+            query_embeddings,
+            dtype=np.float32,
+        ).reshape(1, -1)
+        # Indexed vectors have unit length, so scores are cosine similarities
+        faiss.normalize_L2(query_features)
+        return query_features
+
+    @staticmethod
+    def _image_vector(
+        index,
+        image_id: int,
+        embedding_store: EmbeddingStore | None,
+    ) -> np.ndarray | None:
+        """Stored vector of an image as a normalized query, if it has one."""
+        if isinstance(index, OnlineIndex) and not index.contains(image_id):
+            # Deleted images keep their vectors in the embedding matrix
+            return None
+        vector = None
+        if embedding_store is not None:
+            vector = embedding_store.vector(image_id)
+        if vector is None:
+            try:
+                # Needs an IndexIDMap2, and is lossy for compressed indexes
+                vector = index.reconstruct(int(image_id))
+            except RuntimeError:
+                return None
+        query_features = np.array(vector, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(query_features)
+        return query_features
+
+    def _search_params(
+        self,
+        index,
+        allowed_ids: np.ndarray | None,
+    ) -> faiss.SearchParameters | None:
+        """Build search parameters restricting FAISS to ``allowed_ids``.
+
+        IVF indexes need IVF parameters, which also carry the ``nprobe`` of
+        the search settings, or else the one the index was saved with.
+        """
+        sel = None
+        if allowed_ids is not None:
+            sel = faiss.IDSelectorBatch(allowed_ids)
+        nprobe = self.settings.nprobe
+        if nprobe is None and sel is not None:
+            nprobe = _ivf_nprobe(index)
+        if nprobe is not None:
+            return faiss.SearchParametersIVF(sel=sel, nprobe=nprobe)
+        if sel is None:
+            return None
+        return faiss.SearchParameters(sel=sel)
+
+
+def _ivf_nprobe(index) -> int | None:
+    """``nprobe`` an IVF index was saved with, None for other indexes."""
+    # The online and sharded indexes wrap indexes saved by the pipeline
+    if isinstance(index, OnlineIndex):
+        return _ivf_nprobe(index.main)
+    if isinstance(index, ShardedIndex):
+        return _ivf_nprobe(index.shards[0])
+    try:
+        return faiss.extract_index_ivf(index).nprobe
+    except RuntimeError:
+        return None
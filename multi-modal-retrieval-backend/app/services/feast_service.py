@@ -1,5 +1,6 @@
 from typing import Any
 
+import pandas as pd
 from feast import FeatureStore
 
 from app.config.settings import get_feature_store_settings
@@ -26,3 +27,12 @@ class FeastService:
         except Exception as e:
             logger.error(f"Error retrieving features: {e}")
             raise
+
+    def write_online_features(self, features: pd.DataFrame) -> None:
+        """Write the features of ingested images to the online store."""
+        try:
+            self.store.write_to_online_store("image_features", df=features)
+            logger.info("Wrote online features of %d images", len(features))
+        except Exception as e:
+            logger.error(f"Error writing features: {e}")
+            raise
@@ -45,6 +45,7 @@ class ImageService:
         self._initialized = True
 
     def generate_caption(self, images: list[Image.Image]) -> list[str]:
+        # Errors reach the caller, which knows which images were captioned
         try:
             pixel_values = self.feature_extractor(
                 images=images,
@@ -64,8 +65,6 @@ class ImageService:
             )
             return [caption.strip() for caption in image_captions]
 
-        except Exception as e:
-            return [f"Error generating caption: {e!s}"]
         finally:
             # Clean up any CUDA memory
             if torch.cuda.is_available():
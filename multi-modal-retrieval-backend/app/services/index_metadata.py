@@ -0,0 +1,106 @@
+import hashlib
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+@dataclass(frozen=True)
+class IndexMetadata:
+    """Description of a FAISS index, read from the sidecar the pipeline
+    writes next to it, so the index can be checked without loading it.
+    """
+
+    dimension: int
+    ntotal: int
+    index_type: str
+    metric: str
+    checksum: str
+    search_params: dict = field(default_factory=dict)
+    source_data_version: str | None = None
+
+    @staticmethod
+    def path_for(index_path: Path) -> Path:
+        """Path of the sidecar of an index file."""
+        return index_path.with_name(f"{index_path.stem}.meta.json")
+
+    @classmethod
+    def from_file(cls, path: Path) -> "IndexMetadata":
+        """Load a metadata sidecar written by the pipeline."""
+        with path.open(encoding="utf-8") as f:
+            metadata = json.load(f)
+        return cls(
+            dimension=metadata["dimension"],
+            ntotal=metadata["ntotal"],
+            index_type=metadata["index_type"],
+            metric=metadata["metric"],
+            checksum=metadata["checksum"],
+            search_params=metadata.get("search_params") or {},
+            source_data_version=metadata.get("source_data_version"),
+        )
+
+    @classmethod
+    def from_shards(cls, shards: list["IndexMetadata"]) -> "IndexMetadata":
+        """Describe index shards as the single index they make up.
+
+        The checksum is a digest of the checksums of the shards, so it
+        changes whenever one of them is rebuilt.
+        """
+        digest = hashlib.sha256()
+        for shard in shards:
+            digest.update(shard.checksum.encode())
+        first = shards[0]
+        versions = {shard.source_data_version for shard in shards}
+        return cls(
+            dimension=first.dimension,
+            ntotal=sum(shard.ntotal for shard in shards),
+            index_type=f"{len(shards)} x {first.index_type}",
+            metric=first.metric,
+            checksum=f"sha256:{digest.hexdigest()}",
+            search_params=first.search_params,
+            # Shards saved by different runs disagree on the version
+            source_data_version=(
+                first.source_data_version if len(versions) == 1 else None
+            ),
+        )
+
+    def compatibility_errors(self, dimension: int, metric: str) -> list[str]:
+        """List why the index cannot serve queries of the given model.
+
+        Args:
+        ----
+            dimension: Dimension of the query embeddings
+            metric: Similarity metric the query embeddings are meant for
+
+        Returns:
+        -------
+            Reasons the index is incompatible, empty if it is compatible
+        """
+        errors = []
+        if self.dimension != dimension:
+            errors.append(
+                f"index dimension {self.dimension} does not match the "
+                f"query embedding dimension {dimension}",
+            )
+        if self.metric != metric:
+            errors.append(
+                f"index metric '{self.metric}' does not match '{metric}'",
+            )
+        return errors
+
+
+def shard_paths(shards_path: Path) -> list[Path]:
+    """Index shards saved by the pipeline, in shard order."""
+    return sorted(shards_path.glob("shard-*.idx"))
+
+
+def resolve_index_path(index_path: Path) -> Path:
+    """Follow the ``latest`` pointer of a versioned index, if there is one.
+
+    Versioned indexes are saved as ``<version>/<name>`` next to a
+    ``<name>.latest`` file holding the newest version.
+    """
+    latest = index_path.with_name(f"{index_path.name}.latest")
+    if latest.exists():
+        version = latest.read_text(encoding="utf-8").strip()
+        return index_path.parent / version / index_path.name
+    return index_path
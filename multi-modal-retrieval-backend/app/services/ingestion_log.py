@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app.core.logging_config import logger
+
+
+class IngestionLog:
+    """Images added and deleted through the API, kept on disk.
+
+    The backend never rewrites the files of the pipeline. Every ingested
+    batch is written as ``batch-<number>.pq`` with the ids, tags, bytes and
+    embeddings of its images, and ``state.json`` holds the next free id and
+    the ids deleted since. Replaying the log over the pipeline index on
+    startup restores the online changes after a restart, or after the
+    pipeline rebuilt the index. ``compact`` merges the batches into one
+    without the images deleted since.
+
+    Ingested images are numbered from ``first_id``, above the ids the
+    pipeline assigns, so they never collide.
+    """
+
+    def __init__(self, path: Path, first_id: int) -> None:
+        self.path = path
+        self.first_id = first_id
+        self._lock = threading.Lock()
+        self.path.mkdir(parents=True, exist_ok=True)
+        state_path = self.path / "state.json"
+        state = {}
+        if state_path.exists():
+            with state_path.open(encoding="utf-8") as f:
+                state = json.load(f)
+        self._next_id = max(state.get("next_id", first_id), first_id)
+        self._deleted_ids = set(state.get("deleted_ids", []))
+
+    @property
+    def deleted_ids(self) -> list[int]:
+        return sorted(self._deleted_ids)
+
+    def allocate_ids(self, count: int) -> np.ndarray:
+        """Reserve ids for new images."""
+        with self._lock:
+            ids = np.arange(self._next_id, self._next_id + count)
+            self._next_id += count
+            self._write_state()
+        return ids
+
+    def append(self, images: pd.DataFrame) -> None:
+        """Record a batch of ingested images.
+
+        Args:
+        ----
+            images: DataFrame with 'image_id', 'image_tag', 'image_data'
+                and 'embedding' columns
+        """
+        with self._lock:
+            number = max(self._batch_numbers(), default=0) + 1
+            _write_atomic(self.path / f"batch-{number:06d}.pq", images)
+
+    def delete(self, ids: list[int]) -> None:
+        """Record that images were deleted."""
+        with self._lock:
+            self._deleted_ids.update(int(image_id) for image_id in ids)
+            self._write_state()
+
+    def replay(self) -> Iterator[pd.DataFrame]:
+        """Read back the recorded batches without the deleted images."""
+        for path in self._batch_paths():
+            images = pd.read_parquet(path)
+            yield images[~images["image_id"].isin(self._deleted_ids)]
+
+    def compact(self) -> None:
+        """Merge the batches into one, dropping the deleted images.
+
+        Deletions of pipeline images are kept, they apply again whenever
+        the pipeline index is loaded.
+        """
+        with self._lock:
+            paths = self._batch_paths()
+            if not paths:
+                return
+            images = pd.concat(
+                [pd.read_parquet(path) for path in paths],
+                ignore_index=True,
+            )
+            images = images[~images["image_id"].isin(self._deleted_ids)]
+            number = int(paths[-1].stem.split("-")[1])
+            _write_atomic(self.path / f"batch-{number + 1:06d}.pq", images)
+            for path in paths:
+                path.unlink()
+
+            self._deleted_ids = {
+                image_id
+                for image_id in self._deleted_ids
+                if image_id < self.first_id
+            }
+            self._write_state()
+            logger.info(
+                "Compacted %d ingestion batches into %d images",
+                len(paths),
+                len(images),
+            )
+
+    def _batch_paths(self) -> list[Path]:
+        return sorted(self.path.glob("batch-*.pq"))
+
+    def _batch_numbers(self) -> Iterator[int]:
+        for path in self._batch_paths():
+            yield int(path.stem.split("-")[1])
+
+    def _write_state(self) -> None:
+        state_path = self.path / "state.json"
+        temporary = state_path.with_suffix(".tmp")
+        with temporary.open("w", encoding="utf-8") as f:
+            json.dump(
+                {"next_id": self._next_id, "deleted_ids": self.deleted_ids},
+                f,
+            )
+        os.replace(temporary, state_path)
+
+
+def _write_atomic(path: Path, images: pd.DataFrame) -> None:
+    # A batch is either complete or absent, never half written
+    temporary = path.with_suffix(".tmp")
+    images.to_parquet(temporary, index=False)
+    os.replace(temporary, path)
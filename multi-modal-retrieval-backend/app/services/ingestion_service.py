@@ -0,0 +1,308 @@
+import asyncio
+import base64
+import binascii
+from datetime import datetime
+from io import BytesIO
+
+import faiss
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from PIL import Image, UnidentifiedImageError
+
+from app.config.settings import get_ingestion_settings
+from app.core.logging_config import logger
+from app.core.query_processor import QueryProcessor
+from app.schemas.ingestion import ImageUpload, IngestResponse
+from app.services.embedding_store import EmbeddingStore
+from app.services.feast_service import FeastService
+from app.services.image_service import ImageService
+from app.services.ingestion_log import IngestionLog
+from app.services.lexical_index import LexicalIndex
+from app.services.online_index import OnlineIndex
+from app.services.tag_index import TagIndex
+
+
+def _decode_image_data(image_data: str) -> bytes:
+    """Decode base64 image bytes, with or without a data URL prefix."""
+    if image_data.startswith("data:"):
+        image_data = image_data.partition(",")[2]
+    return base64.b64decode(image_data, validate=True)
+
+
+def _open_images(image_bytes: list[bytes]) -> list[Image.Image]:
+    return [Image.open(BytesIO(data)).convert("RGB") for data in image_bytes]
+
+
+def _lexical_texts(tags: list[str], captions: list[str | None]) -> list[str]:
+    # Indexed like the pipeline indexes tags and captions
+    return [
+        f"{tag} {caption or ''}"
+        for tag, caption in zip(tags, captions, strict=True)
+    ]
+
+
+class IngestionService:
+    """Service adding and deleting images while searches are served.
+
+    Added images are embedded with the CLIP model in batches, their
+    features are written to the online store and they are recorded in the
+    ingestion log before they become searchable in the delta of the
+    ``OnlineIndex``. With a lexical index they are captioned and added to
+    it, so hybrid search finds them by tag and caption. Deleted images are
+    recorded and tombstoned. A background task compacts the index and the
+    log periodically.
+    """
+
+    def __init__(self) -> None:
+        """Initialize IngestionService with required dependencies."""
+        self.query_processor = QueryProcessor()
+        self.feast_service = FeastService()
+        self.image_service = ImageService()
+        self.settings = get_ingestion_settings()
+
+    async def add_images(
+        self,
+        uploads: list[ImageUpload],
+        faiss_index: OnlineIndex | None,
+        ingestion_log: IngestionLog | None,
+        tag_index: TagIndex | None = None,
+        embedding_store: EmbeddingStore | None = None,
+        lexical_index: LexicalIndex | None = None,
+    ) -> IngestResponse:
+        """Embed new images and make them searchable.
+
+        Args:
+        ----
+            uploads (List[ImageUpload]): Base64 encoded images and tags.
+            faiss_index (OnlineIndex): Index the images are added to.
+            ingestion_log (IngestionLog): Log the images are recorded in.
+            tag_index (TagIndex, optional): Tag index to add the tags to.
+            embedding_store (EmbeddingStore, optional): Store to keep the
+                vectors in for re-ranking.
+            lexical_index (LexicalIndex, optional): BM25 index to add the
+                tags and captions to.
+
+        Returns:
+        -------
+            IngestResponse: Ids given to the images, in upload order.
+
+        Raises:
+        ------
+            HTTPException: If ingestion is not enabled, if there are no or
+                too many images, or if an image cannot be decoded.
+        """
+        self._check_available(faiss_index, ingestion_log)
+        if not uploads:
+            raise HTTPException(status_code=400, detail="No images to ingest")
+        if len(uploads) > self.settings.max_images:
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    f"At most {self.settings.max_images} images can be "
+                    "ingested at once"
+                ),
+            )
+
+        try:
+            image_bytes = [
+                _decode_image_data(upload.image_data) for upload in uploads
+            ]
+            images = await asyncio.to_thread(_open_images, image_bytes)
+            vectors = await asyncio.to_thread(self._embed, images)
+        except (binascii.Error, UnidentifiedImageError, OSError) as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Image could not be decoded: {e}",
+            ) from e
+
+        captions = [None] * len(images)
+        if lexical_index is not None:
+            captions = await asyncio.to_thread(self._caption, images)
+
+        ids = ingestion_log.allocate_ids(len(uploads))
+        tags = [upload.image_tag for upload in uploads]
+        features = pd.DataFrame(
+            {
+                "image_id": ids,
+                "image_data": image_bytes,
+                "embedding": list(vectors),
+                "image_tag": tags,
+            },
+        )
+        # Features are stored and the images logged before they can be found
+        await asyncio.to_thread(
+            self.feast_service.write_online_features,
+            features.assign(event_timestamp=datetime.now()),
+        )
+        await asyncio.to_thread(
+            ingestion_log.append,
+            features.assign(caption=captions),
+        )
+        if embedding_store is not None:
+            embedding_store.add(ids, vectors)
+        await asyncio.to_thread(faiss_index.add, ids, vectors)
+        if tag_index is not None:
+            tag_index.add(ids, tags)
+        if lexical_index is not None:
+            lexical_index.add(ids, _lexical_texts(tags, captions))
+
+        logger.info(
+            "Ingested %d images, %d waiting for compaction",
+            len(ids),
+            faiss_index.delta_size,
+        )
+        return IngestResponse(image_ids=ids.tolist())
+
+    async def delete_image(
+        self,
+        image_id: int,
+        faiss_index: OnlineIndex | None,
+        ingestion_log: IngestionLog | None,
+        embedding_store: EmbeddingStore | None = None,
+        lexical_index: LexicalIndex | None = None,
+    ) -> None:
+        """Stop an image from being found by searches.
+
+        Args:
+        ----
+            image_id (int): Id of the image to delete.
+            faiss_index (OnlineIndex): Index the image is removed from.
+            ingestion_log (IngestionLog): Log the deletion is recorded in.
+            embedding_store (EmbeddingStore, optional): Store to drop the
+                vector of an ingested image from.
+            lexical_index (LexicalIndex, optional): BM25 index the image
+                is no longer found in.
+
+        Raises:
+        ------
+            HTTPException: If ingestion is not enabled or the image is not
+                in the index.
+        """
+        self._check_available(faiss_index, ingestion_log)
+        if not await asyncio.to_thread(faiss_index.contains, image_id):
+            raise HTTPException(
+                status_code=404,
+                detail=f"Image {image_id} is not in the index",
+            )
+
+        await asyncio.to_thread(ingestion_log.delete, [image_id])
+        await asyncio.to_thread(faiss_index.remove, [image_id])
+        if embedding_store is not None:
+            embedding_store.remove([image_id])
+        if lexical_index is not None:
+            lexical_index.remove([image_id])
+        logger.info("Deleted image %d", image_id)
+
+    def replay(
+        self,
+        faiss_index: OnlineIndex,
+        ingestion_log: IngestionLog,
+        tag_index: TagIndex | None = None,
+        embedding_store: EmbeddingStore | None = None,
+        lexical_index: LexicalIndex | None = None,
+    ) -> None:
+        """Apply the ingestion log to the index loaded from the pipeline.
+
+        The features of the logged images are written to the online store
+        again, in case the store was recreated since they were ingested.
+        Images logged without a caption are found by their tag alone.
+        """
+        added = 0
+        for images in ingestion_log.replay():
+            if not len(images):
+                continue
+            ids = images["image_id"].to_numpy(dtype=np.int64)
+            vectors = np.stack(images["embedding"]).astype(np.float32)
+            captions = images.get("caption", pd.Series([None] * len(images)))
+            self.feast_service.write_online_features(
+                images.drop(columns="caption", errors="ignore").assign(
+                    event_timestamp=datetime.now(),
+                ),
+            )
+            faiss_index.add(ids, vectors)
+            if embedding_store is not None:
+                embedding_store.add(ids, vectors)
+            tags = images["image_tag"].tolist()
+            if tag_index is not None:
+                tag_index.add(ids, tags)
+            if lexical_index is not None:
+                lexical_index.add(
+                    ids,
+                    _lexical_texts(tags, captions.tolist()),
+                )
+            added += len(ids)
+
+        faiss_index.remove(ingestion_log.deleted_ids)
+        if lexical_index is not None:
+            lexical_index.remove(ingestion_log.deleted_ids)
+        _, removed = faiss_index.compact()
+        logger.info(
+            "Replayed %d ingested and %d deleted images",
+            added,
+            removed,
+        )
+
+    async def compact_periodically(
+        self,
+        faiss_index: OnlineIndex,
+        ingestion_log: IngestionLog,
+    ) -> None:
+        """Merge ingested and deleted images into the main index.
+
+        Runs until cancelled, compacting the index and the log every
+        ``compaction_interval_seconds`` when images changed since.
+        """
+        while True:
+            await asyncio.sleep(self.settings.compaction_interval_seconds)
+            if not (faiss_index.delta_size or faiss_index.tombstones):
+                continue
+            try:
+                added, removed = await asyncio.to_thread(faiss_index.compact)
+                await asyncio.to_thread(ingestion_log.compact)
+                logger.info(
+                    "Compacted the index: %d images added, %d removed",
+                    added,
+                    removed,
+                )
+            except Exception as e:
+                logger.error(f"Error compacting the index: {e}")
+
+    def _embed(self, images: list[Image.Image]) -> np.ndarray:
+        vectors = self.query_processor.get_image_embeddings(
+            images,
+            batch_size=self.settings.batch_size,
+        )
+        # Indexed vectors have unit length, so scores are cosine similarities
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def _caption(self, images: list[Image.Image]) -> list[str | None]:
+        # If the batch fails, an image that cannot be captioned only loses
+        # its own caption and is still found by its tag
+        try:
+            return self.image_service.generate_caption(images)
+        except Exception as e:
+            logger.warning(f"Error captioning {len(images)} images: {e}")
+        if len(images) == 1:
+            return [None]
+
+        captions = []
+        for image in images:
+            try:
+                captions.extend(self.image_service.generate_caption([image]))
+            except Exception as e:
+                logger.warning(f"Error captioning an ingested image: {e}")
+                captions.append(None)
+        return captions
+
+    @staticmethod
+    def _check_available(
+        faiss_index: OnlineIndex | None,
+        ingestion_log: IngestionLog | None,
+    ) -> None:
+        if not isinstance(faiss_index, OnlineIndex) or ingestion_log is None:
+            raise HTTPException(
+                status_code=400,
+                detail="Online ingestion is not available",
+            )
@@ -0,0 +1,143 @@
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from app.core.logging_config import logger
+from app.core.read_write_lock import ReadWriteLock
+
+
+class LexicalIndex:
+    """BM25 inverted index over image tags and captions built by the pipeline.
+
+    The pipeline stores the BM25 weight of every term in every image, so a
+    query is scored by summing the weights of its terms. Images ingested
+    through the API are weighed with the BM25 parameters and corpus
+    statistics the pipeline saved, and deleted images are filtered out.
+    Searches hold a shared lock, changes an exclusive one.
+    """
+
+    def __init__(self, lexical_index: dict) -> None:
+        self._token_pattern = re.compile(lexical_index["token_pattern"])
+        self._postings = {
+            term: (
+                np.asarray(posting["ids"], dtype=np.int64),
+                np.asarray(posting["weights"], dtype=np.float32),
+            )
+            for term, posting in lexical_index["terms"].items()
+        }
+        self._k1 = lexical_index.get("k1", 1.2)
+        self._b = lexical_index.get("b", 0.75)
+        self._n_docs = lexical_index.get("n_docs")
+        self._avgdl = lexical_index.get("avgdl")
+        if self._n_docs is None or self._avgdl is None:
+            # Saved before the statistics were, estimated from the postings
+            self._n_docs, self._avgdl = self._estimate_statistics()
+        self._removed = np.empty(0, dtype=np.int64)
+        self._lock = ReadWriteLock()
+
+    @classmethod
+    def from_file(cls, path: Path) -> "LexicalIndex":
+        """Load the lexical index JSON written by the pipeline."""
+        with path.open(encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def __len__(self) -> int:
+        with self._lock.read():
+            return len(self._postings)
+
+    def add(self, ids: np.ndarray, texts: list[str]) -> None:
+        """Add the tags and captions of images ingested after the build.
+
+        The weights of the other images are not recomputed, so they drift
+        from exact BM25 as images are added, until the pipeline runs again.
+
+        Args:
+        ----
+            ids: Ids of the ingested images
+            texts: Tag and caption of every image
+        """
+        with self._lock.write():
+            for image_id, text in zip(ids, texts, strict=True):
+                counts = Counter(self._token_pattern.findall(text.lower()))
+                length = sum(counts.values())
+                self._n_docs += 1
+                self._avgdl += (length - self._avgdl) / self._n_docs
+                for term, tf in counts.items():
+                    term_ids, weights = self._postings.get(
+                        term,
+                        (np.empty(0, np.int64), np.empty(0, np.float32)),
+                    )
+                    df = len(term_ids) + 1
+                    idf = math.log(1 + (self._n_docs - df + 0.5) / (df + 0.5))
+                    norm = 1 - self._b + self._b * length / self._avgdl
+                    weight = idf * tf * (self._k1 + 1) / (tf + self._k1 * norm)
+                    self._postings[term] = (
+                        np.append(term_ids, np.int64(image_id)),
+                        np.append(weights, np.float32(weight)),
+                    )
+
+    def remove(self, ids: np.ndarray) -> None:
+        """Stop deleted images from being found."""
+        with self._lock.write():
+            self._removed = np.union1d(
+                self._removed,
+                np.asarray(ids, dtype=np.int64),
+            )
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        allowed_ids: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Rank images by BM25 score for a text query.
+
+        Args:
+        ----
+            query: Text query to search for
+            top_k: Number of images to return
+            allowed_ids: If given, only these ids are considered
+
+        Returns:
+        -------
+            Tuple of BM25 scores and image ids, best match first
+        """
+        terms = set(self._token_pattern.findall(query.lower()))
+        with self._lock.read():
+            postings = [
+                self._postings[term] for term in terms & self._postings.keys()
+            ]
+            removed = self._removed
+        if not postings:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        ids = np.concatenate([posting[0] for posting in postings])
+        weights = np.concatenate([posting[1] for posting in postings])
+        if len(removed):
+            keep = ~np.isin(ids, removed)
+            ids, weights = ids[keep], weights[keep]
+        if allowed_ids is not None:
+            keep = np.isin(ids, allowed_ids)
+            ids, weights = ids[keep], weights[keep]
+
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype(np.float32)
+
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            unique_ids, scores = unique_ids[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        logger.info("Lexical search matched %d images", len(unique_ids))
+        return scores[order], unique_ids[order]
+
+    def _estimate_statistics(self) -> tuple[int, float]:
+        # Distinct terms per image stand in for the document length
+        if not self._postings:
+            return 0, 0.0
+        ids = np.concatenate([ids for ids, _ in self._postings.values()])
+        n_docs = len(np.unique(ids))
+        return n_docs, len(ids) / n_docs
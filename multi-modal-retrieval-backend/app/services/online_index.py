@@ -0,0 +1,274 @@
+import faiss
+import numpy as np
+
+from app.core.read_write_lock import ReadWriteLock
+from app.services.search_params import with_selector
+from app.services.sharded_index import ShardedIndex
+
+
+class OnlineIndex:
+    """The pipeline index together with the images ingested through the API.
+
+    New images are added to a small exact delta index that is searched
+    together with the main one, so adding them never blocks on the main
+    index. The delta applies the transforms of the main index, such as a
+    PCA projection, so both score vectors in the same space. Deleted images
+    of the main index are tombstoned and filtered out of its results
+    through an ID selector, deleted images of the delta are removed from it
+    directly. ``compact`` later merges the delta into the main index and
+    removes the tombstoned images from it.
+
+    Searches hold a shared lock, ingestion and compaction an exclusive one.
+    """
+
+    def __init__(self, main) -> None:
+        self.main = main
+        # Sorted ids of the main index, None when it does not keep them
+        self._main_ids = _stored_ids(main)
+        self._delta = self._empty_delta()
+        self._deleted: set[int] = set()
+        self._exclusion = None
+        self._lock = ReadWriteLock()
+
+    @property
+    def d(self) -> int:
+        return self.main.d
+
+    @property
+    def ntotal(self) -> int:
+        return self.main.ntotal + self._delta.ntotal - len(self._deleted)
+
+    @property
+    def metric_type(self) -> int:
+        return self.main.metric_type
+
+    @property
+    def delta_size(self) -> int:
+        """Images added since the last compaction."""
+        return self._delta.ntotal
+
+    @property
+    def tombstones(self) -> int:
+        """Images deleted from the main index since the last compaction."""
+        return len(self._deleted)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Make new images searchable by adding them to the delta index."""
+        with self._lock.write():
+            self._delta.add_with_ids(
+                np.ascontiguousarray(vectors, dtype=np.float32),
+                np.asarray(ids, dtype=np.int64),
+            )
+
+    def remove(self, ids: np.ndarray) -> int:
+        """Delete images from the delta and tombstone those of the index.
+
+        Returns
+        -------
+            Number of images that were searchable and no longer are
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock.write():
+            removed = self._delta.remove_ids(ids)
+            tombstoned = [
+                int(image_id)
+                for image_id in ids
+                if image_id not in self._deleted
+                and self._in_main(int(image_id))
+            ]
+            if tombstoned:
+                self._deleted.update(tombstoned)
+                self._exclusion = self._excluding(self._deleted)
+            return removed + len(tombstoned)
+
+    def contains(self, key: int) -> bool:
+        """Whether an image is searchable."""
+        with self._lock.read():
+            if _contains(self._delta, key):
+                return True
+            return key not in self._deleted and self._in_main(key)
+
+    def reconstruct(self, key: int) -> np.ndarray:
+        with self._lock.read():
+            if _contains(self._delta, key):
+                return self._delta.reconstruct(key)
+            if key in self._deleted:
+                msg = f"Image {key} was deleted"
+                raise RuntimeError(msg)
+            return self.main.reconstruct(key)
+
+    def search(
+        self,
+        x: np.ndarray,
+        k: int,
+        params: faiss.SearchParameters | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Search both indexes and keep the best ``k`` results of all."""
+        heap = faiss.ResultHeap(
+            len(x),
+            k,
+            keep_max=self.metric_type == faiss.METRIC_INNER_PRODUCT,
+        )
+        with self._lock.read():
+            main_params = self._main_params(params)
+            heap.add_result(*self.main.search(x, k, params=main_params))
+            if self._delta.ntotal:
+                heap.add_result(*self._delta.search(x, k, params=params))
+        heap.finalize()
+        return heap.D, heap.I
+
+    def range_search(
+        self,
+        x: np.ndarray,
+        radius: float,
+        params: faiss.SearchParameters | None = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Range search both indexes and concatenate results per query."""
+        with self._lock.read():
+            main_params = self._main_params(params)
+            results = [self.main.range_search(x, radius, params=main_params)]
+            if self._delta.ntotal:
+                results.append(
+                    self._delta.range_search(x, radius, params=params),
+                )
+
+        lims = [0]
+        distances = []
+        labels = []
+        for query in range(len(x)):
+            found = 0
+            for result_lims, result_distances, result_labels in results:
+                start, end = result_lims[query], result_lims[query + 1]
+                distances.append(result_distances[start:end])
+                labels.append(result_labels[start:end])
+                found += end - start
+            lims.append(lims[-1] + found)
+        return (
+            np.asarray(lims, dtype=np.int64),
+            np.concatenate(distances),
+            np.concatenate(labels),
+        )
+
+    def compact(self) -> tuple[int, int]:
+        """Merge the delta into the main index and apply the tombstones.
+
+        Returns
+        -------
+            Number of images moved from the delta and removed from the
+            main index
+        """
+        with self._lock.write():
+            added = self._delta.ntotal
+            if added:
+                added_ids = faiss.vector_to_array(self._delta.id_map)
+                self.main.add_with_ids(
+                    self._delta.index.reconstruct_n(0, added),
+                    added_ids,
+                )
+                if self._main_ids is not None:
+                    self._main_ids = np.union1d(self._main_ids, added_ids)
+                self._delta = self._empty_delta()
+            removed = 0
+            if self._deleted:
+                deleted_ids = np.array(sorted(self._deleted), dtype=np.int64)
+                removed = self.main.remove_ids(deleted_ids)
+                if self._main_ids is not None:
+                    self._main_ids = np.setdiff1d(self._main_ids, deleted_ids)
+                self._deleted = set()
+                self._exclusion = None
+            return added, removed
+
+    def close(self) -> None:
+        """Stop the threads searching a sharded main index."""
+        close = getattr(self.main, "close", None)
+        if close is not None:
+            close()
+
+    def _in_main(self, key: int) -> bool:
+        if self._main_ids is None:
+            return _reconstructs(self.main, key)
+        position = np.searchsorted(self._main_ids, key)
+        return bool(
+            position < len(self._main_ids) and self._main_ids[position] == key,
+        )
+
+    def _empty_delta(self) -> faiss.IndexIDMap2:
+        pre_transform = _pre_transform(self.main)
+        if pre_transform is None:
+            return faiss.IndexIDMap2(
+                faiss.IndexFlat(self.main.d, self.main.metric_type),
+            )
+
+        empty = faiss.IndexPreTransform(
+            faiss.IndexFlat(pre_transform.index.d, self.main.metric_type),
+        )
+        for i in reversed(range(pre_transform.chain.size())):
+            empty.prepend_transform(pre_transform.chain.at(i))
+        # A copy owns its transforms, clone_index cannot copy all of them
+        return faiss.IndexIDMap2(
+            faiss.deserialize_index(faiss.serialize_index(empty)),
+        )
+
+    def _main_params(
+        self,
+        params: faiss.SearchParameters | None,
+    ) -> faiss.SearchParameters | None:
+        """Search parameters leaving the tombstoned images out."""
+        if self._exclusion is None:
+            return params
+        if params is None or params.sel is None:
+            return with_selector(params, self._exclusion[-1])
+        both = faiss.IDSelectorAnd(params.sel, self._exclusion[-1])
+        main_params = with_selector(params, both)
+        # The selectors must outlive the search that uses them
+        main_params.referenced_objects = [params.sel, both]
+        return main_params
+
+    @staticmethod
+    def _excluding(ids: set[int]) -> tuple[faiss.IDSelector, ...]:
+        batch = faiss.IDSelectorBatch(np.array(sorted(ids), dtype=np.int64))
+        return batch, faiss.IDSelectorNot(batch)
+
+
+def _contains(index: faiss.IndexIDMap, key: int) -> bool:
+    return bool((faiss.vector_to_array(index.id_map) == key).any())
+
+
+def _stored_ids(index) -> np.ndarray | None:
+    """Sorted ids of the vectors in an index that maps ids to vectors.
+
+    A plain ``IndexIDMap`` cannot reconstruct vectors, so its ids are read
+    from its id map instead of probing it with ``reconstruct``.
+    """
+    if isinstance(index, ShardedIndex):
+        shard_ids = [_stored_ids(shard) for shard in index.shards]
+        if any(ids is None for ids in shard_ids):
+            return None
+        return np.sort(np.concatenate(shard_ids))
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return np.sort(faiss.vector_to_array(index.id_map))
+    return None
+
+
+def _pre_transform(index) -> faiss.IndexPreTransform | None:
+    """Transforms applied to vectors before the index, if there are any.
+
+    The pipeline wraps them in an ``IndexIDMap2``, except for IVF indexes,
+    and every shard of a sharded index applies the same ones.
+    """
+    if isinstance(index, ShardedIndex):
+        index = index.shards[0]
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index if isinstance(index, faiss.IndexPreTransform) else None
+
+
+def _reconstructs(index, key: int) -> bool:
+    # Indexes without an id map, such as IVF indexes keeping a direct map
+    try:
+        index.reconstruct(key)
+    except RuntimeError:
+        return False
+    return True
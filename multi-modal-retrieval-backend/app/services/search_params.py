@@ -0,0 +1,19 @@
+import faiss
+
+
+def with_selector(
+    params: faiss.SearchParameters | None,
+    sel: faiss.IDSelector | None,
+) -> faiss.SearchParameters:
+    """Copy search parameters with another ID selector.
+
+    IVF parameters are copied as IVF parameters, an IVF index rejects any
+    other kind and would otherwise lose the ``nprobe`` asked for.
+    """
+    if isinstance(params, faiss.SearchParametersIVF):
+        return faiss.SearchParametersIVF(
+            sel=sel,
+            nprobe=params.nprobe,
+            max_codes=params.max_codes,
+        )
+    return faiss.SearchParameters(sel=sel)
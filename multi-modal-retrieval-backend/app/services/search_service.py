@@ -1,15 +1,29 @@
+import asyncio
 import base64
 from io import BytesIO
 from typing import Any
 
+import numpy as np
 from fastapi import HTTPException
 from PIL import Image
 
+from app.config.settings import get_search_settings
 from app.core.logging_config import logger
+from app.core.pagination import (
+    CandidateCache,
+    Candidates,
+    Cursor,
+    decode_cursor,
+    encode_cursor,
+)
+from app.core.single_flight import SingleFlight
 from app.schemas.search import SearchResponse, SearchResult
+from app.services.embedding_store import EmbeddingStore
 from app.services.faiss_service import FaissService
 from app.services.feast_service import FeastService
 from app.services.image_service import ImageService
+from app.services.lexical_index import LexicalIndex
+from app.services.tag_index import TagIndex
 
 
 def _base64_to_pil_image(image_bytes: bytes) -> Image.Image:
@@ -27,11 +41,43 @@ def _base64_to_pil_image(image_bytes: bytes) -> Image.Image:
     return Image.open(buffer)
 
 
+def _reciprocal_rank_fusion(
+    rankings: list[np.ndarray],
+    k: int,
+    limit: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Merge ranked id lists with reciprocal rank fusion.
+
+    Args
+    ----------
+        rankings (List[np.ndarray]): Image ids of each ranking, best first.
+        k (int): Smoothing constant damping the weight of top ranks.
+        limit (int): Number of fused results to keep.
+
+    Returns
+    -------
+        Tuple of fused scores and image ids, best match first.
+    """
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, image_id in enumerate(ranking, start=1):
+            image_id = int(image_id)
+            scores[image_id] = scores.get(image_id, 0.0) + 1.0 / (k + rank)
+
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    fused = fused[:limit]
+    return (
+        np.array([score for _, score in fused], dtype=np.float32),
+        np.array([image_id for image_id, _ in fused], dtype=np.int64),
+    )
+
+
 class SearchService:
     """Service for text and image-based search operations.
 
     This class integrates FAISS search, Feast storage, and image processing
-    capabilities.
+    capabilities. Concurrent identical searches, and concurrent caption
+    requests for the same image, share a single in-flight computation.
     """
 
     def __init__(self) -> None:
@@ -39,6 +85,13 @@ class SearchService:
         self.faiss_service = FaissService()
         self.feast_service = FeastService()
         self.image_service = ImageService()
+        self.settings = get_search_settings()
+        self.candidate_cache = CandidateCache(
+            max_size=self.settings.cursor_cache_size,
+            ttl_seconds=self.settings.cursor_ttl_seconds,
+        )
+        self._search_flight = SingleFlight("search")
+        self._caption_flight = SingleFlight("caption")
 
     async def search_by_text(
         self,
@@ -46,15 +99,66 @@ class SearchService:
         k: int,
         sort: bool,
         faiss_index: Any,
+        tags: list[str] | None = None,
+        tag_prefixes: list[str] | None = None,
+        tag_index: TagIndex | None = None,
+        cursor: str | None = None,
+        index_version: str | None = None,
+        min_score: float | None = None,
+        hybrid: bool = False,
+        lexical_index: LexicalIndex | None = None,
+        rerank_candidates: int | None = None,
+        embedding_store: EmbeddingStore | None = None,
     ) -> SearchResponse:
         """Perform a text-based search for similar images.
 
+        The first page ranks up to ``max_candidates`` images and caches the
+        ranking. The returned ``next_cursor`` lets later pages slice that
+        ranking without searching again, so only the next ``k`` images are
+        fetched and captioned.
+
+        With ``min_score`` the ranking holds every image scoring above it,
+        capped at ``max_range_results``, instead of a fixed number of
+        candidates.
+
+        With ``hybrid`` a BM25 search over image tags and captions runs in
+        parallel with the FAISS search and both rankings are merged with
+        reciprocal rank fusion. Result distances are then fused scores.
+        With ``min_score`` as well, the lexical ranking only reorders the
+        images scoring above the threshold, it adds none of its own.
+
+        With ``rerank_candidates``, or the configured default, the FAISS
+        search fetches that many candidates, or ``max_candidates`` if that
+        is more, and re-ranks them with exact scores against the full
+        precision ``embedding_store`` before the ranking is cut to
+        ``max_candidates``. It is capped at
+        ``max_rerank_candidates`` and does not apply to ``min_score``
+        searches.
+
         Args:
         ----
             query (str): The text query to search for.
             k (int): Number of results to return.
             sort (bool): Whether to sort results by similarity score.
             faiss_index (Any): The FAISS index to use for search.
+            tags (List[str], optional): Only return images with these tags.
+            tag_prefixes (List[str], optional): Only return images whose tag
+                starts with one of these prefixes.
+            tag_index (TagIndex, optional): Index resolving tags to image ids.
+            cursor (str, optional): Token from a previous page. When given,
+                the query and filters of that first page are used.
+            index_version (str, optional): Version of the loaded index that
+                cursors are tied to.
+            min_score (float, optional): Return only images whose similarity
+                is above this threshold.
+            hybrid (bool): Whether to fuse lexical and vector rankings.
+            lexical_index (LexicalIndex, optional): BM25 index used by hybrid
+                search.
+            rerank_candidates (int, optional): Candidates to re-rank with
+                exact scores, 0 to disable. Defaults to the configured
+                number.
+            embedding_store (EmbeddingStore, optional): Full precision
+                vectors used for re-ranking.
 
         Returns:
         -------
@@ -63,7 +167,9 @@ class SearchService:
 
         Raises:
         ------
-            HTTPException: If search index is not available.
+            HTTPException: If search index is not available, if filters,
+                hybrid search or re-ranking are requested without their
+                index, or if the cursor is invalid or expired.
             Exception: For other errors during search process.
         """
         logger.info(
@@ -77,26 +183,355 @@ class SearchService:
                 detail="Search index not available",
             )
 
-        try:
-            distances, indices = self.faiss_service.search(
-                faiss_index,
+        if cursor is not None:
+            return await self._search_flight.do(
+                ("page", cursor, k, sort),
+                lambda: self._next_page(cursor, k, sort, index_version),
+            )
+
+        if hybrid and lexical_index is None:
+            raise HTTPException(
+                status_code=400,
+                detail="Hybrid search is not available",
+            )
+
+        allowed_ids = self._allowed_ids(tags, tag_prefixes, tag_index)
+        rerank_candidates = self._rerank_candidates(
+            rerank_candidates,
+            embedding_store,
+        )
+        key = (
+            query,
+            k,
+            sort,
+            id(faiss_index),
+            tuple(tags or ()),
+            tuple(tag_prefixes or ()),
+            min_score,
+            hybrid,
+            rerank_candidates,
+        )
+        return await self._search_flight.do(
+            key,
+            lambda: self._run_text_search(
                 query,
                 k,
+                sort,
+                faiss_index,
+                allowed_ids,
+                index_version,
+                min_score,
+                lexical_index if hybrid else None,
+                rerank_candidates,
+                embedding_store,
+            ),
+        )
+
+    async def search_similar(
+        self,
+        image_id: int,
+        k: int,
+        sort: bool,
+        faiss_index: Any,
+        tags: list[str] | None = None,
+        tag_prefixes: list[str] | None = None,
+        tag_index: TagIndex | None = None,
+        cursor: str | None = None,
+        index_version: str | None = None,
+        rerank_candidates: int | None = None,
+        embedding_store: EmbeddingStore | None = None,
+    ) -> SearchResponse:
+        """Find images similar to an indexed image, without a model.
+
+        The stored vector of the image is searched instead of an encoded
+        query, read from the ``embedding_store`` or reconstructed from the
+        index. Ranking, filters, re-ranking and cursors work as they do for
+        ``search_by_text``.
+
+        Args:
+        ----
+            image_id (int): Id of the image to find similar images to.
+            k (int): Number of results to return.
+            sort (bool): Whether to sort results by similarity score.
+            faiss_index (Any): The FAISS index to use for search.
+            tags (List[str], optional): Only return images with these tags.
+            tag_prefixes (List[str], optional): Only return images whose tag
+                starts with one of these prefixes.
+            tag_index (TagIndex, optional): Index resolving tags to image ids.
+            cursor (str, optional): Token from a previous page.
+            index_version (str, optional): Version of the loaded index that
+                cursors are tied to.
+            rerank_candidates (int, optional): Candidates to re-rank with
+                exact scores, 0 to disable. Defaults to the configured
+                number.
+            embedding_store (EmbeddingStore, optional): Full precision
+                vectors read as the query and used for re-ranking.
+
+        Returns:
+        -------
+            SearchResponse: Object containing search results with images and
+                          metadata.
+
+        Raises:
+        ------
+            HTTPException: If search index is not available, if the image
+                has no stored vector, if filters or re-ranking are requested
+                without their index, or if the cursor is invalid or expired.
+        """
+        logger.info(
+            "Processing similar image request - Image: %d, k: %d",
+            image_id,
+            k,
+        )
+        if faiss_index is None:
+            raise HTTPException(
+                status_code=500,
+                detail="Search index not available",
             )
 
-            results = await self._process_search(
-                distances,
-                indices,
+        if cursor is not None:
+            return await self._search_flight.do(
+                ("page", cursor, k, sort),
+                lambda: self._next_page(cursor, k, sort, index_version),
             )
-            results = (
-                sorted(results, key=lambda x: x.distance) if sort else results
+
+        allowed_ids = self._allowed_ids(tags, tag_prefixes, tag_index)
+        rerank_candidates = self._rerank_candidates(
+            rerank_candidates,
+            embedding_store,
+        )
+        key = (
+            "similar",
+            image_id,
+            k,
+            sort,
+            id(faiss_index),
+            tuple(tags or ()),
+            tuple(tag_prefixes or ()),
+            rerank_candidates,
+        )
+        return await self._search_flight.do(
+            key,
+            lambda: self._run_similar_search(
+                image_id,
+                k,
+                sort,
+                faiss_index,
+                allowed_ids,
+                index_version,
+                rerank_candidates,
+                embedding_store,
+            ),
+        )
+
+    def _allowed_ids(
+        self,
+        tags: list[str] | None,
+        tag_prefixes: list[str] | None,
+        tag_index: TagIndex | None,
+    ) -> np.ndarray | None:
+        """Resolve tag filters to the ids a search is restricted to."""
+        if not (tags or tag_prefixes):
+            return None
+        if tag_index is None:
+            raise HTTPException(
+                status_code=400,
+                detail="Tag filters are not available",
             )
+        return tag_index.select_ids(tags, tag_prefixes)
 
-            return SearchResponse(results=results)
+    def _rerank_candidates(
+        self,
+        rerank_candidates: int | None,
+        embedding_store: EmbeddingStore | None,
+    ) -> int:
+        """Number of candidates a search re-ranks, within the limit."""
+        if rerank_candidates and embedding_store is None:
+            raise HTTPException(
+                status_code=400,
+                detail="Re-ranking is not available",
+            )
+        if rerank_candidates is None:
+            # The configured default applies only when vectors are loaded
+            rerank_candidates = (
+                self.settings.rerank_candidates if embedding_store else 0
+            )
+        return min(rerank_candidates, self.settings.max_rerank_candidates)
+
+    async def _run_text_search(
+        self,
+        query: str,
+        k: int,
+        sort: bool,
+        faiss_index: Any,
+        allowed_ids: np.ndarray | None = None,
+        index_version: str | None = None,
+        min_score: float | None = None,
+        lexical_index: LexicalIndex | None = None,
+        rerank_candidates: int = 0,
+        embedding_store: EmbeddingStore | None = None,
+    ) -> SearchResponse:
+        """Run the FAISS search and build the first page for a text query."""
+        try:
+            # Blocking work runs off the event loop so that identical
+            # requests arriving meanwhile can join this search
+            if min_score is None:
+                limit = max(k, self.settings.max_candidates)
+                vector_search = asyncio.to_thread(
+                    self.faiss_service.search,
+                    faiss_index,
+                    query,
+                    limit,
+                    allowed_ids,
+                    rerank_candidates,
+                    embedding_store,
+                )
+            else:
+                limit = self.settings.max_range_results
+                vector_search = asyncio.to_thread(
+                    self.faiss_service.range_search,
+                    faiss_index,
+                    query,
+                    min_score,
+                    limit,
+                    allowed_ids,
+                )
+
+            if lexical_index is None:
+                distances, indices = await vector_search
+            else:
+                (_, vector_ids), (_, lexical_ids) = await asyncio.gather(
+                    vector_search,
+                    asyncio.to_thread(
+                        lexical_index.search,
+                        query,
+                        limit,
+                        allowed_ids,
+                    ),
+                )
+                if min_score is not None:
+                    # Fused scores cannot be compared with the threshold
+                    lexical_ids = lexical_ids[np.isin(lexical_ids, vector_ids)]
+                distances, indices = _reciprocal_rank_fusion(
+                    [vector_ids, lexical_ids],
+                    self.settings.rrf_k,
+                    limit,
+                )
+            candidates = Candidates(
+                distances=np.asarray(distances),
+                indices=np.asarray(indices),
+                index_version=index_version or "",
+            )
+
+            candidates_id = None
+            if len(candidates) > k:
+                candidates_id = self.candidate_cache.put(candidates)
+            return await self._build_page(
+                candidates,
+                candidates_id,
+                0,
+                k,
+                sort,
+            )
         except Exception as e:
             logger.error("Error in text search: %s", e)
             raise
 
+    async def _run_similar_search(
+        self,
+        image_id: int,
+        k: int,
+        sort: bool,
+        faiss_index: Any,
+        allowed_ids: np.ndarray | None = None,
+        index_version: str | None = None,
+        rerank_candidates: int = 0,
+        embedding_store: EmbeddingStore | None = None,
+    ) -> SearchResponse:
+        """Run the FAISS search and build the first page for an image."""
+        found = await asyncio.to_thread(
+            self.faiss_service.search_similar,
+            faiss_index,
+            image_id,
+            max(k, self.settings.max_candidates),
+            allowed_ids,
+            rerank_candidates,
+            embedding_store,
+        )
+        if found is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Image {image_id} is not in the index",
+            )
+
+        distances, indices = found
+        candidates = Candidates(
+            distances=np.asarray(distances),
+            indices=np.asarray(indices),
+            index_version=index_version or "",
+        )
+        candidates_id = None
+        if len(candidates) > k:
+            candidates_id = self.candidate_cache.put(candidates)
+        return await self._build_page(candidates, candidates_id, 0, k, sort)
+
+    async def _next_page(
+        self,
+        token: str,
+        k: int,
+        sort: bool,
+        index_version: str | None,
+    ) -> SearchResponse:
+        """Build the page a cursor points to from the cached candidates."""
+        try:
+            cursor = decode_cursor(token)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+
+        if cursor.index_version != (index_version or ""):
+            raise HTTPException(
+                status_code=410,
+                detail="Cursor refers to a different index version",
+            )
+        candidates = self.candidate_cache.get(cursor.candidates_id)
+        if candidates is None:
+            raise HTTPException(status_code=410, detail="Cursor has expired")
+
+        return await self._build_page(
+            candidates,
+            cursor.candidates_id,
+            cursor.offset,
+            k,
+            sort,
+        )
+
+    async def _build_page(
+        self,
+        candidates: Candidates,
+        candidates_id: str | None,
+        offset: int,
+        k: int,
+        sort: bool,
+    ) -> SearchResponse:
+        """Fetch and caption one slice of a ranked candidate list."""
+        end = offset + k
+        results = await self._process_search(
+            candidates.distances[offset:end],
+            candidates.indices[offset:end],
+        )
+        results = sorted(results, key=lambda x: x.distance) if sort else results
+
+        next_cursor = None
+        if candidates_id is not None and end < len(candidates):
+            next_cursor = encode_cursor(
+                Cursor(
+                    candidates_id=candidates_id,
+                    offset=end,
+                    index_version=candidates.index_version,
+                ),
+            )
+        return SearchResponse(results=results, next_cursor=next_cursor)
+
     async def _process_search(
         self,
         distances: list[float],
@@ -118,6 +553,8 @@ class SearchService:
             List[SearchResult]: Results with image data, scores, and captions.
         """
         logger.info("Processing search results for %d images", len(indices))
+        if len(indices) == 0:
+            return []
         try:
             image_ids: list[str] = [str(idx) for idx in indices]
             features: dict[str, Any] = self.feast_service.get_online_features(
@@ -125,12 +562,15 @@ class SearchService:
             )
             results = []
 
-            images: list[Image.Image] = [
-                _base64_to_pil_image(image) for image in features["image_data"]
-            ]
-            captions = self.image_service.generate_caption(images)
+            images: dict[str, bytes] = dict(
+                zip(image_ids, features["image_data"], strict=False),
+            )
+            captions = await self._caption_flight.do_many(
+                image_ids,
+                lambda missing: self._generate_captions(missing, images),
+            )
 
-            for i, (distance, _idx, caption_idx) in enumerate(
+            for i, (distance, idx, caption_idx) in enumerate(
                 zip(distances, indices, captions, strict=False),
             ):
                 image_data = features["image_data"][i]
@@ -140,6 +580,7 @@ class SearchService:
 
                 results.append(
                     SearchResult(
+                        image_id=int(idx),
                         image_data=image_str,
                         distance=distance,
                         caption=caption_idx,
@@ -152,3 +593,58 @@ class SearchService:
             logger.error(f"Error processing search results: {e}")
             # Return empty results instead of raising to prevent crashes
             return []
+
+    async def _generate_captions(
+        self,
+        image_ids: list[str],
+        images: dict[str, bytes],
+    ) -> list[str | None]:
+        """Caption a batch of images in a worker thread.
+
+        If the batch fails, the images are captioned one at a time, so an
+        image that cannot be captioned only loses its own caption.
+
+        Args:
+        ----
+            image_ids (List[str]): Ids of the images to caption.
+            images (Dict[str, bytes]): Encoded image bytes keyed by image id.
+
+        Returns:
+        -------
+            List[Optional[str]]: One caption per image id, None for the
+                images that could not be captioned.
+        """
+        try:
+            return await self._caption_images(image_ids, images)
+        except Exception as e:
+            logger.warning(f"Error captioning {len(image_ids)} images: {e}")
+        if len(image_ids) == 1:
+            return [None]
+
+        captions = []
+        for image_id in image_ids:
+            try:
+                captions.extend(
+                    await self._caption_images([image_id], images),
+                )
+            except Exception as e:
+                logger.warning(f"Error captioning image {image_id}: {e}")
+                captions.append(None)
+        return captions
+
+    async def _caption_images(
+        self,
+        image_ids: list[str],
+        images: dict[str, bytes],
+    ) -> list[str]:
+        pil_images: list[Image.Image] = [
+            _base64_to_pil_image(images[image_id]) for image_id in image_ids
+        ]
+        captions = await asyncio.to_thread(
+            self.image_service.generate_caption,
+            pil_images,
+        )
+        if len(captions) != len(image_ids):
+            msg = f"Expected {len(image_ids)} captions, got {len(captions)}"
+            raise RuntimeError(msg)
+        return captions
@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from app.services.search_params import with_selector
+
+
+class ShardedIndex:
+    """FAISS index shards searched in parallel, with their results merged.
+
+    The pipeline splits the index into shards holding disjoint sets of
+    image ids. Every query is sent to all shards at once on a thread pool,
+    FAISS releases the GIL while it searches, so the shards are searched on
+    separate cores. Their top-k results are then merged into the overall
+    top-k. ID selectors are passed to every shard, so filtered searches
+    work as they do on a single index.
+    """
+
+    def __init__(
+        self,
+        shards: list[faiss.Index],
+        num_threads: int | None = None,
+    ) -> None:
+        self.shards = shards
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_threads or len(shards),
+            thread_name_prefix="faiss-shard",
+        )
+
+    @classmethod
+    def from_paths(
+        cls,
+        paths: list[Path],
+        num_threads: int | None = None,
+    ) -> "ShardedIndex":
+        """Read the index shards saved by the pipeline."""
+        return cls([faiss.read_index(str(path)) for path in paths], num_threads)
+
+    @property
+    def d(self) -> int:
+        return self.shards[0].d
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.ntotal for shard in self.shards)
+
+    @property
+    def metric_type(self) -> int:
+        return self.shards[0].metric_type
+
+    def add_with_ids(self, x: np.ndarray, ids: np.ndarray) -> None:
+        """Add vectors to the shards their ids belong to."""
+        ids = np.asarray(ids, dtype=np.int64)
+        shard_numbers = ids % len(self.shards)
+        for number in np.unique(shard_numbers):
+            rows = shard_numbers == number
+            self.shards[number].add_with_ids(
+                np.ascontiguousarray(x[rows]),
+                np.ascontiguousarray(ids[rows]),
+            )
+
+    def remove_ids(self, ids: np.ndarray) -> int:
+        ids = np.asarray(ids, dtype=np.int64)
+        shard_numbers = ids % len(self.shards)
+        return sum(
+            self.shards[number].remove_ids(ids[shard_numbers == number])
+            for number in np.unique(shard_numbers)
+        )
+
+    def reconstruct(self, key: int) -> np.ndarray:
+        """Vector stored under an image id, read from the shard holding it."""
+        # The pipeline puts every image in shard image_id % num_shards
+        return self.shards[key % len(self.shards)].reconstruct(key)
+
+    def search(
+        self,
+        x: np.ndarray,
+        k: int,
+        params: faiss.SearchParameters | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Search every shard and keep the best ``k`` results of all."""
+        results = self._executor.map(
+            lambda shard: shard.search(x, k, params=_copy(params)),
+            self.shards,
+        )
+        heap = faiss.ResultHeap(
+            len(x),
+            k,
+            keep_max=self.metric_type == faiss.METRIC_INNER_PRODUCT,
+        )
+        for distances, labels in results:
+            heap.add_result(distances, labels)
+        heap.finalize()
+        return heap.D, heap.I
+
+    def range_search(
+        self,
+        x: np.ndarray,
+        radius: float,
+        params: faiss.SearchParameters | None = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Range search every shard and concatenate the results per query."""
+        results = list(
+            self._executor.map(
+                lambda shard: shard.range_search(
+                    x,
+                    radius,
+                    params=_copy(params),
+                ),
+                self.shards,
+            ),
+        )
+        lims = [0]
+        distances = []
+        labels = []
+        for query in range(len(x)):
+            found = 0
+            for shard_lims, shard_distances, shard_labels in results:
+                start, end = shard_lims[query], shard_lims[query + 1]
+                distances.append(shard_distances[start:end])
+                labels.append(shard_labels[start:end])
+                found += end - start
+            lims.append(lims[-1] + found)
+        return (
+            np.asarray(lims, dtype=np.int64),
+            np.concatenate(distances),
+            np.concatenate(labels),
+        )
+
+    def close(self) -> None:
+        """Stop the threads searching the shards."""
+        self._executor.shutdown(wait=False)
+
+
+def _copy(
+    params: faiss.SearchParameters | None,
+) -> faiss.SearchParameters | None:
+    # IndexIDMap swaps the selector of the parameters while it searches, so
+    # shards searched at the same time cannot share them
+    if params is None:
+        return None
+    return with_selector(params, params.sel)
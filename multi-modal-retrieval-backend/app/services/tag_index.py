@@ -0,0 +1,69 @@
+import json
+from bisect import bisect_left
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+from app.core.logging_config import logger
+
+
+class TagIndex:
+    """Inverted index from image tag to FAISS ids built by the pipeline.
+
+    Tags are the partition paths of the source images, so a prefix such as
+    ``"animals/cats/"`` selects every image under that directory.
+    """
+
+    def __init__(self, tag_index: dict[str, list[int]]) -> None:
+        self._ids = {
+            tag: np.asarray(ids, dtype=np.int64)
+            for tag, ids in tag_index.items()
+        }
+        self._tags = sorted(self._ids)
+
+    @classmethod
+    def from_file(cls, path: Path) -> "TagIndex":
+        """Load the tag index JSON written by the pipeline."""
+        with path.open(encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    def select_ids(
+        self,
+        tags: list[str] | None = None,
+        prefixes: list[str] | None = None,
+    ) -> np.ndarray:
+        """Resolve tag and prefix filters to the matching image ids.
+
+        Args:
+        ----
+            tags: Exact tags to match
+            prefixes: Tag prefixes to match
+
+        Returns:
+        -------
+            Sorted unique ids of the images matching any of the filters
+        """
+        matched = [self._ids[tag] for tag in tags or [] if tag in self._ids]
+        for prefix in prefixes or []:
+            start = bisect_left(self._tags, prefix)
+            for tag in islice(self._tags, start, None):
+                if not tag.startswith(prefix):
+                    break
+                matched.append(self._ids[tag])
+
+        if not matched:
+            return np.empty(0, dtype=np.int64)
+        ids = np.unique(np.concatenate(matched))
+        logger.info("Tag filters matched %d images", len(ids))
+        return ids
+
+    def add(self, ids: np.ndarray, tags: list[str]) -> None:
+        """Add the tags of images ingested after the index was built."""
+        for image_id, tag in zip(ids, tags, strict=True):
+            ids_with_tag = self._ids.get(tag, np.empty(0, dtype=np.int64))
+            self._ids[tag] = np.append(ids_with_tag, np.int64(image_id))
+        self._tags = sorted(self._ids)
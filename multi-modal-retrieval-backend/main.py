@@ -1,44 +1,255 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 import faiss
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.api.v1.endpoints import query_image_search
-from app.config.settings import get_api_settings, get_model_settings
+from app.api.v1.endpoints import image_ingestion, query_image_search
+from app.config.settings import (
+    get_api_settings,
+    get_ingestion_settings,
+    get_model_settings,
+)
 from app.core.logging_config import logger
+from app.services.embedding_store import EmbeddingStore
+from app.services.index_metadata import (
+    IndexMetadata,
+    resolve_index_path,
+    shard_paths,
+)
+from app.services.ingestion_log import IngestionLog
+from app.services.lexical_index import LexicalIndex
+from app.services.online_index import OnlineIndex
+from app.services.sharded_index import ShardedIndex
+from app.services.tag_index import TagIndex
 
 api_settings = get_api_settings()
 model_settings = get_model_settings()
+ingestion_settings = get_ingestion_settings()
 
 
-def load_faiss_index():
+def load_index_metadata() -> IndexMetadata | None:
+    """Read the sidecar describing the FAISS index, without the index."""
     try:
-        index_path = model_settings.faiss_index_path
-        if index_path.exists():
-            return faiss.read_index(str(index_path))
-        logger.warning(f"Warning: FAISS index not found at {index_path}")
+        if model_settings.sharded_index:
+            return load_shard_metadata()
+        index_path = resolve_index_path(model_settings.faiss_index_path)
+        metadata_path = IndexMetadata.path_for(index_path)
+        if metadata_path.exists():
+            return IndexMetadata.from_file(metadata_path)
+        logger.warning(f"Warning: index metadata not found at {metadata_path}")
+        return None
+    except Exception as e:
+        logger.error(f"Error loading index metadata: {e}")
+        return None
+
+
+def load_shard_metadata() -> IndexMetadata | None:
+    """Read the sidecars of the index shards as one description."""
+    paths = shard_paths(model_settings.faiss_shards_path)
+    metadata_paths = [IndexMetadata.path_for(path) for path in paths]
+    missing = [path for path in metadata_paths if not path.exists()]
+    if not paths or missing:
+        logger.warning(
+            "Warning: index shard metadata not found at %s",
+            model_settings.faiss_shards_path,
+        )
         return None
+    return IndexMetadata.from_shards(
+        [IndexMetadata.from_file(path) for path in metadata_paths],
+    )
+
+
+def load_faiss_index(metadata: IndexMetadata | None = None):
+    try:
+        index_path = (
+            model_settings.faiss_shards_path
+            if model_settings.sharded_index
+            else resolve_index_path(model_settings.faiss_index_path)
+        )
+        if not index_path.exists():
+            logger.warning(f"Warning: FAISS index not found at {index_path}")
+            return None
+
+        # Refuse an index the query model cannot search before loading it
+        if metadata is not None:
+            errors = metadata.compatibility_errors(
+                model_settings.embedding_dimension,
+                model_settings.embedding_metric,
+            )
+            if errors:
+                logger.error(
+                    "FAISS index at %s is not compatible: %s",
+                    index_path,
+                    "; ".join(errors),
+                )
+                return None
+
+        if model_settings.sharded_index:
+            paths = shard_paths(index_path)
+            if not paths:
+                logger.warning(f"Warning: no index shards in {index_path}")
+                return None
+            logger.info("Loading %d FAISS index shards", len(paths))
+            return ShardedIndex.from_paths(
+                paths,
+                model_settings.shard_search_threads,
+            )
+        return faiss.read_index(str(index_path))
     except Exception as e:
         logger.error(f"Error loading FAISS index: {e}")
         return None
 
 
+def get_index_version(
+    index,
+    metadata: IndexMetadata | None = None,
+) -> str | None:
+    """Identify the loaded index so cursors from another index are rejected."""
+    if index is None:
+        return None
+    if metadata is not None:
+        # The checksum identifies the content, whenever it was written
+        return f"{metadata.checksum.split(':')[-1][:16]}-{index.ntotal}"
+    index_path = (
+        model_settings.faiss_shards_path
+        if model_settings.sharded_index
+        else resolve_index_path(model_settings.faiss_index_path)
+    )
+    stat = index_path.stat()
+    return f"{stat.st_mtime_ns:x}-{index.ntotal}"
+
+
+def load_tag_index():
+    try:
+        tag_index_path = model_settings.tag_index_path
+        if tag_index_path.exists():
+            return TagIndex.from_file(tag_index_path)
+        logger.warning(f"Warning: tag index not found at {tag_index_path}")
+        return None
+    except Exception as e:
+        logger.error(f"Error loading tag index: {e}")
+        return None
+
+
+def load_lexical_index():
+    try:
+        lexical_index_path = model_settings.lexical_index_path
+        if lexical_index_path.exists():
+            return LexicalIndex.from_file(lexical_index_path)
+        logger.warning(
+            f"Warning: lexical index not found at {lexical_index_path}",
+        )
+        return None
+    except Exception as e:
+        logger.error(f"Error loading lexical index: {e}")
+        return None
+
+
+def load_embedding_store():
+    try:
+        matrix_path = model_settings.embedding_matrix_path
+        if not (matrix_path / "vectors.npy").exists():
+            logger.warning(
+                f"Warning: embedding matrix not found at {matrix_path}",
+            )
+            return None
+        store = EmbeddingStore.from_directory(matrix_path)
+        if store.dimension != model_settings.embedding_dimension:
+            logger.error(
+                "Embedding matrix dimension %d does not match %d",
+                store.dimension,
+                model_settings.embedding_dimension,
+            )
+            return None
+        return store
+    except Exception as e:
+        logger.error(f"Error loading embedding matrix: {e}")
+        return None
+
+
+def load_ingestion_log():
+    try:
+        return IngestionLog(
+            model_settings.ingestion_log_path,
+            ingestion_settings.first_id,
+        )
+    except Exception as e:
+        logger.error(f"Error loading ingestion log: {e}")
+        return None
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Load FAISS index before app startup
-    app.state.faiss_index = load_faiss_index()
+    app.state.index_metadata = load_index_metadata()
+    app.state.faiss_index = load_faiss_index(app.state.index_metadata)
     if app.state.faiss_index is not None:
         logger.info("FAISS index loaded successfully")
+    app.state.index_version = get_index_version(
+        app.state.faiss_index,
+        app.state.index_metadata,
+    )
+    app.state.tag_index = load_tag_index()
+    if app.state.tag_index is not None:
+        logger.info("Tag index loaded with %d tags", len(app.state.tag_index))
+    app.state.lexical_index = load_lexical_index()
+    if app.state.lexical_index is not None:
+        logger.info(
+            "Lexical index loaded with %d terms",
+            len(app.state.lexical_index),
+        )
+
+    app.state.embedding_store = load_embedding_store()
+    if app.state.embedding_store is not None:
+        logger.info(
+            "Embedding matrix memory-mapped with %d vectors",
+            len(app.state.embedding_store),
+        )
+
+    # Images added and deleted through the API since the pipeline ran
+    app.state.ingestion_log = None
+    compaction = None
+    if ingestion_settings.enabled and app.state.faiss_index is not None:
+        app.state.ingestion_log = load_ingestion_log()
+    if app.state.ingestion_log is not None:
+        app.state.faiss_index = OnlineIndex(app.state.faiss_index)
+        image_ingestion.ingestion_service.replay(
+            app.state.faiss_index,
+            app.state.ingestion_log,
+            app.state.tag_index,
+            app.state.embedding_store,
+            app.state.lexical_index,
+        )
+        compaction = asyncio.create_task(
+            image_ingestion.ingestion_service.compact_periodically(
+                app.state.faiss_index,
+                app.state.ingestion_log,
+            ),
+        )
+        logger.info("Online ingestion enabled")
 
     yield
 
     # Cleanup on shutdown
+    if compaction is not None:
+        compaction.cancel()
+        with suppress(asyncio.CancelledError):
+            await compaction
+    if isinstance(app.state.faiss_index, ShardedIndex | OnlineIndex):
+        app.state.faiss_index.close()
     if app.state.faiss_index is not None:
         del app.state.faiss_index
         app.state.faiss_index = None
         logger.info("FAISS index cleaned up")
+    app.state.index_version = None
+    app.state.index_metadata = None
+    app.state.tag_index = None
+    app.state.lexical_index = None
+    app.state.embedding_store = None
+    app.state.ingestion_log = None
 
 
 app = FastAPI(
@@ -53,11 +264,12 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["*"],
 )
 
 app.include_router(query_image_search.router, prefix=api_settings.api_v1_str)
+app.include_router(image_ingestion.router, prefix=api_settings.api_v1_str)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", workers=1, host="0.0.0.0", port=8000, reload=False)
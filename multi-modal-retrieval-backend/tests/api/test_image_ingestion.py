@@ -0,0 +1,217 @@
+import base64
+
+import faiss
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.services import ingestion_service
+from app.services.ingestion_log import IngestionLog
+from app.services.lexical_index import LexicalIndex
+from app.services.online_index import OnlineIndex
+from tests.fakes import jpeg
+
+
+@pytest.fixture()
+def app(fake_models, captioner, monkeypatch, tmp_path) -> FastAPI:
+    # The endpoint module creates its service on import, with the real models
+    monkeypatch.setattr(ingestion_service, "ImageService", lambda: captioner)
+    from app.api.v1.endpoints import image_ingestion
+
+    monkeypatch.setattr(
+        image_ingestion,
+        "ingestion_service",
+        ingestion_service.IngestionService(),
+    )
+    main = faiss.IndexIDMap(faiss.IndexFlatIP(8))
+    vectors = np.random.default_rng(0).random((10, 8), np.float32)
+    faiss.normalize_L2(vectors)
+    main.add_with_ids(vectors, np.arange(10))
+
+    app = FastAPI()
+    app.include_router(image_ingestion.router, prefix="/api/v1")
+    app.state.faiss_index = OnlineIndex(main)
+    app.state.ingestion_log = IngestionLog(tmp_path, first_id=1000)
+    return app
+
+
+def _upload(color: tuple[int, int, int], tag: str, width: int = 4) -> dict:
+    return {
+        "image_data": base64.b64encode(jpeg(color, width)).decode(),
+        "image_tag": tag,
+    }
+
+
+@pytest.fixture()
+def lexical_index(app) -> LexicalIndex:
+    app.state.lexical_index = LexicalIndex(
+        {
+            "token_pattern": r"[a-z0-9]+",
+            "k1": 1.2,
+            "b": 0.75,
+            "n_docs": 10,
+            "avgdl": 3.0,
+            "terms": {"red": {"ids": [1, 2], "weights": [1.0, 0.5]}},
+        },
+    )
+    return app.state.lexical_index
+
+
+def test_add_images_makes_them_searchable(app, fake_models) -> None:
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/v1/images",
+        json={
+            "images": [
+                _upload((250, 0, 0), "red"),
+                _upload((0, 0, 250), "blue"),
+            ]
+        },
+    )
+
+    assert response.status_code == 201
+    assert response.json() == {"image_ids": [1000, 1001]}
+    index = app.state.faiss_index
+    assert index.delta_size == 2
+    assert sorted(fake_models.features) == ["1000", "1001"]
+    assert fake_models.features["1001"]["image_tag"] == "blue"
+    query = index.reconstruct(1001).reshape(1, -1)
+    _, ids = index.search(query, 1)
+    assert ids[0][0] == 1001
+    replayed = next(app.state.ingestion_log.replay())
+    assert list(replayed["image_id"]) == [1000, 1001]
+
+
+def test_add_images_rejects_undecodable_images(app) -> None:
+    client = TestClient(app)
+    upload = {"image_data": base64.b64encode(b"not a jpeg").decode()}
+
+    response = client.post(
+        "/api/v1/images",
+        json={"images": [{**upload, "image_tag": "broken"}]},
+    )
+
+    assert response.status_code == 400
+    assert "could not be decoded" in response.json()["detail"]
+    assert app.state.faiss_index.delta_size == 0
+
+
+def test_delete_pipeline_image(app) -> None:
+    client = TestClient(app)
+
+    assert client.delete("/api/v1/images/3").status_code == 204
+
+    index = app.state.faiss_index
+    assert not index.contains(3)
+    assert app.state.ingestion_log.deleted_ids == [3]
+    # It is gone, so it cannot be deleted again
+    assert client.delete("/api/v1/images/3").status_code == 404
+
+
+def test_delete_ingested_image(app) -> None:
+    client = TestClient(app)
+    response = client.post(
+        "/api/v1/images",
+        json={"images": [_upload((0, 250, 0), "green")]},
+    )
+    (image_id,) = response.json()["image_ids"]
+
+    assert client.delete(f"/api/v1/images/{image_id}").status_code == 204
+
+    assert app.state.faiss_index.delta_size == 0
+    assert not app.state.faiss_index.contains(image_id)
+
+
+def test_delete_unknown_image(app) -> None:
+    response = TestClient(app).delete("/api/v1/images/12345")
+
+    assert response.status_code == 404
+
+
+def test_ingestion_needs_the_ingestion_log(app) -> None:
+    app.state.ingestion_log = None
+
+    response = TestClient(app).delete("/api/v1/images/3")
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Online ingestion is not available"
+
+
+def test_ingested_images_are_found_by_tag_and_caption(
+    app,
+    lexical_index,
+) -> None:
+    client = TestClient(app)
+    response = client.post(
+        "/api/v1/images",
+        json={
+            "images": [
+                _upload((250, 0, 0), "red"),
+                _upload((0, 0, 250), "sky", width=8),
+            ],
+        },
+    )
+    assert response.status_code == 201
+
+    # Captioned "4 pixels wide" and "8 pixels wide"
+    assert sorted(lexical_index.search("pixels", 10)[1]) == [1000, 1001]
+    assert 1000 in lexical_index.search("red", 10)[1]
+    assert lexical_index.search("sky", 10)[1].tolist() == [1001]
+
+    assert client.delete("/api/v1/images/1001").status_code == 204
+    assert lexical_index.search("pixels", 10)[1].tolist() == [1000]
+
+
+def test_images_the_captioner_fails_on_keep_their_tag(
+    app,
+    lexical_index,
+    captioner,
+) -> None:
+    captioner.failing_widths = (8,)
+
+    response = TestClient(app).post(
+        "/api/v1/images",
+        json={
+            "images": [
+                _upload((250, 0, 0), "red"),
+                _upload((0, 0, 250), "sky", width=8),
+            ],
+        },
+    )
+
+    assert response.status_code == 201
+    # The batch failed, then every image was captioned on its own
+    assert captioner.batches == [2, 1, 1]
+    assert lexical_index.search("pixels", 10)[1].tolist() == [1000]
+    assert lexical_index.search("sky", 10)[1].tolist() == [1001]
+    replayed = next(app.state.ingestion_log.replay())
+    assert replayed["caption"].tolist() == ["4 pixels wide", None]
+
+
+def test_replay_adds_logged_captions_to_the_lexical_index(
+    app,
+    lexical_index,
+) -> None:
+    from app.api.v1.endpoints import image_ingestion
+
+    client = TestClient(app)
+    client.post("/api/v1/images", json={"images": [_upload((0, 250, 0), "g")]})
+    client.delete("/api/v1/images/1")
+
+    # A restarted backend loads the pipeline indexes and replays the log
+    restarted = LexicalIndex(
+        {
+            "token_pattern": r"[a-z0-9]+",
+            "terms": {"red": {"ids": [1, 2], "weights": [1.0, 0.5]}},
+        },
+    )
+    image_ingestion.ingestion_service.replay(
+        OnlineIndex(app.state.faiss_index.main),
+        app.state.ingestion_log,
+        lexical_index=restarted,
+    )
+
+    assert restarted.search("pixels", 10)[1].tolist() == [1000]
+    assert restarted.search("red", 10)[1].tolist() == [2]
@@ -0,0 +1,66 @@
+import faiss
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.services.online_index import OnlineIndex
+from tests.fakes import DIMENSION, jpeg
+
+
+@pytest.fixture()
+def app(search, fake_models, monkeypatch) -> FastAPI:
+    from app.api.v1.endpoints import query_image_search
+
+    # The endpoint module creates its service on import, with the real models
+    monkeypatch.setattr(query_image_search, "search_service", search)
+    main = faiss.IndexIDMap2(faiss.IndexFlatIP(DIMENSION))
+    vectors = np.random.default_rng(0).random((10, DIMENSION), np.float32)
+    faiss.normalize_L2(vectors)
+    main.add_with_ids(vectors, np.arange(10))
+    fake_models.features = {
+        str(image_id): {"image_data": jpeg((0, 0, 0))}
+        for image_id in [*range(10), 1000]
+    }
+
+    app = FastAPI()
+    app.include_router(query_image_search.router, prefix="/api/v1")
+    app.state.faiss_index = OnlineIndex(main)
+    return app
+
+
+def _similar(app: FastAPI, image_id: int, k: int) -> list[int]:
+    response = TestClient(app).get(
+        f"/api/v1/features/similar/{image_id}",
+        # Keep the ranking of the index, best match first
+        params={"k": k, "sort": False},
+    )
+    assert response.status_code == 200
+    return [result["image_id"] for result in response.json()["results"]]
+
+
+def test_similar_images_leave_out_the_image_itself(app) -> None:
+    index = app.state.faiss_index
+    _, expected = index.search(index.reconstruct(4).reshape(1, -1), 4)
+
+    assert _similar(app, 4, 3) == expected[0][1:].tolist()
+
+
+def test_similar_images_of_an_ingested_image(app) -> None:
+    index = app.state.faiss_index
+    index.add(np.array([1000]), index.reconstruct(4).reshape(1, -1))
+
+    ids = _similar(app, 1000, 3)
+
+    assert ids[0] == 4
+    assert 1000 not in ids
+
+
+@pytest.mark.parametrize("image_id", [12345, 4])
+def test_similar_images_of_an_unknown_image(app, image_id) -> None:
+    app.state.faiss_index.remove(np.array([4]))
+
+    response = TestClient(app).get(f"/api/v1/features/similar/{image_id}")
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == f"Image {image_id} is not in the index"
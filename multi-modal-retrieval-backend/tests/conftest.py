@@ -0,0 +1,31 @@
+import pytest
+
+from app.core import query_processor
+from app.services import feast_service, search_service
+from tests.fakes import FakeCaptioner, FakeClipModel, FakeFeatureStore
+
+
+@pytest.fixture()
+def fake_models(monkeypatch) -> FakeFeatureStore:
+    """Replace CLIP and the Feast store, which need downloads and a repo."""
+    store = FakeFeatureStore()
+    monkeypatch.setattr(
+        query_processor,
+        "SentenceTransformer",
+        lambda *_: FakeClipModel(),
+    )
+    monkeypatch.setattr(query_processor.QueryProcessor, "_instance", None)
+    monkeypatch.setattr(feast_service, "FeatureStore", lambda *_: store)
+    return store
+
+
+@pytest.fixture()
+def captioner() -> FakeCaptioner:
+    return FakeCaptioner()
+
+
+@pytest.fixture()
+def search(fake_models, captioner, monkeypatch) -> search_service.SearchService:
+    """Search service captioning with ``captioner`` instead of the model."""
+    monkeypatch.setattr(search_service, "ImageService", lambda: captioner)
+    return search_service.SearchService()
@@ -0,0 +1,144 @@
+import asyncio
+
+import faiss
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app.core import pagination
+from app.core.pagination import (
+    CandidateCache,
+    Candidates,
+    Cursor,
+    decode_cursor,
+    encode_cursor,
+)
+from tests.fakes import DIMENSION, jpeg
+
+
+def _candidates(count: int = 3) -> Candidates:
+    return Candidates(
+        distances=np.linspace(1, 0, count, dtype=np.float32),
+        indices=np.arange(count),
+        index_version="v1",
+    )
+
+
+def test_cursor_round_trips_through_its_token() -> None:
+    cursor = Cursor(candidates_id="abc", offset=20, index_version="v1")
+
+    assert decode_cursor(encode_cursor(cursor)) == cursor
+
+
+@pytest.mark.parametrize("token", ["not a cursor", "e30=", "é"])
+def test_malformed_cursors_are_rejected(token: str) -> None:
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(token)
+
+
+def test_candidate_cache_evicts_the_least_recently_used() -> None:
+    cache = CandidateCache(max_size=2, ttl_seconds=60)
+    first = cache.put(_candidates())
+    second = cache.put(_candidates())
+
+    assert cache.get(first) is not None
+    third = cache.put(_candidates())
+
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    assert cache.get(third) is not None
+
+
+def test_candidate_cache_expires_entries(monkeypatch) -> None:
+    now = [100.0]
+    monkeypatch.setattr(pagination.time, "monotonic", lambda: now[0])
+    cache = CandidateCache(max_size=2, ttl_seconds=60)
+    candidates_id = cache.put(_candidates())
+
+    now[0] += 61
+
+    assert cache.get(candidates_id) is None
+
+
+@pytest.fixture()
+def index(fake_models) -> faiss.Index:
+    vectors = np.random.default_rng(0).random((30, DIMENSION), np.float32)
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(DIMENSION))
+    index.add_with_ids(vectors, np.arange(30))
+    fake_models.features = {
+        str(image_id): {"image_data": jpeg((0, 0, 0))} for image_id in range(30)
+    }
+    return index
+
+
+def _ids(response) -> list[int]:
+    return [result.image_id for result in response.results]
+
+
+def test_cursor_pages_through_the_first_ranking(search, index) -> None:
+    async def main() -> list:
+        first = await search.search_by_text(
+            "a red car",
+            10,
+            False,
+            index,
+            index_version="v1",
+        )
+        second = await search.search_by_text(
+            "ignored",
+            10,
+            False,
+            index,
+            cursor=first.next_cursor,
+            index_version="v1",
+        )
+        third = await search.search_by_text(
+            "ignored",
+            10,
+            False,
+            index,
+            cursor=second.next_cursor,
+            index_version="v1",
+        )
+        return [first, second, third]
+
+    pages = asyncio.run(main())
+
+    _, expected = search.faiss_service.search(index, "a red car", 30)
+    ids = [image_id for page in pages for image_id in _ids(page)]
+    assert ids == expected.tolist()
+    assert pages[-1].next_cursor is None
+
+
+def test_cursor_of_another_index_version_is_gone(search, index) -> None:
+    async def main() -> None:
+        first = await search.search_by_text(
+            "a red car",
+            10,
+            False,
+            index,
+            index_version="v1",
+        )
+        await search.search_by_text(
+            "a red car",
+            10,
+            False,
+            index,
+            cursor=first.next_cursor,
+            index_version="v2",
+        )
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main())
+
+    assert error.value.status_code == 410
+
+
+def test_invalid_cursor_is_a_bad_request(search, index) -> None:
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(
+            search.search_by_text("a red car", 10, False, index, cursor="x"),
+        )
+
+    assert error.value.status_code == 400
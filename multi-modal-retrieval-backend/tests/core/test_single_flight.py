@@ -0,0 +1,116 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.core.single_flight import SingleFlight
+from tests.fakes import jpeg
+
+
+def test_concurrent_calls_with_one_key_run_once() -> None:
+    flight = SingleFlight("test")
+    calls = []
+
+    async def compute() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main() -> list[str]:
+        return await asyncio.gather(
+            *(flight.do("key", compute) for _ in range(5)),
+        )
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert len(calls) == 1
+
+
+def test_calls_after_completion_recompute() -> None:
+    flight = SingleFlight("test")
+    calls = []
+
+    async def compute() -> int:
+        calls.append(1)
+        return len(calls)
+
+    async def main() -> list[int]:
+        return [await flight.do("key", compute) for _ in range(2)]
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_errors_reach_every_caller() -> None:
+    flight = SingleFlight("test")
+
+    async def fail() -> None:
+        await asyncio.sleep(0.01)
+        msg = "failed"
+        raise ValueError(msg)
+
+    async def main() -> list:
+        return await asyncio.gather(
+            flight.do("key", fail),
+            flight.do("key", fail),
+            return_exceptions=True,
+        )
+
+    errors = asyncio.run(main())
+    assert [str(error) for error in errors] == ["failed", "failed"]
+
+
+def test_do_many_joins_keys_in_flight_and_batches_the_rest() -> None:
+    flight = SingleFlight("test")
+    batches = []
+
+    async def compute(keys: list[str]) -> list[str]:
+        batches.append(keys)
+        await asyncio.sleep(0.01)
+        return [key.upper() for key in keys]
+
+    async def main() -> list[list[str]]:
+        return await asyncio.gather(
+            flight.do_many(["a", "b", "a"], compute),
+            flight.do_many(["b", "c"], compute),
+        )
+
+    assert asyncio.run(main()) == [["A", "B", "A"], ["B", "C"]]
+    assert batches == [["a", "b"], ["c"]]
+
+
+def test_do_many_rejects_a_wrong_number_of_results() -> None:
+    flight = SingleFlight("test")
+
+    async def compute(keys: list[str]) -> list[str]:
+        return keys[:1]
+
+    with pytest.raises(RuntimeError, match="Expected 2 results, got 1"):
+        asyncio.run(flight.do_many(["a", "b"], compute))
+
+
+def test_concurrent_searches_caption_each_image_once(
+    search,
+    fake_models,
+    captioner,
+) -> None:
+    fake_models.features = {
+        str(image_id): {"image_data": jpeg((0, 0, 0), width=image_id)}
+        for image_id in (1, 2, 3)
+    }
+
+    async def main() -> list:
+        return await asyncio.gather(
+            search._process_search(np.array([0.9, 0.8]), np.array([1, 2])),
+            search._process_search(np.array([0.9, 0.7]), np.array([2, 3])),
+        )
+
+    first, second = asyncio.run(main())
+
+    assert [result.caption for result in first] == [
+        "1 pixels wide",
+        "2 pixels wide",
+    ]
+    assert [result.caption for result in second] == [
+        "2 pixels wide",
+        "3 pixels wide",
+    ]
+    assert captioner.batches == [2, 1]
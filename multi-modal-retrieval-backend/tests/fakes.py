@@ -0,0 +1,79 @@
+import io
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+DIMENSION = 8
+
+
+class FakeClipModel:
+    """Embeds text and images deterministically instead of running CLIP."""
+
+    def encode(self, inputs, batch_size: int = 32) -> np.ndarray:
+        if isinstance(inputs, str):
+            rng = np.random.default_rng(sum(inputs.encode()))
+            return rng.random(DIMENSION, dtype=np.float32)
+        # An image embeds as the colour of its first pixels
+        return np.stack(
+            [
+                np.asarray(image.resize((2, 2)), np.float32).ravel()[:DIMENSION]
+                + 1.0
+                for image in inputs
+            ],
+        )
+
+
+class FakeFeatureStore:
+    """Online store keeping image features in memory."""
+
+    def __init__(self, *_, **__) -> None:
+        self.features: dict[str, dict] = {}
+
+    def write_to_online_store(self, _: str, df: pd.DataFrame) -> None:
+        for row in df.to_dict("records"):
+            self.features[str(row["image_id"])] = row
+
+    def get_online_features(self, features, entity_rows):
+        rows = [
+            self.features.get(str(row["image_id"]), {}) for row in entity_rows
+        ]
+        names = [feature.split(":")[1] for feature in features]
+        return _OnlineResponse(
+            {name: [row.get(name) for row in rows] for name in names},
+        )
+
+
+class FakeCaptioner:
+    """Captions an image with its width and records the batches it gets.
+
+    Images of a width in ``failing_widths`` make the whole batch fail, as
+    an image the real model cannot caption would.
+    """
+
+    def __init__(self, failing_widths: tuple[int, ...] = ()) -> None:
+        self.failing_widths = failing_widths
+        self.batches: list[int] = []
+
+    def generate_caption(self, images: list) -> list[str]:
+        self.batches.append(len(images))
+        widths = [image.width for image in images]
+        if any(width in self.failing_widths for width in widths):
+            msg = "Image could not be captioned"
+            raise RuntimeError(msg)
+        return [f"{width} pixels wide" for width in widths]
+
+
+class _OnlineResponse:
+    def __init__(self, features: dict) -> None:
+        self._features = features
+
+    def to_dict(self) -> dict:
+        return self._features
+
+
+def jpeg(color: tuple[int, int, int], width: int = 4) -> bytes:
+    """Encode a small image of a single colour as JPEG."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, 4), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
@@ -0,0 +1,73 @@
+import threading
+
+import numpy as np
+
+from app.services.embedding_store import EmbeddingStore
+
+
+def _store() -> EmbeddingStore:
+    # Ids out of order, as the rows of an incrementally updated matrix are
+    vectors = np.eye(4, dtype=np.float32)
+    return EmbeddingStore(np.array([30, 10, 40, 20]), vectors)
+
+
+def test_rerank_scores_candidates_exactly() -> None:
+    store = _store()
+    query = np.array([0.1, 0.9, 0.5, 0.0], dtype=np.float32)
+
+    scores, ids = store.rerank(query, np.array([30, 10, 40]))
+
+    assert ids.tolist() == [10, 40, 30]
+    assert scores.tolist() == [
+        np.float32(0.9),
+        np.float32(0.5),
+        np.float32(0.1),
+    ]
+
+
+def test_rerank_drops_candidates_without_a_vector() -> None:
+    scores, ids = _store().rerank(np.ones(4), np.array([20, 99]))
+
+    assert ids.tolist() == [20]
+    assert len(scores) == 1
+
+
+def test_rerank_uses_the_vectors_of_ingested_images() -> None:
+    store = _store()
+    store.add(np.array([50]), np.array([[0.0, 0.0, 0.0, 2.0]]))
+
+    _, ids = store.rerank(np.array([0, 0, 0, 1.0]), np.array([10, 50, 20]))
+    assert ids.tolist() == [50, 20, 10]
+    assert store.vector(50).tolist() == [0, 0, 0, 2]
+
+    store.remove([50])
+    _, ids = store.rerank(np.array([0, 0, 0, 1.0]), np.array([10, 50, 20]))
+    assert ids.tolist() == [20, 10]
+    assert store.vector(50) is None
+    assert len(store) == 4
+
+
+def test_rerank_is_safe_while_images_are_ingested() -> None:
+    store = _store()
+    errors = []
+    stop = threading.Event()
+
+    def rerank() -> None:
+        candidates = np.arange(1000, 1100)
+        while not stop.is_set():
+            try:
+                store.rerank(np.ones(4), candidates)
+            except Exception as e:  # noqa: BLE001
+                errors.append(e)
+
+    readers = [threading.Thread(target=rerank) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    for image_id in range(1000, 1100):
+        store.add(np.array([image_id]), np.ones((1, 4)))
+        store.remove([image_id - 1])
+    stop.set()
+    for reader in readers:
+        reader.join()
+
+    assert errors == []
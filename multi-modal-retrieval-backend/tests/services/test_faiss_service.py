@@ -0,0 +1,307 @@
+import asyncio
+
+import faiss
+import numpy as np
+import pytest
+
+from app.services.embedding_store import EmbeddingStore
+from app.services.faiss_service import FaissService
+from app.services.online_index import OnlineIndex
+from app.services.tag_index import TagIndex
+from tests.fakes import DIMENSION, jpeg
+
+
+@pytest.fixture()
+def service(fake_models) -> FaissService:
+    return FaissService()
+
+
+@pytest.fixture()
+def index() -> faiss.Index:
+    vectors = np.random.default_rng(0).random((100, DIMENSION), np.float32)
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(DIMENSION))
+    index.add_with_ids(vectors, np.arange(100))
+    return index
+
+
+def test_search_returns_only_allowed_ids(service, index) -> None:
+    allowed_ids = np.array([3, 17, 42, 64, 99])
+
+    distances, indices = service.search(index, "a red car", 5, allowed_ids)
+
+    # Filtering inside FAISS fills top_k even with few allowed images
+    assert sorted(indices) == allowed_ids.tolist()
+    assert list(distances) == sorted(distances, reverse=True)
+
+
+def test_filtered_search_ranks_like_an_index_of_the_allowed_ids(
+    service,
+    index,
+) -> None:
+    allowed_ids = np.arange(0, 100, 3)
+    subset = faiss.IndexIDMap2(faiss.IndexFlatIP(DIMENSION))
+    subset.add_with_ids(index.reconstruct_batch(allowed_ids), allowed_ids)
+
+    _, indices = service.search(index, "a red car", 10, allowed_ids)
+
+    assert np.array_equal(indices, service.search(subset, "a red car", 10)[1])
+
+
+def test_search_without_allowed_ids_returns_nothing(service, index) -> None:
+    distances, indices = service.search(
+        index,
+        "a red car",
+        5,
+        np.empty(0, dtype=np.int64),
+    )
+
+    assert len(distances) == len(indices) == 0
+
+
+def test_tag_prefixes_select_the_ids_of_matching_tags() -> None:
+    tag_index = TagIndex(
+        {"animal/cat": [1, 4], "animal/dog": [2], "vehicle/car": [3]},
+    )
+
+    assert tag_index.select_ids(prefixes=["animal/"]).tolist() == [1, 2, 4]
+    assert tag_index.select_ids(["vehicle/car", "animal/dog"]).tolist() == [
+        2,
+        3,
+    ]
+    assert len(tag_index.select_ids(prefixes=["plant/"])) == 0
+
+
+def test_filtered_ivf_search_keeps_the_saved_nprobe(service, index) -> None:
+    vectors = index.reconstruct_n(0, index.ntotal)
+    ivf = faiss.IndexIVFFlat(
+        faiss.IndexFlatIP(DIMENSION),
+        DIMENSION,
+        4,
+        faiss.METRIC_INNER_PRODUCT,
+    )
+    ivf.train(vectors)
+    ivf.add_with_ids(vectors, np.arange(100))
+    ivf.nprobe = 4
+
+    params = service._search_params(OnlineIndex(ivf), np.array([1, 2]))
+    _, indices = service.search(ivf, "a red car", 5, np.array([1, 2]))
+
+    assert isinstance(params, faiss.SearchParametersIVF)
+    assert params.nprobe == 4
+    assert sorted(indices) == [1, 2]
+
+
+def _scores(service, index, query: str) -> np.ndarray:
+    """Cosine similarity of the query with every indexed vector, by id."""
+    vectors = index.reconstruct_n(0, index.ntotal)
+    return vectors @ service._embed_query(query)[0]
+
+
+def test_range_search_returns_every_image_above_min_score(
+    service,
+    index,
+) -> None:
+    scores = _scores(service, index, "a red car")
+    min_score = float(np.quantile(scores, 0.8))
+
+    distances, indices = service.range_search(
+        index,
+        "a red car",
+        min_score,
+        1000,
+    )
+
+    assert sorted(indices) == np.flatnonzero(scores > min_score).tolist()
+    assert (distances > min_score).all()
+    assert list(distances) == sorted(distances, reverse=True)
+
+
+def test_range_search_keeps_the_best_max_results(service, index) -> None:
+    scores = _scores(service, index, "a red car")
+
+    distances, indices = service.range_search(index, "a red car", -1.0, 7)
+
+    assert indices.tolist() == np.argsort(-scores)[:7].tolist()
+    assert list(distances) == sorted(distances, reverse=True)
+
+
+def test_range_search_is_restricted_to_allowed_ids(service, index) -> None:
+    _, indices = service.range_search(
+        index,
+        "a red car",
+        -1.0,
+        1000,
+        np.array([5, 6, 7]),
+    )
+
+    assert sorted(indices) == [5, 6, 7]
+    assert service.range_search(
+        index,
+        "a red car",
+        -1.0,
+        1000,
+        np.empty(0, dtype=np.int64),
+    ) == ([], [])
+
+
+@pytest.fixture()
+def compressed(index) -> faiss.Index:
+    # 4 bit codes rank the vectors differently from their exact scores
+    vectors = index.reconstruct_n(0, index.ntotal)
+    compressed = faiss.IndexIDMap2(
+        faiss.IndexScalarQuantizer(
+            DIMENSION,
+            faiss.ScalarQuantizer.QT_4bit,
+            faiss.METRIC_INNER_PRODUCT,
+        ),
+    )
+    compressed.train(vectors)
+    compressed.add_with_ids(vectors, np.arange(100))
+    return compressed
+
+
+@pytest.fixture()
+def store(index) -> EmbeddingStore:
+    return EmbeddingStore(np.arange(100), index.reconstruct_n(0, 100))
+
+
+@pytest.mark.parametrize("rerank_candidates", [5, 100])
+def test_search_reranks_candidates_with_exact_scores(
+    service,
+    index,
+    compressed,
+    store,
+    rerank_candidates,
+) -> None:
+    exact_distances, exact_indices = service.search(index, "a red car", 10)
+
+    distances, indices = service.search(
+        compressed,
+        "a red car",
+        10,
+        rerank_candidates=rerank_candidates,
+        embedding_store=store,
+    )
+
+    # Fewer candidates than results still re-rank the top_k found
+    assert np.allclose(
+        distances,
+        store.rerank(service._embed_query("a red car")[0], indices)[0],
+    )
+    if rerank_candidates == 100:
+        assert indices.tolist() == exact_indices.tolist()
+        assert np.allclose(distances, exact_distances)
+
+
+def test_search_without_store_keeps_the_index_ranking(
+    service,
+    compressed,
+) -> None:
+    distances, indices = service.search(
+        compressed,
+        "a red car",
+        10,
+        rerank_candidates=100,
+    )
+
+    expected = compressed.search(service._embed_query("a red car"), 10)
+    assert indices.tolist() == expected[1][0].tolist()
+    assert np.allclose(distances, expected[0][0])
+
+
+def test_first_page_reranks_fewer_candidates_than_it_ranks(
+    search,
+    fake_models,
+    index,
+    compressed,
+    store,
+) -> None:
+    fake_models.features = {
+        str(image_id): {"image_data": jpeg((0, 0, 0))}
+        for image_id in range(100)
+    }
+
+    # The first page ranks max_candidates, more than the 50 asked for
+    response = asyncio.run(
+        search.search_by_text(
+            "a red car",
+            5,
+            False,
+            compressed,
+            rerank_candidates=50,
+            embedding_store=store,
+        ),
+    )
+
+    distances, indices = search.faiss_service.search(index, "a red car", 5)
+    assert [result.image_id for result in response.results] == indices.tolist()
+    assert [result.distance for result in response.results] == pytest.approx(
+        distances.tolist(),
+    )
+
+
+def test_search_similar_leaves_out_the_image_itself(service, index) -> None:
+    query = index.reconstruct(7).reshape(1, -1)
+    _, expected = index.search(query, 6)
+
+    distances, indices = service.search_similar(index, 7, 5)
+
+    # The image finds itself first, one more result makes up for it
+    assert expected[0][0] == 7
+    assert indices.tolist() == expected[0][1:].tolist()
+    assert list(distances) == sorted(distances, reverse=True)
+
+
+def test_search_similar_keeps_top_k_when_the_image_is_filtered_out(
+    service,
+    index,
+) -> None:
+    _, indices = service.search_similar(
+        index,
+        7,
+        3,
+        allowed_ids=np.array([1, 2, 3, 4, 5]),
+    )
+
+    assert len(indices) == 3
+    assert set(indices) <= {1, 2, 3, 4, 5}
+
+
+def test_search_similar_unknown_image(service, index) -> None:
+    assert service.search_similar(index, 12345, 5) is None
+
+
+def test_image_vector_is_read_from_the_store_first(
+    service,
+    compressed,
+    store,
+) -> None:
+    exact = store.vector(7).reshape(1, -1)
+
+    query = service._image_vector(compressed, 7, store)
+
+    assert np.allclose(query, exact / np.linalg.norm(exact))
+    # Without the store the lossy codes are decoded instead
+    assert not np.allclose(service._image_vector(compressed, 7, None), query)
+
+
+def test_search_similar_finds_images_only_in_the_delta(service, index) -> None:
+    online = OnlineIndex(index)
+    # An ingested copy of image 7 that the main index does not hold
+    online.add(np.array([1000]), index.reconstruct(7).reshape(1, -1))
+
+    distances, indices = service.search_similar(online, 1000, 3)
+
+    assert indices[0] == 7
+    assert distances[0] == pytest.approx(1.0)
+    assert 1000 not in indices
+    assert 1000 in service.search_similar(online, 7, 3)[1]
+
+
+def test_search_similar_deleted_image(service, index, store) -> None:
+    online = OnlineIndex(index)
+    online.remove(np.array([7]))
+
+    # The store still holds the vector of the deleted image
+    assert service.search_similar(online, 7, 3, embedding_store=store) is None
@@ -0,0 +1,109 @@
+import json
+
+from app.services.index_metadata import (
+    IndexMetadata,
+    resolve_index_path,
+    shard_paths,
+)
+
+
+def _metadata(**overrides) -> IndexMetadata:
+    fields = {
+        "dimension": 8,
+        "ntotal": 10,
+        "index_type": "IndexIDMap(IndexFlatIP)",
+        "metric": "inner_product",
+        "checksum": "sha256:abc",
+        "search_params": {},
+        "source_data_version": "v1",
+    }
+    return IndexMetadata(**{**fields, **overrides})
+
+
+def test_from_file_reads_the_pipeline_sidecar(tmp_path) -> None:
+    index_path = tmp_path / "faiss.index"
+    sidecar = IndexMetadata.path_for(index_path)
+    # The pipeline writes more entries than the backend needs
+    sidecar.write_text(
+        json.dumps(
+            {
+                "dimension": 8,
+                "ntotal": 3,
+                "index_type": "IndexIVFFlat",
+                "metric": "l2",
+                "search_params": {"nprobe": 4},
+                "transforms": [],
+                "checksum": "sha256:abc",
+                "source_data_version": None,
+                "normalized": False,
+                "created_at": "2026-01-01T00:00:00+00:00",
+            },
+        ),
+    )
+
+    metadata = IndexMetadata.from_file(sidecar)
+
+    assert sidecar.name == "faiss.meta.json"
+    assert metadata == IndexMetadata(
+        dimension=8,
+        ntotal=3,
+        index_type="IndexIVFFlat",
+        metric="l2",
+        checksum="sha256:abc",
+        search_params={"nprobe": 4},
+        source_data_version=None,
+    )
+
+
+def test_compatibility_errors() -> None:
+    metadata = _metadata()
+
+    assert metadata.compatibility_errors(8, "inner_product") == []
+    errors = metadata.compatibility_errors(16, "l2")
+    assert len(errors) == 2
+    assert "dimension 8" in errors[0]
+    assert "'inner_product'" in errors[1]
+
+
+def test_from_shards_describes_one_index() -> None:
+    first = _metadata(ntotal=3, checksum="sha256:a")
+    second = _metadata(ntotal=4, checksum="sha256:b")
+
+    combined = IndexMetadata.from_shards([first, second])
+
+    assert combined.ntotal == 7
+    assert combined.index_type == "2 x IndexIDMap(IndexFlatIP)"
+    assert combined.source_data_version == "v1"
+    # Rebuilding a shard changes the checksum of the whole index
+    rebuilt = IndexMetadata.from_shards([first, _metadata(checksum="c")])
+    assert rebuilt.checksum != combined.checksum
+    # Shards of different runs have no single version
+    mixed = IndexMetadata.from_shards(
+        [first, _metadata(source_data_version="v2")],
+    )
+    assert mixed.source_data_version is None
+
+
+def test_shard_paths_are_in_shard_order(tmp_path) -> None:
+    for name in ["shard-00001.idx", "shard-00000.idx", "shard-00000.meta.json"]:
+        (tmp_path / name).touch()
+
+    assert [path.name for path in shard_paths(tmp_path)] == [
+        "shard-00000.idx",
+        "shard-00001.idx",
+    ]
+
+
+def test_resolve_index_path_follows_the_latest_pointer(tmp_path) -> None:
+    index_path = tmp_path / "faiss.index"
+    (tmp_path / "faiss.index.latest").write_text("2026-01-01T00.00.00.000Z\n")
+
+    assert resolve_index_path(index_path) == (
+        tmp_path / "2026-01-01T00.00.00.000Z" / "faiss.index"
+    )
+
+
+def test_resolve_index_path_without_pointer(tmp_path) -> None:
+    index_path = tmp_path / "faiss.index"
+
+    assert resolve_index_path(index_path) == index_path
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from app.services.ingestion_log import IngestionLog
+
+
+def _images(ids: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "image_id": ids,
+            "image_data": [b"jpeg"] * len(ids),
+            "embedding": list(np.ones((len(ids), 4), np.float32)),
+            "image_tag": ["tag"] * len(ids),
+        },
+    )
+
+
+def test_replay_skips_deleted_images(tmp_path) -> None:
+    log = IngestionLog(tmp_path, first_id=1000)
+    ids = log.allocate_ids(3)
+    log.append(_images(ids))
+    log.delete([1001, 5])
+
+    # A restarted backend reads the same log
+    log = IngestionLog(tmp_path, first_id=1000)
+
+    replayed = pd.concat(list(log.replay()))
+    assert list(replayed["image_id"]) == [1000, 1002]
+    assert log.deleted_ids == [5, 1001]
+    assert list(log.allocate_ids(1)) == [1003]
+
+
+def test_compact_merges_batches(tmp_path) -> None:
+    log = IngestionLog(tmp_path, first_id=1000)
+    for _ in range(3):
+        log.append(_images(log.allocate_ids(2)))
+    log.delete([1002, 7])
+
+    log.compact()
+
+    assert sorted(p.name for p in tmp_path.glob("batch-*.pq")) == [
+        "batch-000004.pq",
+    ]
+    replayed = pd.concat(list(log.replay()))
+    assert list(replayed["image_id"]) == [1000, 1001, 1003, 1004, 1005]
+    # Deleted pipeline images are applied again to every loaded index
+    assert log.deleted_ids == [7]
@@ -0,0 +1,149 @@
+import faiss
+import numpy as np
+import pytest
+
+from app.services.online_index import OnlineIndex
+from app.services.sharded_index import ShardedIndex
+
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).random((count, 8), np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+@pytest.fixture()
+def vectors() -> np.ndarray:
+    return _vectors(100)
+
+
+@pytest.fixture()
+def main(vectors) -> faiss.Index:
+    # A plain IndexIDMap, which cannot reconstruct vectors by id
+    index = faiss.IndexIDMap(faiss.IndexFlatIP(8))
+    index.add_with_ids(vectors, np.arange(100))
+    return index
+
+
+def _exact(vectors: np.ndarray, ids: np.ndarray) -> faiss.Index:
+    index = faiss.IndexIDMap(faiss.IndexFlatIP(8))
+    index.add_with_ids(vectors, ids)
+    return index
+
+
+def test_added_images_are_searched_with_the_main_index(main, vectors) -> None:
+    online = OnlineIndex(main)
+    added = _vectors(5, seed=1)
+
+    online.add(np.arange(1000, 1005), added)
+
+    assert online.delta_size == 5
+    assert online.ntotal == 105
+    expected = _exact(
+        np.vstack([vectors, added]),
+        np.concatenate([np.arange(100), np.arange(1000, 1005)]),
+    )
+    queries = _vectors(10, seed=2)
+    assert np.array_equal(
+        online.search(queries, 10)[1],
+        expected.search(queries, 10)[1],
+    )
+
+
+def test_remove_tombstones_images_of_a_plain_id_map(main, vectors) -> None:
+    online = OnlineIndex(main)
+
+    assert online.contains(7)
+    assert online.remove(np.array([7, 8, 500])) == 2
+
+    assert not online.contains(7)
+    assert online.tombstones == 2
+    assert online.ntotal == 98
+    _, ids = online.search(vectors[7:8], 5)
+    assert 7 not in ids[0]
+    # Removing an image twice does not count it twice
+    assert online.remove(np.array([7])) == 0
+
+
+def test_remove_deletes_added_images_from_the_delta(main) -> None:
+    online = OnlineIndex(main)
+    online.add(np.array([1000]), _vectors(1, seed=1))
+
+    assert online.contains(1000)
+    assert online.remove(np.array([1000])) == 1
+
+    assert not online.contains(1000)
+    assert online.delta_size == 0
+    assert online.tombstones == 0
+
+
+def test_filtered_search_leaves_out_tombstones(main, vectors) -> None:
+    online = OnlineIndex(main)
+    online.remove(np.array([3]))
+    params = faiss.SearchParameters(
+        sel=faiss.IDSelectorBatch(np.array([3, 4, 5])),
+    )
+
+    _, ids = online.search(vectors[3:4], 3, params=params)
+
+    assert sorted(ids[0]) == [-1, 4, 5]
+
+
+def test_compact_merges_delta_and_applies_tombstones(main, vectors) -> None:
+    online = OnlineIndex(main)
+    added = _vectors(3, seed=1)
+    online.add(np.array([1000, 1001, 1002]), added)
+    online.remove(np.array([1, 1001]))
+
+    assert online.compact() == (2, 1)
+
+    assert online.delta_size == 0
+    assert online.tombstones == 0
+    assert main.ntotal == 101
+    assert online.contains(1000)
+    assert not online.contains(1)
+    assert not online.contains(1001)
+    # Compacted images can be deleted again
+    assert online.remove(np.array([1000])) == 1
+    _, ids = online.search(added[:1], 1)
+    assert ids[0][0] != 1000
+
+
+def test_contains_looks_up_sharded_indexes(vectors) -> None:
+    shards = [faiss.IndexIDMap(faiss.IndexFlatIP(8)) for _ in range(2)]
+    for number, shard in enumerate(shards):
+        ids = np.arange(number, 100, 2)
+        shard.add_with_ids(vectors[ids], ids)
+    online = OnlineIndex(ShardedIndex(shards))
+
+    try:
+        assert online.contains(41)
+        assert not online.contains(100)
+        assert online.remove(np.array([41])) == 1
+        assert not online.contains(41)
+    finally:
+        online.close()
+
+
+@pytest.mark.parametrize("sharded", [False, True])
+def test_delta_scores_like_a_projecting_main_index(vectors, sharded) -> None:
+    main = faiss.IndexIDMap2(
+        faiss.IndexPreTransform(faiss.PCAMatrix(8, 4), faiss.IndexFlatIP(4)),
+    )
+    main.train(vectors)
+    expected = faiss.clone_index(main)
+    expected.add_with_ids(vectors, np.arange(100))
+    main.add_with_ids(vectors[:90], np.arange(90))
+    online = OnlineIndex(ShardedIndex([main]) if sharded else main)
+
+    online.add(np.arange(90, 100), vectors[90:])
+
+    # The delta projects the added images like the main index would
+    query = vectors[90:95]
+    distances, ids = online.search(query, 5)
+    expected_distances, expected_ids = expected.search(query, 5)
+    assert np.array_equal(ids, expected_ids)
+    assert np.allclose(distances, expected_distances, atol=1e-5)
+    online.compact()
+    assert np.allclose(online.search(query, 5)[0], distances, atol=1e-5)
+    online.close()
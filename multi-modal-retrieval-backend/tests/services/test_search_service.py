@@ -0,0 +1,162 @@
+import asyncio
+
+import faiss
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app.services.lexical_index import LexicalIndex
+from app.services.search_service import _reciprocal_rank_fusion
+from tests.fakes import DIMENSION, FakeCaptioner, jpeg
+
+
+@pytest.fixture()
+def lexical_index() -> LexicalIndex:
+    return LexicalIndex(
+        {
+            "token_pattern": r"\w+",
+            "terms": {
+                "red": {"ids": [1, 2, 3], "weights": [0.5, 1.5, 1.0]},
+                "car": {"ids": [2, 4], "weights": [0.5, 2.5]},
+            },
+        },
+    )
+
+
+def test_reciprocal_rank_fusion_favours_images_in_both_rankings() -> None:
+    scores, ids = _reciprocal_rank_fusion(
+        [np.array([1, 2, 3]), np.array([3, 4])],
+        k=60,
+        limit=3,
+    )
+
+    assert ids.tolist() == [3, 1, 2]
+    assert scores[0] == pytest.approx(1 / 63 + 1 / 61)
+    assert scores[1] == pytest.approx(1 / 61)
+
+
+def test_lexical_search_sums_the_weights_of_query_terms(lexical_index) -> None:
+    scores, ids = lexical_index.search("A red CAR", 3)
+
+    assert ids.tolist() == [4, 2, 3]
+    assert scores.tolist() == pytest.approx([2.5, 2.0, 1.0])
+
+
+def test_lexical_search_is_restricted_to_allowed_ids(lexical_index) -> None:
+    _, ids = lexical_index.search("red car", 10, np.array([1, 3]))
+
+    assert ids.tolist() == [3, 1]
+    assert len(lexical_index.search("boat", 10)[1]) == 0
+
+
+def test_lexical_index_adds_and_removes_images(lexical_index) -> None:
+    lexical_index.add(np.array([10, 11]), ["red boat", "a boat on a lake"])
+
+    scores, ids = lexical_index.search("boat", 10)
+    # The shorter text weighs the term more
+    assert ids.tolist() == [10, 11]
+    assert scores[0] > scores[1] > 0
+    assert 10 in lexical_index.search("red", 10)[1]
+
+    lexical_index.remove(np.array([2, 10]))
+
+    assert lexical_index.search("red", 10)[1].tolist() == [3, 1]
+    assert lexical_index.search("boat", 10)[1].tolist() == [11]
+
+
+def test_hybrid_search_fuses_vector_and_lexical_rankings(
+    search,
+    fake_models,
+    lexical_index,
+) -> None:
+    vectors = np.random.default_rng(0).random((10, DIMENSION), np.float32)
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(DIMENSION))
+    index.add_with_ids(vectors, np.arange(10))
+    fake_models.features = {
+        str(image_id): {"image_data": jpeg((0, 0, 0))} for image_id in range(10)
+    }
+
+    response = asyncio.run(
+        search.search_by_text(
+            "red car",
+            5,
+            False,
+            index,
+            hybrid=True,
+            lexical_index=lexical_index,
+        ),
+    )
+
+    _, vector_ids = search.faiss_service.search(index, "red car", 100)
+    _, lexical_ids = lexical_index.search("red car", 100)
+    scores, ids = _reciprocal_rank_fusion([vector_ids, lexical_ids], 60, 5)
+    assert [result.image_id for result in response.results] == ids.tolist()
+    assert [result.distance for result in response.results] == pytest.approx(
+        scores.tolist(),
+    )
+
+
+def test_hybrid_search_keeps_min_score(
+    search,
+    fake_models,
+    lexical_index,
+) -> None:
+    vectors = np.random.default_rng(0).random((10, DIMENSION), np.float32)
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(DIMENSION))
+    index.add_with_ids(vectors, np.arange(10))
+    fake_models.features = {
+        str(image_id): {"image_data": jpeg((0, 0, 0))} for image_id in range(10)
+    }
+    scores, ids = search.faiss_service.search(index, "red car", 10)
+    min_score = float(scores[4])
+    above = ids[:4].tolist()
+
+    response = asyncio.run(
+        search.search_by_text(
+            "red car",
+            10,
+            False,
+            index,
+            min_score=min_score,
+            hybrid=True,
+            lexical_index=lexical_index,
+        ),
+    )
+
+    # Lexical hits scoring below the threshold are left out
+    assert sorted(result.image_id for result in response.results) == sorted(
+        above,
+    )
+
+
+def test_hybrid_search_needs_a_lexical_index(search) -> None:
+    index = faiss.IndexFlatIP(DIMENSION)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(search.search_by_text("red", 5, False, index, hybrid=True))
+
+    assert error.value.status_code == 400
+
+
+def test_images_are_captioned_in_one_batch(search, captioner) -> None:
+    images = {str(width): jpeg((0, 0, 0), width) for width in (1, 2, 3)}
+
+    captions = asyncio.run(search._generate_captions(["1", "2", "3"], images))
+
+    assert captions == ["1 pixels wide", "2 pixels wide", "3 pixels wide"]
+    assert captioner.batches == [3]
+
+
+@pytest.mark.parametrize("captioner", [FakeCaptioner(failing_widths=(2,))])
+def test_only_the_image_that_fails_loses_its_caption(
+    search,
+    captioner,
+) -> None:
+    images = {str(width): jpeg((0, 0, 0), width) for width in (1, 2, 3)}
+
+    captions = asyncio.run(search._generate_captions(["1", "2", "3"], images))
+
+    assert captions == ["1 pixels wide", None, "3 pixels wide"]
+    assert captioner.batches == [3, 1, 1, 1]
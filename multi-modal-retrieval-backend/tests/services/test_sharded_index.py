@@ -0,0 +1,99 @@
+from collections.abc import Iterator
+
+import faiss
+import numpy as np
+import pytest
+
+from app.services.sharded_index import ShardedIndex
+
+NUM_SHARDS = 3
+
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).random((count, 8), np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _index(vectors: np.ndarray, ids: np.ndarray) -> faiss.Index:
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(8))
+    index.add_with_ids(vectors[ids], ids)
+    return index
+
+
+@pytest.fixture()
+def vectors() -> np.ndarray:
+    return _vectors(300)
+
+
+@pytest.fixture()
+def sharded(vectors) -> Iterator[ShardedIndex]:
+    # Shards the way the pipeline does, image_id % num_shards
+    ids = np.arange(len(vectors))
+    index = ShardedIndex(
+        [
+            _index(vectors, ids[ids % NUM_SHARDS == number])
+            for number in range(NUM_SHARDS)
+        ],
+    )
+    yield index
+    index.close()
+
+
+@pytest.fixture()
+def exact(vectors) -> faiss.Index:
+    return _index(vectors, np.arange(len(vectors)))
+
+
+def test_merged_results_equal_a_single_index(sharded, exact) -> None:
+    queries = _vectors(20, seed=1)
+
+    distances, indices = sharded.search(queries, 10)
+
+    expected_distances, expected_indices = exact.search(queries, 10)
+    assert np.array_equal(indices, expected_indices)
+    assert np.allclose(distances, expected_distances)
+    assert sharded.ntotal == exact.ntotal
+
+
+def test_selector_filters_every_shard(sharded, exact) -> None:
+    queries = _vectors(5, seed=1)
+    allowed_ids = np.array([4, 10, 11, 200, 299])
+
+    _, indices = sharded.search(
+        queries,
+        5,
+        params=faiss.SearchParameters(sel=faiss.IDSelectorBatch(allowed_ids)),
+    )
+
+    expected = exact.search(
+        queries,
+        5,
+        params=faiss.SearchParameters(sel=faiss.IDSelectorBatch(allowed_ids)),
+    )[1]
+    assert np.array_equal(indices, expected)
+
+
+def test_range_search_collects_results_of_every_shard(sharded, exact) -> None:
+    queries = _vectors(3, seed=1)
+
+    lims, _, labels = sharded.range_search(queries, 0.9)
+
+    expected_lims, _, expected_labels = exact.range_search(queries, 0.9)
+    for query in range(len(queries)):
+        assert sorted(labels[lims[query] : lims[query + 1]]) == sorted(
+            expected_labels[expected_lims[query] : expected_lims[query + 1]],
+        )
+
+
+def test_ids_are_added_to_and_removed_from_their_shard(sharded) -> None:
+    added = _vectors(3, seed=2)
+
+    sharded.add_with_ids(added, np.array([1000, 1001, 1002]))
+
+    assert [shard.ntotal for shard in sharded.shards] == [101, 101, 101]
+    assert np.allclose(sharded.reconstruct(1001), added[1])
+    assert np.allclose(sharded.shards[2].reconstruct(1001), added[1])
+
+    assert sharded.remove_ids(np.array([1000, 1001, 5])) == 3
+    assert [shard.ntotal for shard in sharded.shards] == [101, 100, 99]
@@ -30,6 +30,9 @@ log_message "Using Python from: $(which python)"
 log_message "Setting up feature store..."
 mkdir -p feature_data
 cp "../multi-modal-retrieval-pipeline/data/04_feature/embeddings.pq" "feature_data/embeddings.pq"
+cp -r "../multi-modal-retrieval-pipeline/data/04_feature/embedding_matrix" "feature_data/"
+cp "../multi-modal-retrieval-pipeline/data/06_models/near_duplicates.json" "feature_data/" 2>/dev/null || true
+cp "../multi-modal-retrieval-pipeline/data/06_models/image_manifest.json" "feature_data/" 2>/dev/null || true
 
 # Install requirements
 log_message "Installing requirements..."
@@ -1,9 +1,11 @@
+import json
 import subprocess
 import sys
 from datetime import datetime, timedelta
 from pathlib import Path
 
 import logging_config
+import numpy as np
 import pandas as pd
 from feast import FeatureStore
 from utils import timing_decorator
@@ -48,11 +50,28 @@ def prepare_data() -> bool | None:
         df = pd.read_parquet("feature_data/embeddings.pq", engine="pyarrow")
         logger.info("Found %d records in embeddings file", len(df))
 
+        # Near-duplicates are not indexed by the pipeline, so they are not
+        # stored either
+        near_duplicates = Path("feature_data/near_duplicates.json")
+        if near_duplicates.exists():
+            with near_duplicates.open(encoding="utf-8") as f:
+                duplicate_ids = json.load(f)["duplicate_ids"]
+            duplicates = df["image_id"].isin(duplicate_ids)
+            df = df[~duplicates]
+            logger.info("Skipped %d near-duplicate images", duplicates.sum())
+
+        # Embeddings are stored apart from the image bytes as a float32 or
+        # float16 matrix, Feast stores them as float32
+        ids = np.load("feature_data/embedding_matrix/ids.npy")
+        vectors = np.load("feature_data/embedding_matrix/vectors.npy")
+        vectors = vectors.astype(np.float32, copy=False)
+        embeddings = pd.Series(list(vectors), index=ids)
+
         feast_df = pd.DataFrame(
             {
                 "image_id": df["image_id"],
                 "image_data": df["image_data"],
-                "embedding": df["embedding"],
+                "embedding": df["image_id"].map(embeddings),
                 "image_tag": df["image_tag"],
                 "event_timestamp": datetime.now(),
             },
@@ -75,6 +94,34 @@ def prepare_data() -> bool | None:
         return False
 
 
+@timing_decorator
+def remove_deleted_images(store: FeatureStore) -> None:
+    """Remove images deleted by an incremental pipeline run from the store."""
+    manifest_path = Path("feature_data/image_manifest.json")
+    if not manifest_path.exists():
+        return
+    with manifest_path.open(encoding="utf-8") as f:
+        deleted_ids = json.load(f)["deleted_ids"]
+    if not deleted_ids:
+        return
+
+    # Feast cannot delete single entities from the online store, so the
+    # image bytes, embeddings and tags of deleted images are set to null
+    store.write_to_online_store(
+        "image_features",
+        pd.DataFrame(
+            {
+                "image_id": deleted_ids,
+                "image_data": None,
+                "embedding": None,
+                "image_tag": None,
+                "event_timestamp": datetime.now(),
+            },
+        ),
+    )
+    logger.info("Removed %d deleted images", len(deleted_ids))
+
+
 def initialize_store() -> None:
     """Initialize and populate the feature store."""
     try:
@@ -97,6 +144,7 @@ def initialize_store() -> None:
             start_date=start_date,
             end_date=end_date,
         )
+        remove_deleted_images(store)
 
         logger.info("\nFeature store initialized successfully!")
     except Exception as e:
@@ -1,11 +1,29 @@
+import json
 import logging
 import logging.config
+import sys
 import time
+import tracemalloc
+from collections.abc import Sized
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
 from kedro.framework.hooks import hook_impl
+from kedro.io import DataCatalog
+from kedro.pipeline import Pipeline
 from kedro.pipeline.node import Node
+from kedro_datasets.partitions import PartitionedDataset
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Node tag declaring the dataset whose length counts the items a node
+# processes, e.g. ``items.partitioned_images``. Transcoded datasets are
+# named without their suffix, ``items.embeddings`` for ``embeddings@parquet``
+ITEMS_TAG_PREFIX = "items."
 
 
 class PipelineLoggingHook:
@@ -78,3 +96,241 @@ class PipelineLoggingHook:
 
     def __init__(self) -> None:
         self._timings = {}
+
+
+class PipelinePerformanceHook:
+    """Hook recording dataset I/O, memory and throughput of a pipeline run.
+
+    Every dataset load and save is timed and sized on disk, except
+    partitioned datasets, whose files are not listed on every access.
+    Every node records its wall time and the peak RSS of the process,
+    and with ``trace_memory`` the change in memory traced by
+    ``tracemalloc``. Nodes tagged ``items.<dataset>``
+    also report items per second, counted from the length of that input
+    or output. A node is measured until its outputs are saved, so lazily
+    streamed outputs are included. At the end of the run the report is
+    written as JSON to ``logs/performance/``.
+    """
+
+    def __init__(
+        self,
+        report_dir: str = "logs/performance",
+        trace_memory: bool = False,
+    ) -> None:
+        self._report_dir = Path(report_dir)
+        # tracemalloc slows down allocation heavy code such as embedding
+        # images, so it only runs when asked for
+        self._trace_memory = trace_memory
+        self._catalog = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._run_started = None
+        self._started_tracing = False
+        self._io_starts = {}
+        self._nodes = {}
+        self._node_reports = []
+        self._dataset_reports = []
+
+    @hook_impl
+    def before_pipeline_run(self, catalog: DataCatalog) -> None:
+        """Start measuring a pipeline run."""
+        self._reset()
+        self._catalog = catalog
+        self._run_started = (time.perf_counter(), datetime.now(timezone.utc))
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @hook_impl
+    def before_dataset_loaded(self, dataset_name: str, node: Node) -> None:
+        """Start timing a dataset load."""
+        self._io_starts["load", dataset_name, node.name] = time.perf_counter()
+
+    @hook_impl
+    def after_dataset_loaded(
+        self,
+        dataset_name: str,
+        data: Any,
+        node: Node,
+    ) -> None:
+        """Record the duration and size of a dataset load."""
+        self._record_io("load", dataset_name, node)
+        self._keep_items(node, dataset_name, data)
+
+    @hook_impl
+    def before_dataset_saved(self, dataset_name: str, node: Node) -> None:
+        """Start timing a dataset save."""
+        self._io_starts["save", dataset_name, node.name] = time.perf_counter()
+
+    @hook_impl
+    def after_dataset_saved(
+        self,
+        dataset_name: str,
+        data: Any,
+        node: Node,
+    ) -> None:
+        """Record the duration and size of a dataset save."""
+        self._record_io("save", dataset_name, node)
+        self._keep_items(node, dataset_name, data)
+
+        state = self._nodes.get(node.name)
+        if state is not None:
+            state["unsaved"].discard(dataset_name)
+            if not state["unsaved"] and "computed" in state:
+                self._finish_node(node)
+
+    @hook_impl
+    def before_node_run(self, node: Node) -> None:
+        """Start measuring a node."""
+        state = self._nodes.setdefault(node.name, {})
+        state["started"] = time.perf_counter()
+        state["unsaved"] = set(node.outputs)
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            state["traced"] = tracemalloc.get_traced_memory()[0]
+
+    @hook_impl
+    def after_node_run(self, node: Node, outputs: dict[str, Any]) -> None:
+        """Stop measuring a node, or wait for its outputs to be saved."""
+        state = self._nodes[node.name]
+        state["computed"] = time.perf_counter()
+        for dataset_name, data in outputs.items():
+            self._keep_items(node, dataset_name, data)
+        if not state["unsaved"]:
+            self._finish_node(node)
+
+    @hook_impl
+    def after_pipeline_run(
+        self,
+        run_params: dict[str, Any],
+        pipeline: Pipeline,
+    ) -> None:
+        """Write the performance report of a successful run."""
+        self._write_report(run_params, "success")
+
+    @hook_impl
+    def on_pipeline_error(
+        self,
+        error: Exception,
+        run_params: dict[str, Any],
+        pipeline: Pipeline,
+    ) -> None:
+        """Write the performance report of a failed run."""
+        self._write_report(run_params, "failed", error)
+
+    def _record_io(self, operation: str, dataset_name: str, node: Node) -> None:
+        started = self._io_starts.pop((operation, dataset_name, node.name))
+        self._dataset_reports.append(
+            {
+                "dataset": dataset_name,
+                "operation": operation,
+                "node": node.name,
+                "duration_seconds": time.perf_counter() - started,
+                "bytes": self._dataset_bytes(dataset_name),
+            },
+        )
+
+    def _dataset_bytes(self, dataset_name: str) -> int | None:
+        # Size on disk of the file or directory the dataset points to
+        try:
+            dataset = self._catalog._get_dataset(dataset_name)
+            # Sizing would stat every partition twice per run
+            if isinstance(dataset, PartitionedDataset):
+                return None
+            description = dataset._describe()
+        except Exception:
+            return None
+
+        location = description.get("filepath") or description.get("path")
+        if location is None:
+            return None
+        path = Path(str(location))
+        if path.is_file():
+            return path.stat().st_size
+        if path.is_dir():
+            return sum(
+                file.stat().st_size
+                for file in path.rglob("*")
+                if file.is_file()
+            )
+        return None
+
+    def _keep_items(self, node: Node, dataset_name: str, data: Any) -> None:
+        if ITEMS_TAG_PREFIX + dataset_name.split("@")[0] in node.tags:
+            self._nodes.setdefault(node.name, {})["items"] = data
+
+    def _finish_node(self, node: Node) -> None:
+        state = self._nodes.pop(node.name)
+        duration = time.perf_counter() - state["started"]
+        report = {
+            "node": node.name,
+            "duration_seconds": duration,
+            "compute_seconds": state["computed"] - state["started"],
+            "peak_rss_bytes": _peak_rss_bytes(),
+        }
+
+        if "traced" in state and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report["tracemalloc_delta_bytes"] = current - state["traced"]
+            report["tracemalloc_peak_bytes"] = peak - state["traced"]
+
+        items = _count_items(state.get("items"))
+        if items is not None:
+            report["items"] = items
+            report["items_per_second"] = items / duration if duration else None
+
+        self._node_reports.append(report)
+
+    def _write_report(
+        self,
+        run_params: dict[str, Any],
+        status: str,
+        error: Exception | None = None,
+    ) -> None:
+        if self._run_started is None:
+            return
+
+        started, started_at = self._run_started
+        report = {
+            "session_id": run_params.get("session_id"),
+            "pipeline_name": run_params.get("pipeline_name"),
+            "status": status,
+            "error": str(error) if error is not None else None,
+            "started_at": started_at.isoformat(),
+            "duration_seconds": time.perf_counter() - started,
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "nodes": self._node_reports,
+            "datasets": self._dataset_reports,
+        }
+
+        self._report_dir.mkdir(parents=True, exist_ok=True)
+        report_path = (
+            self._report_dir
+            / f"performance_{started_at.strftime('%Y-%m-%dT%H.%M.%S.%fZ')}.json"
+        )
+        report_path.write_text(json.dumps(report, indent=2))
+        logging.getLogger(__name__).info(
+            "Performance report written to %s",
+            report_path,
+        )
+
+        if self._started_tracing:
+            tracemalloc.stop()
+        self._run_started = None
+
+
+def _peak_rss_bytes() -> int | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _count_items(data: Any) -> int | None:
+    # Lazy streams expose the rows they produced once they have been saved
+    if isinstance(data, Sized):
+        return len(data)
+    rows = getattr(data, "rows", None)
+    return rows if isinstance(rows, int) else None
@@ -0,0 +1,175 @@
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from kedro.io import AbstractDataset
+
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrixWriter,
+)
+
+
+class DataFrameChunks:
+    """Lazy sequence of DataFrame chunks saved as a single dataset.
+
+    Kedro saves an ``Iterator`` output one chunk at a time, calling
+    ``save`` for every chunk. This wrapper is iterable but not an iterator,
+    so the whole stream reaches a single ``save`` call with any runner.
+    The number of rows produced so far is available as ``rows``.
+    """
+
+    def __init__(self, chunks: Iterable[pd.DataFrame]) -> None:
+        self._chunks = chunks
+        self.rows = 0
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        for chunk in self._chunks:
+            self.rows += len(chunk)
+            yield chunk
+
+
+class ChunkedParquetDataset(
+    AbstractDataset[pd.DataFrame | Iterable[pd.DataFrame], pd.DataFrame],
+):
+    """``ChunkedParquetDataset`` writes Parquet files one row group per chunk.
+
+    Saving accepts either a DataFrame or an iterable of DataFrame chunks.
+    Chunks are written as they are produced, so peak memory is bounded by
+    the chunk size rather than by the size of the dataset. The file is
+    written next to its destination and moved into place once complete.
+
+    With ``matrix`` set, an embedding column is not stored in Parquet but
+    streamed into a contiguous float32, or float16, matrix that
+    ``EmbeddingMatrixDataset`` memory-maps, keeping the vectors apart from
+    large image blobs.
+
+    Example:
+    -------
+    ::
+        >>> ChunkedParquetDataset(
+        >>>     filepath="data/04_feature/embeddings.pq",
+        >>>     save_args={"compression": "snappy"},
+        >>>     matrix={
+        >>>         "filepath": "data/04_feature/embedding_matrix",
+        >>>         "column": "embedding",
+        >>>         "id_column": "image_id",
+        >>>         "dtype": "float16",
+        >>>     },
+        >>> )
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        load_args: dict[str, Any] | None = None,
+        save_args: dict[str, Any] | None = None,
+        matrix: dict[str, str] | None = None,
+    ) -> None:
+        """Creates a new instance of ChunkedParquetDataset.
+
+        Args:
+        ----
+            filepath: The location of the Parquet file
+            load_args: Arguments passed to ``pandas.read_parquet``
+            save_args: Arguments passed to ``pyarrow.parquet.ParquetWriter``
+            matrix: Optional 'filepath' of the embedding matrix directory,
+                with the embedding 'column' and 'id_column' to write to it
+                and the 'dtype' of the stored vectors
+        """
+        self._filepath = Path(filepath)
+        self._load_args = load_args or {}
+        self._save_args = save_args or {}
+        self._matrix = matrix
+
+    def _load(self) -> pd.DataFrame:
+        """Loads the whole Parquet file into a DataFrame."""
+        return pd.read_parquet(self._filepath, **self._load_args)
+
+    def _save(self, data: pd.DataFrame | Iterable[pd.DataFrame]) -> None:
+        """Writes a DataFrame or a stream of DataFrame chunks.
+
+        Args:
+        ----
+            data: DataFrame, or iterable of DataFrames sharing one schema
+        """
+        chunks = [data] if isinstance(data, pd.DataFrame) else data
+        self._filepath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._filepath.with_name(f".{self._filepath.name}.tmp")
+
+        writer = None
+        matrix_writer = (
+            EmbeddingMatrixWriter(
+                Path(self._matrix["filepath"]),
+                self._matrix.get("dtype", "float32"),
+            )
+            if self._matrix
+            else None
+        )
+        try:
+            for chunk in chunks:
+                if chunk.empty:
+                    continue
+                if matrix_writer is not None:
+                    column = self._matrix.get("column", "embedding")
+                    matrix_writer.write(
+                        chunk[self._matrix.get("id_column", "image_id")],
+                        chunk[column],
+                    )
+                    chunk = chunk.drop(columns=column)
+                table = pa.Table.from_pandas(
+                    chunk,
+                    schema=writer.schema if writer else None,
+                    preserve_index=False,
+                )
+                if writer is None:
+                    writer = pq.ParquetWriter(
+                        tmp_path,
+                        table.schema,
+                        **self._save_args,
+                    )
+                writer.write_table(table)
+        except Exception:
+            if writer is not None:
+                writer.close()
+            if matrix_writer is not None:
+                matrix_writer.abort()
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        if writer is None:
+            pq.write_table(pa.table({}), tmp_path)
+        else:
+            writer.close()
+        if matrix_writer is not None:
+            matrix_writer.commit()
+        tmp_path.replace(self._filepath)
+
+    def read_chunked(self) -> Iterator[pd.DataFrame]:
+        """Yields the Parquet file one row group at a time."""
+        parquet_file = pq.ParquetFile(self._filepath)
+        columns = self._load_args.get("columns")
+        for index in range(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(index, columns=columns)
+            yield table.to_pandas()
+
+    def write_chunked(
+        self,
+        data: pd.DataFrame | Iterable[pd.DataFrame],
+    ) -> None:
+        """Writes a stream of chunks, one row group per chunk."""
+        self.save(data)
+
+    def _exists(self) -> bool:
+        return self._filepath.exists()
+
+    def _describe(self) -> dict[str, Any]:
+        """Returns a dict that describes the attributes of the dataset."""
+        return {
+            "filepath": self._filepath,
+            "load_args": self._load_args,
+            "save_args": self._save_args,
+            "matrix": self._matrix,
+        }
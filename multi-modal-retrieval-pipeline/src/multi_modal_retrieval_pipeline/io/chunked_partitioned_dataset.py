@@ -0,0 +1,49 @@
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from itertools import islice
+from typing import Any
+
+from kedro_datasets.partitions import PartitionedDataset
+
+
+class ChunkedPartitionedDataset(PartitionedDataset):
+    """``PartitionedDataset`` that can also be read in chunks of partitions.
+
+    ``DaskRunner`` reads datasets through ``read_chunked`` when they provide
+    it, so a node receives an iterator of partition dictionaries instead of
+    a single dictionary covering every file.
+
+    Example:
+    -------
+    ::
+        >>> ChunkedPartitionedDataset(
+        >>>     path="data/01_raw/",
+        >>>     dataset={
+        >>>         "type": (
+        >>>             "multi_modal_retrieval_pipeline.io.raw_bytes_dataset"
+        >>>             ".RawBytesDataset"
+        >>>         ),
+        >>>     },
+        >>>     filename_suffix=".jpg",
+        >>>     chunk_size=1024,
+        >>> )
+    """
+
+    def __init__(self, *, chunk_size: int = 1024, **kwargs: Any) -> None:
+        """Creates a new instance of ChunkedPartitionedDataset.
+
+        Args:
+        ----
+            chunk_size: Number of partitions per chunk
+            **kwargs: Arguments of ``PartitionedDataset``
+        """
+        super().__init__(**kwargs)
+        self._chunk_size = chunk_size
+
+    def read_chunked(
+        self,
+    ) -> Iterator[OrderedDict[str, Callable[[], Any]]]:
+        """Yields the partition load functions ``chunk_size`` at a time."""
+        partitions = iter(self.load().items())
+        while chunk := OrderedDict(islice(partitions, self._chunk_size)):
+            yield chunk
@@ -0,0 +1,219 @@
+import struct
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import numpy as np
+from kedro.io import AbstractDataset
+
+# Fixed size of the .npy header, so it can be rewritten in place with the
+# final row count once every chunk has been streamed to disk
+_HEADER_SIZE = 128
+
+
+@dataclass(frozen=True)
+class EmbeddingMatrix:
+    """Image ids and the float32 embedding matrix rows that belong to them."""
+
+    ids: np.ndarray
+    vectors: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class EmbeddingMatrixChunks:
+    """Lazy sequence of ``EmbeddingMatrix`` chunks saved as a single dataset.
+
+    Like ``DataFrameChunks``, it is iterable but not an iterator, so Kedro
+    hands the whole stream to a single ``save`` call. The number of rows
+    produced so far is available as ``rows``.
+    """
+
+    def __init__(self, chunks: Iterable[EmbeddingMatrix]) -> None:
+        self._chunks = chunks
+        self.rows = 0
+
+    def __iter__(self) -> Iterator[EmbeddingMatrix]:
+        for chunk in self._chunks:
+            self.rows += len(chunk)
+            yield chunk
+
+
+class EmbeddingMatrixWriter:
+    """Stream ids and embedding rows into ``ids.npy`` and ``vectors.npy``.
+
+    Rows are appended to temporary files as they arrive. :meth:`commit`
+    writes the final shapes into the headers and moves both files into
+    place, :meth:`abort` discards them. Vectors are stored as ``dtype``,
+    float32 by default or float16 to halve the matrix on disk.
+    """
+
+    def __init__(self, path: Path, dtype: str = "float32") -> None:
+        self._path = path
+        self._dtype = np.dtype(dtype).newbyteorder("<")
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._files: dict[str, BinaryIO] = {}
+        self._rows = 0
+        self._dimension = 0
+        for name in ("ids", "vectors"):
+            file = self._tmp_path(name).open("wb")
+            file.write(b"\0" * _HEADER_SIZE)
+            self._files[name] = file
+
+    def _tmp_path(self, name: str) -> Path:
+        return self._path / f".{name}.npy.tmp"
+
+    def write(self, ids: Iterable[int], vectors: Iterable[np.ndarray]) -> None:
+        """Append embedding rows and their ids."""
+        ids = np.asarray(ids, dtype="<i8")
+        if not len(ids):
+            return
+        # Matrices are used as they are, rows such as a DataFrame column of
+        # arrays are stacked straight into one matrix without a list copy
+        if isinstance(vectors, np.ndarray) and vectors.dtype != object:
+            vectors = np.asarray(vectors, dtype=self._dtype)
+        else:
+            vectors = np.stack(vectors, dtype=self._dtype)
+        if self._rows and vectors.shape[1] != self._dimension:
+            msg = (
+                f"Embedding dimension {vectors.shape[1]} does not match "
+                f"{self._dimension}"
+            )
+            raise ValueError(msg)
+
+        self._dimension = vectors.shape[1]
+        self._rows += len(ids)
+        self._files["ids"].write(ids.tobytes())
+        self._files["vectors"].write(np.ascontiguousarray(vectors).tobytes())
+
+    def commit(self) -> None:
+        """Finalise the headers and move both files into place."""
+        shapes = {
+            "ids": ("<i8", (self._rows,)),
+            "vectors": (self._dtype.str, (self._rows, self._dimension)),
+        }
+        for name, file in self._files.items():
+            descr, shape = shapes[name]
+            file.seek(0)
+            file.write(_npy_header(descr, shape))
+            file.close()
+            self._tmp_path(name).replace(self._path / f"{name}.npy")
+
+    def abort(self) -> None:
+        """Discard the partially written files."""
+        for name, file in self._files.items():
+            file.close()
+            self._tmp_path(name).unlink(missing_ok=True)
+
+
+def _npy_header(descr: str, shape: tuple[int, ...]) -> bytes:
+    header = repr({"descr": descr, "fortran_order": False, "shape": shape})
+    # Pad with spaces, as numpy does, up to the reserved header size
+    header = header.ljust(_HEADER_SIZE - 11) + "\n"
+    return (
+        np.lib.format.magic(1, 0)
+        + struct.pack("<H", len(header))
+        + header.encode("latin1")
+    )
+
+
+class EmbeddingMatrixDataset(
+    AbstractDataset[
+        EmbeddingMatrix | Iterable[EmbeddingMatrix], EmbeddingMatrix
+    ],
+):
+    """``EmbeddingMatrixDataset`` stores embeddings as a contiguous matrix.
+
+    The dataset is a directory holding ``vectors.npy``, a C-contiguous
+    float32 or float16 matrix with one row per image, and ``ids.npy`` with
+    the image id of every row. Loading memory-maps both files, so the
+    vectors can be handed to FAISS without reading image bytes or copying
+    the matrix. Float16 rows are converted to float32 a batch at a time
+    by their consumers.
+
+    Example:
+    -------
+    ::
+        >>> EmbeddingMatrixDataset(
+        >>>     filepath="data/04_feature/embedding_matrix",
+        >>> )
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        mmap_mode: str | None = "r",
+        chunk_size: int = 65536,
+        dtype: str = "float32",
+    ) -> None:
+        """Creates a new instance of EmbeddingMatrixDataset.
+
+        Args:
+        ----
+            filepath: The directory holding ``ids.npy`` and ``vectors.npy``
+            mmap_mode: Memory-map mode passed to ``numpy.load``, None to
+                read the matrix into memory
+            chunk_size: Number of rows per chunk read by ``read_chunked``
+            dtype: Type the vectors are saved as, 'float32' or 'float16'
+        """
+        self._filepath = Path(filepath)
+        self._mmap_mode = mmap_mode
+        self._chunk_size = chunk_size
+        self._dtype = dtype
+
+    def _load(self) -> EmbeddingMatrix:
+        """Memory-maps the ids and the embedding matrix."""
+        return EmbeddingMatrix(
+            ids=np.load(self._filepath / "ids.npy", mmap_mode=self._mmap_mode),
+            vectors=np.load(
+                self._filepath / "vectors.npy",
+                mmap_mode=self._mmap_mode,
+            ),
+        )
+
+    def _save(self, data: EmbeddingMatrix | Iterable[EmbeddingMatrix]) -> None:
+        """Writes a matrix or a stream of matrix chunks.
+
+        Args:
+        ----
+            data: EmbeddingMatrix, or iterable of chunks of one dimension
+        """
+        chunks = [data] if isinstance(data, EmbeddingMatrix) else data
+        writer = EmbeddingMatrixWriter(self._filepath, self._dtype)
+        try:
+            for chunk in chunks:
+                writer.write(chunk.ids, chunk.vectors)
+        except Exception:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def read_chunked(self) -> Iterator[EmbeddingMatrix]:
+        """Yields ``chunk_size`` row views of the memory-mapped matrix."""
+        matrix = self.load()
+        for start in range(0, len(matrix), self._chunk_size):
+            yield EmbeddingMatrix(
+                ids=matrix.ids[start : start + self._chunk_size],
+                vectors=matrix.vectors[start : start + self._chunk_size],
+            )
+
+    def write_chunked(
+        self,
+        data: EmbeddingMatrix | Iterable[EmbeddingMatrix],
+    ) -> None:
+        """Writes a stream of matrix chunks."""
+        self.save(data)
+
+    def _exists(self) -> bool:
+        return (self._filepath / "vectors.npy").exists()
+
+    def _describe(self) -> dict[str, Any]:
+        """Returns a dict that describes the attributes of the dataset."""
+        return {
+            "filepath": self._filepath,
+            "mmap_mode": self._mmap_mode,
+            "chunk_size": self._chunk_size,
+            "dtype": self._dtype,
+        }
@@ -1,3 +1,11 @@
+import hashlib
+import json
+import logging
+import os
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
@@ -5,10 +13,122 @@ import faiss
 import numpy as np
 from kedro.io import AbstractDataset
 
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrix,
+)
 
-class FaissDataset(AbstractDataset[tuple[np.ndarray, int], faiss.Index]):
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IndexBatches:
+    """FAISS index with batches of vectors still to be added to it.
+
+    Saving adds the batches one at a time, split further into at most
+    ``batch_size`` vectors, so only a single batch of vectors is held in
+    memory next to the index. ``num_threads`` sets the OpenMP threads FAISS
+    uses while adding, None keeps the FAISS default of one per core. With
+    ``normalize`` every vector is scaled to unit L2 norm before it is
+    added, so inner product scores are cosine similarities.
+    """
+
+    index: faiss.Index
+    batches: Iterable[EmbeddingMatrix] = ()
+    batch_size: int | None = None
+    num_threads: int | None = None
+    normalize: bool = False
+    # Recorded in the metadata sidecar, e.g. the 'source_data_version' and
+    # whether the vectors were 'normalized'
+    metadata: dict[str, Any] = field(default_factory=dict)
+
+    def add_all(self) -> faiss.Index:
+        """Add every batch to the index and return it."""
+        added = 0
+        with omp_threads(self.num_threads):
+            for batch in self._split_batches():
+                self.index.add_with_ids(
+                    as_float32(batch.vectors, self.normalize),
+                    np.ascontiguousarray(batch.ids, dtype=np.int64),
+                )
+                added += len(batch)
+                logger.debug("Added %d vectors to the FAISS index", added)
+        logger.info("Added %d vectors to the FAISS index in batches", added)
+        return self.index
+
+    def _split_batches(self) -> Iterator[EmbeddingMatrix]:
+        for batch in self.batches:
+            size = self.batch_size or len(batch)
+            for start in range(0, len(batch), max(size, 1)):
+                yield EmbeddingMatrix(
+                    ids=batch.ids[start : start + size],
+                    vectors=batch.vectors[start : start + size],
+                )
+
+
+def as_float32(vectors: np.ndarray, normalize: bool = False) -> np.ndarray:
+    """Convert vectors to the contiguous float32 rows FAISS expects.
+
+    Args:
+    ----
+        vectors: Vectors of any float type, e.g. rows of a memory-mapped
+            float16 matrix
+        normalize: If True, scale every row to unit L2 norm
+
+    Returns:
+    -------
+        float32 vectors, copied if they had to be converted or normalized
+    """
+    if not normalize:
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+    # Normalized in place, so never in the memory-mapped source
+    vectors = np.array(vectors, dtype=np.float32, order="C")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+@contextmanager
+def omp_threads(num_threads: int | None) -> Iterator[None]:
+    """Temporarily set the number of OpenMP threads used by FAISS.
+
+    Args:
+    ----
+        num_threads: Threads to use, None to leave the setting unchanged
+
+    Yields:
+    ------
+        None, the previous setting is restored on exit
+    """
+    if num_threads is None:
+        yield
+        return
+
+    previous = faiss.omp_get_max_threads()
+    faiss.omp_set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        faiss.omp_set_num_threads(previous)
+
+
+class FaissDataset(AbstractDataset[faiss.Index | IndexBatches, faiss.Index]):
     """``FaissDataset`` loads and saves FAISS indexes with versioning support.
 
+    The index is written to a temporary file, flushed to disk and renamed
+    into place, so readers never see a partially written index. Next to it
+    a JSON sidecar, ``<name>.meta.json``, describes the index: dimension,
+    number of vectors, index type, metric, search parameters, checksum, the
+    version of the data it was built from and whether the vectors were
+    normalized. :meth:`load_metadata` reads it without loading the index.
+    The sidecar is renamed into place before the index and restored if the
+    index cannot be, so a failed save leaves the old pair intact.
+
+    Versioned indexes are saved under ``<version>/<name>`` and the
+    ``<name>.latest`` file next to the versions points at the newest one.
+    Only the pointer moves once a version is complete, so readers following
+    it never pair an index with another's metadata. Unversioned saves
+    rename two files, and a reader between the renames sees the new
+    sidecar next to the old index.
+
     Example:
     -------
     ::
@@ -38,38 +158,39 @@ class FaissDataset(AbstractDataset[tuple[np.ndarray, int], faiss.Index]):
         self._filepath = Path(filepath)
         self._version = version
         self._versioned = is_versioned
+        self._latest_path = self._filepath.with_name(
+            f"{self._filepath.name}.latest",
+        )
 
     def _get_load_path(self) -> Path:
         """Get the full path to load the index file."""
         if not self._versioned:
             return self._filepath
 
-        # Get all versions
-        versions = self._get_versions()
-
         # If version is specified, use it
         if self._version:
-            if self._version not in versions:
+            path = self._get_versioned_path(self._version)
+            if not path.exists():
                 msg = f"Version '{self._version}' not found"
                 raise ValueError(msg)
-            return self._get_versioned_path(self._version)
+            return path
 
         # If no version specified, use latest
-        if versions:
-            latest_version = sorted(versions)[-1]
+        latest_version = self._get_latest_version()
+        if latest_version:
             return self._get_versioned_path(latest_version)
 
         msg = "No versions found for versioned dataset"
         raise ValueError(msg)
 
-    def _get_save_path(self) -> Path:
-        """Get the full path to save the index file."""
-        if not self._versioned:
-            return self._filepath
+    def _get_latest_version(self) -> str | None:
+        """Read the latest version from its pointer file."""
+        if self._latest_path.exists():
+            return self._latest_path.read_text().strip()
 
-        # Generate new version if not specified
-        version = self._version or self._generate_timestamp()
-        return self._get_versioned_path(version)
+        # Indexes saved before the pointer file existed
+        versions = self._get_versions()
+        return versions[-1] if versions else None
 
     def _get_versioned_path(self, version: str) -> Path:
         """Construct the full path for a specific version."""
@@ -111,8 +232,6 @@ class FaissDataset(AbstractDataset[tuple[np.ndarray, int], faiss.Index]):
     def _is_valid_version(version: str) -> bool:
         """Check if a version string is in valid ISO format."""
         try:
-            from datetime import datetime
-
             datetime.strptime(version, "%Y-%m-%dT%H.%M.%S.%fZ")
             return True
         except ValueError:
@@ -121,10 +240,13 @@ class FaissDataset(AbstractDataset[tuple[np.ndarray, int], faiss.Index]):
     @staticmethod
     def _generate_timestamp() -> str:
         """Generate an ISO-8601 timestamp for versioning."""
-        from datetime import datetime
-
         return datetime.utcnow().strftime("%Y-%m-%dT%H.%M.%S.%fZ")
 
+    @staticmethod
+    def metadata_path(index_path: Path) -> Path:
+        """Path of the metadata sidecar of an index file."""
+        return index_path.with_name(f"{index_path.stem}.meta.json")
+
     def _load(self) -> faiss.Index:
         """Loads the FAISS index.
 
@@ -142,35 +264,220 @@ class FaissDataset(AbstractDataset[tuple[np.ndarray, int], faiss.Index]):
             raise ValueError(msg)
         return faiss.read_index(str(load_path))
 
-    def _save(self, index: Any) -> None:
-        """Saves the FAISS index.
+    def load_metadata(self) -> dict[str, Any] | None:
+        """Reads the metadata sidecar without loading the index.
+
+        Returns
+        -------
+            Metadata of the index, or None for an index saved without one
+        """
+        metadata_path = self.metadata_path(self._get_load_path())
+        if not metadata_path.exists():
+            return None
+        return json.loads(metadata_path.read_text())
+
+    def update_metadata(self, metadata: dict[str, Any]) -> None:
+        """Rewrites the metadata sidecar of an index that did not change.
+
+        Args:
+        ----
+            metadata: Entries to add or replace, e.g. the
+                'source_data_version' of the run that kept the index
+
+        Raises:
+        ------
+            ValueError: If the index was saved without a sidecar.
+        """
+        metadata_path = self.metadata_path(self._get_load_path())
+        previous = self.load_metadata()
+        if previous is None:
+            msg = f"No metadata sidecar at {metadata_path}"
+            raise ValueError(msg)
+        _write_atomic(
+            metadata_path,
+            json.dumps(
+                {
+                    **previous,
+                    **metadata,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                },
+                indent=2,
+            ),
+        )
+
+    def _save(self, index: faiss.Index | IndexBatches) -> None:
+        """Saves the FAISS index and its metadata sidecar atomically.
 
         Args:
         ----
-            index: FAISS index to save
+            index: FAISS index to save, or ``IndexBatches`` to add first
 
         Raises:
         ------
             ValueError: If there's an error saving the index.
         """
-        save_path = self._get_save_path()
+        metadata = {}
+        if isinstance(index, IndexBatches):
+            metadata = index.metadata
+            index = index.add_all()
+
+        version = None
+        save_path = self._filepath
+        if self._versioned:
+            # Generate new version if not specified
+            version = self._version or self._generate_timestamp()
+            save_path = self._get_versioned_path(version)
 
         # Create directory if it doesn't exist
         save_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = save_path.with_name(f".{save_path.name}.tmp")
 
+        metadata_path = self.metadata_path(save_path)
+        previous_metadata = (
+            metadata_path.read_text() if metadata_path.exists() else None
+        )
         try:
-            faiss.write_index(index, str(save_path))
+            faiss.write_index(index, str(tmp_path))
+            checksum = _fsync_and_checksum(tmp_path)
+            # The sidecar is in place before the index it describes, so a
+            # failed index rename can put the old sidecar back
+            _write_atomic(
+                metadata_path,
+                json.dumps(
+                    {
+                        **describe_index(index),
+                        "checksum": f"sha256:{checksum}",
+                        "source_data_version": None,
+                        **metadata,
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                    },
+                    indent=2,
+                ),
+            )
+            tmp_path.replace(save_path)
         except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            # The old index stays in place, and so does its sidecar
+            if previous_metadata is None:
+                metadata_path.unlink(missing_ok=True)
+            else:
+                _write_atomic(metadata_path, previous_metadata)
             msg = f"Error saving index: {e}"
             raise ValueError(msg)
 
+        # The pointer moves last, so readers only see complete versions
+        if version is not None:
+            _write_atomic(self._latest_path, str(version))
+        _fsync_directory(save_path.parent)
+
+    def write_chunked(self, index: faiss.Index | IndexBatches) -> None:
+        """Saves the index, adding ``IndexBatches`` one batch at a time."""
+        self.save(index)
+
+    def _exists(self) -> bool:
+        try:
+            return self._get_load_path().exists()
+        except ValueError:
+            return False
+
     def _describe(self) -> dict[str, Any]:
         """Returns a dict that describes the attributes of the dataset."""
         return {
             "filepath": self._filepath,
             "versioned": self._versioned,
             "version": self._version,
-            "available_versions": self._get_versions()
-            if self._versioned
+            "latest_version": self._latest_path.read_text().strip()
+            if self._versioned and self._latest_path.exists()
             else None,
         }
+
+
+def describe_index(index: faiss.Index) -> dict[str, Any]:
+    """Describe the properties of an index that searches depend on.
+
+    Args:
+    ----
+        index: FAISS index to describe
+
+    Returns:
+    -------
+        Dimension, number of vectors, index type, metric, the search
+        parameters of the index and the transforms applied to vectors
+        before they reach it, such as a PCA projection
+    """
+    search_params = {}
+    try:
+        search_params["nprobe"] = faiss.extract_index_ivf(index).nprobe
+    except RuntimeError:
+        pass
+
+    return {
+        "dimension": index.d,
+        "ntotal": index.ntotal,
+        "index_type": _index_type(index),
+        "metric": "inner_product"
+        if index.metric_type == faiss.METRIC_INNER_PRODUCT
+        else "l2",
+        "search_params": search_params,
+        "transforms": _transforms(index),
+    }
+
+
+def _index_type(index: faiss.Index) -> str:
+    index = faiss.downcast_index(index)
+    name = type(index).__name__
+    # Wrappers such as IndexIDMap name the index they wrap
+    inner = getattr(index, "index", None)
+    if isinstance(inner, faiss.Index):
+        name = f"{name}({_index_type(inner)})"
+    return name
+
+
+def _transforms(index: faiss.Index) -> list[dict[str, Any]]:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        return [
+            {
+                "type": type(transform).__name__,
+                "d_in": transform.d_in,
+                "d_out": transform.d_out,
+            }
+            for transform in (
+                faiss.downcast_VectorTransform(index.chain.at(i))
+                for i in range(index.chain.size())
+            )
+        ]
+    inner = getattr(index, "index", None)
+    return _transforms(inner) if isinstance(inner, faiss.Index) else []
+
+
+def _fsync_and_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+        os.fsync(file.fileno())
+    return digest.hexdigest()
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with tmp_path.open("w") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    tmp_path.replace(path)
+
+
+def _fsync_directory(path: Path) -> None:
+    # Persist the renames, not supported on every platform
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,51 @@
+from typing import Any
+
+from kedro.io import AbstractDataset
+
+
+class OptionalDataset(AbstractDataset[Any, Any]):
+    """``OptionalDataset`` loads ``None`` while its wrapped dataset is missing.
+
+    Incremental nodes read the outputs of the previous run through this
+    dataset, so the very first run, when nothing has been written yet,
+    needs no special configuration.
+
+    Example:
+    -------
+    ::
+        >>> OptionalDataset(
+        >>>     dataset={
+        >>>         "type": "json.JSONDataset",
+        >>>         "filepath": "data/02_intermediate/image_manifest.json",
+        >>>     },
+        >>> )
+    """
+
+    def __init__(self, dataset: dict[str, Any]) -> None:
+        """Creates a new instance of OptionalDataset.
+
+        Args:
+        ----
+            dataset: Catalog configuration of the wrapped dataset
+        """
+        self._dataset_config = dataset
+        self._dataset = AbstractDataset.from_config("optional", dataset)
+
+    def _load(self) -> Any:
+        if not self._dataset.exists():
+            self._logger.info(
+                "%s does not exist yet, loading None",
+                self._dataset,
+            )
+            return None
+        return self._dataset.load()
+
+    def _save(self, data: Any) -> None:
+        self._dataset.save(data)
+
+    def _exists(self) -> bool:
+        return self._dataset.exists()
+
+    def _describe(self) -> dict[str, Any]:
+        """Returns a dict that describes the attributes of the dataset."""
+        return {"dataset": self._dataset_config}
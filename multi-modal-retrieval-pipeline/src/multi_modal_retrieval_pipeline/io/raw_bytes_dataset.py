@@ -0,0 +1,41 @@
+from pathlib import Path
+from typing import Any
+
+from kedro.io import AbstractDataset
+
+
+class RawBytesDataset(AbstractDataset[bytes, bytes]):
+    """``RawBytesDataset`` loads and saves the raw bytes of a file.
+
+    Used as the partition dataset of source images, so their original
+    encoded bytes can be stored as they are and decoded only where pixels
+    are needed.
+
+    Example:
+    -------
+    ::
+        >>> RawBytesDataset(filepath="data/01_raw/image.jpg")
+    """
+
+    def __init__(self, filepath: str) -> None:
+        """Creates a new instance of RawBytesDataset.
+
+        Args:
+        ----
+            filepath: The location of the file
+        """
+        self._filepath = Path(filepath)
+
+    def _load(self) -> bytes:
+        return self._filepath.read_bytes()
+
+    def _save(self, data: bytes) -> None:
+        self._filepath.parent.mkdir(parents=True, exist_ok=True)
+        self._filepath.write_bytes(data)
+
+    def _exists(self) -> bool:
+        return self._filepath.exists()
+
+    def _describe(self) -> dict[str, Any]:
+        """Returns a dict that describes the attributes of the dataset."""
+        return {"filepath": self._filepath}
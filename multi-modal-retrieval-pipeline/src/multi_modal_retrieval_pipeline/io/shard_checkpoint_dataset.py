@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+from kedro.io import AbstractDataset, DatasetError
+
+
+class ShardCheckpoint:
+    """Durable store of the shards completed by an embedding run.
+
+    Every completed shard is written to its own Parquet file and recorded
+    in ``manifest.json`` together with a key identifying the planned work.
+    A rerun with the same key resumes after the recorded shards, a run
+    with a different key starts from an empty checkpoint.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._manifest_path = path / "manifest.json"
+        self._manifest = {"key": None, "shards": {}}
+
+    def resume(self, key: str) -> set[int]:
+        """Open the checkpoint for a run and return its completed shards.
+
+        Args:
+        ----
+            key: Identifies the planned work, e.g. a hash of the shards
+
+        Returns:
+        -------
+            Indexes of the shards already completed for this key
+        """
+        if self._manifest_path.exists():
+            manifest = json.loads(self._manifest_path.read_text())
+            if manifest.get("key") == key:
+                self._manifest = manifest
+                return {int(index) for index in manifest["shards"]}
+
+        self.clear()
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._manifest = {"key": key, "shards": {}}
+        self._write_manifest()
+        return set()
+
+    def load_shard(self, index: int) -> pd.DataFrame:
+        """Read back a completed shard."""
+        entry = self._manifest["shards"][str(index)]
+        return pd.read_parquet(self._path / entry["file"])
+
+    def commit_shard(self, index: int, frame: pd.DataFrame) -> None:
+        """Durably store a completed shard, then record it as complete."""
+        filename = f"shard-{index:05d}.pq"
+        tmp_path = self._path / f".{filename}.tmp"
+        frame.to_parquet(tmp_path, index=False)
+        _fsync(tmp_path)
+        tmp_path.replace(self._path / filename)
+
+        self._manifest["shards"][str(index)] = {
+            "file": filename,
+            "rows": len(frame),
+        }
+        self._write_manifest()
+
+    def clear(self) -> None:
+        """Delete every stored shard and the manifest."""
+        shutil.rmtree(self._path, ignore_errors=True)
+
+    def _write_manifest(self) -> None:
+        tmp_path = self._manifest_path.with_name(".manifest.json.tmp")
+        tmp_path.write_text(json.dumps(self._manifest, indent=2))
+        _fsync(tmp_path)
+        tmp_path.replace(self._manifest_path)
+
+
+def _fsync(path: Path) -> None:
+    with path.open("rb") as file:
+        os.fsync(file.fileno())
+
+
+class ShardCheckpointDataset(AbstractDataset[None, ShardCheckpoint]):
+    """``ShardCheckpointDataset`` hands a ``ShardCheckpoint`` to a node.
+
+    Loading does not read any data, it returns the checkpoint stored under
+    ``path`` for the node to resume from and commit shards to as it runs.
+    The dataset exists while shards are stored, until the checkpoint is
+    cleared after the run that used it succeeded.
+
+    Example:
+    -------
+    ::
+        >>> ShardCheckpointDataset(
+        >>>     path="data/02_intermediate/embedding_checkpoint",
+        >>> )
+    """
+
+    def __init__(self, path: str) -> None:
+        """Creates a new instance of ShardCheckpointDataset.
+
+        Args:
+        ----
+            path: The directory holding the shards and their manifest
+        """
+        self._path = Path(path)
+
+    def _load(self) -> ShardCheckpoint:
+        return ShardCheckpoint(self._path)
+
+    def _save(self, data: None) -> None:
+        msg = "Shards are committed through the loaded ShardCheckpoint"
+        raise DatasetError(msg)
+
+    def _exists(self) -> bool:
+        return any(self._path.glob("shard-*.pq"))
+
+    def _describe(self) -> dict[str, Any]:
+        """Returns a dict that describes the attributes of the dataset."""
+        return {"path": self._path}
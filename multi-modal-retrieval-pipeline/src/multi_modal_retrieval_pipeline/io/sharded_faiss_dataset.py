@@ -0,0 +1,202 @@
+import logging
+from pathlib import Path
+from typing import Any
+
+import faiss
+import numpy as np
+from kedro.io import AbstractDataset
+
+from multi_modal_retrieval_pipeline.io.faiss_dataset import (
+    FaissDataset,
+    IndexBatches,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedIndex:
+    """FAISS indexes each holding the vectors of a disjoint set of image ids.
+
+    An image belongs to shard ``image_id % num_shards``, so sequential ids
+    spread evenly over the shards and an image is always added to, and
+    removed from, the same shard. The shards record which of them were
+    changed, so only those need to be saved again.
+    """
+
+    def __init__(self, shards: list[faiss.Index]) -> None:
+        self.shards = shards
+        self.changed = set()
+
+    @classmethod
+    def empty(cls, index: faiss.Index, num_shards: int) -> "ShardedIndex":
+        """Create shards that are copies of an empty, trained index."""
+        sharded = cls([faiss.clone_index(index) for _ in range(num_shards)])
+        sharded.changed = set(range(num_shards))
+        return sharded
+
+    @property
+    def d(self) -> int:
+        return self.shards[0].d
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.ntotal for shard in self.shards)
+
+    @property
+    def metric_type(self) -> int:
+        return self.shards[0].metric_type
+
+    def shard_of(self, ids: np.ndarray) -> np.ndarray:
+        """Shard number of every image id."""
+        return np.asarray(ids, dtype=np.int64) % len(self.shards)
+
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+        shard_numbers = self.shard_of(ids)
+        for number in np.unique(shard_numbers):
+            rows = shard_numbers == number
+            self.shards[number].add_with_ids(
+                np.ascontiguousarray(vectors[rows]),
+                np.ascontiguousarray(ids[rows], dtype=np.int64),
+            )
+            self.changed.add(int(number))
+
+    def remove_ids(self, ids: np.ndarray) -> int:
+        ids = np.asarray(ids, dtype=np.int64)
+        shard_numbers = self.shard_of(ids)
+        removed = 0
+        for number in np.unique(shard_numbers):
+            count = self.shards[number].remove_ids(ids[shard_numbers == number])
+            if count:
+                self.changed.add(int(number))
+            removed += count
+        return removed
+
+    def search(
+        self,
+        vectors: np.ndarray,
+        k: int,
+        params: faiss.SearchParameters | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Search every shard and merge their results into the best ``k``."""
+        heap = faiss.ResultHeap(
+            len(vectors),
+            k,
+            keep_max=self.metric_type == faiss.METRIC_INNER_PRODUCT,
+        )
+        for shard in self.shards:
+            heap.add_result(*shard.search(vectors, k, params=params))
+        heap.finalize()
+        return heap.D, heap.I
+
+
+class ShardedFaissDataset(
+    AbstractDataset[faiss.Index | IndexBatches, ShardedIndex],
+):
+    """``ShardedFaissDataset`` splits a FAISS index into shards by image id.
+
+    It takes the place of ``FaissDataset`` in the catalog and saves the same
+    ``IndexBatches``. Their vectors are added to ``num_shards`` copies of
+    the index, by ``image_id % num_shards``, and every shard is saved by a
+    ``FaissDataset`` as ``shard-<number>.idx`` with its metadata sidecar.
+    The backend searches the shards in parallel and merges their results.
+
+    Every shard is a complete index of its images, so one can be rebuilt
+    or replaced without touching the others. An incremental update only
+    writes the shards whose images changed, the sidecars of the others are
+    rewritten with the metadata of the run, so all of them agree on it.
+
+    Example:
+    -------
+    ::
+        >>> ShardedFaissDataset(
+        >>>     path="data/06_models/faiss_shards",
+        >>>     num_shards=4,
+        >>> )
+    """
+
+    def __init__(self, path: str, num_shards: int) -> None:
+        """Creates a new instance of ShardedFaissDataset.
+
+        Args:
+        ----
+            path: Directory the shards are saved in
+            num_shards: Number of shards the index is split into
+        """
+        if num_shards < 1:
+            msg = f"Need at least one shard, got {num_shards}"
+            raise ValueError(msg)
+        self._path = Path(path)
+        self._num_shards = num_shards
+
+    def _shard_dataset(self, number: int) -> FaissDataset:
+        return FaissDataset(
+            filepath=str(self._path / f"shard-{number:03d}.idx")
+        )
+
+    def _load(self) -> ShardedIndex:
+        saved = sorted(self._path.glob("shard-*.idx"))
+        if len(saved) != self._num_shards:
+            msg = (
+                f"Found {len(saved)} shards in {self._path} instead of "
+                f"{self._num_shards}, run with 'incremental: false' to "
+                "rebuild them"
+            )
+            raise ValueError(msg)
+        return ShardedIndex(
+            [self._shard_dataset(i).load() for i in range(self._num_shards)],
+        )
+
+    def _save(self, data: faiss.Index | IndexBatches) -> None:
+        if not isinstance(data, IndexBatches):
+            data = IndexBatches(data)
+        sharded = data.index
+        if not isinstance(sharded, ShardedIndex):
+            sharded = ShardedIndex.empty(sharded, self._num_shards)
+        elif len(sharded.shards) != self._num_shards:
+            msg = (
+                f"Cannot save {len(sharded.shards)} shards as "
+                f"{self._num_shards}"
+            )
+            raise ValueError(msg)
+
+        IndexBatches(
+            sharded,
+            data.batches,
+            batch_size=data.batch_size,
+            num_threads=data.num_threads,
+            normalize=data.normalize,
+        ).add_all()
+
+        for number, shard in enumerate(sharded.shards):
+            dataset = self._shard_dataset(number)
+            metadata = {
+                **data.metadata,
+                "shard": number,
+                "num_shards": self._num_shards,
+            }
+            if (
+                number not in sharded.changed
+                and dataset.exists()
+                and dataset.load_metadata() is not None
+            ):
+                # Every sidecar describes the same run, changed or not
+                dataset.update_metadata(metadata)
+                logger.info(
+                    "Shard %d is unchanged, updated its metadata", number
+                )
+                continue
+            dataset.save(IndexBatches(shard, metadata=metadata))
+            logger.info("Saved shard %d with %d vectors", number, shard.ntotal)
+
+        # Shards left over from a run with more of them
+        for path in self._path.glob("shard-*.idx"):
+            if int(path.stem.split("-")[1]) >= self._num_shards:
+                path.unlink()
+                FaissDataset.metadata_path(path).unlink(missing_ok=True)
+
+    def _exists(self) -> bool:
+        return any(self._path.glob("shard-*.idx"))
+
+    def _describe(self) -> dict[str, Any]:
+        """Returns a dict that describes the attributes of the dataset."""
+        return {"path": self._path, "num_shards": self._num_shards}
@@ -1,15 +1,34 @@
+import hashlib
 import io
+import json
 import logging
 from collections import OrderedDict
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from functools import lru_cache, partial
+from itertools import chain
+from pathlib import Path
 from typing import Any
 
+import numpy as np
 import pandas as pd
+from distributed import Client
 from PIL import Image
 from sentence_transformers import SentenceTransformer
 
+from multi_modal_retrieval_pipeline.io.chunked_parquet_dataset import (
+    DataFrameChunks,
+)
+from multi_modal_retrieval_pipeline.io.shard_checkpoint_dataset import (
+    ShardCheckpoint,
+)
+
+from .prefetch import prefetch_batches
+from .sharding import dask_client, map_shards, split_shards
+
 logger = logging.getLogger(__name__)
 
+Partitions = OrderedDict[str, Callable[[], Any]]
+
 
 def image_to_bytes(image: Image.Image) -> bytes:
     """Convert PIL Image to bytes.
@@ -27,57 +46,499 @@ def image_to_bytes(image: Image.Image) -> bytes:
     return img_byte_arr.getvalue()
 
 
+def encode_images(
+    model: SentenceTransformer,
+    images: list[Image.Image],
+) -> list[np.ndarray | None]:
+    """Encode a batch of images, isolating failures to single images.
+
+    The whole batch is encoded in one call. If that fails, the batch is
+    retried image by image so only the images that cannot be encoded are
+    dropped.
+
+    Args:
+    ----
+        model: CLIP model used for encoding
+        images: Images to encode
+
+    Returns:
+    -------
+        list: One embedding per image, None where encoding failed
+    """
+    try:
+        return list(model.encode(images, batch_size=len(images)))
+    except Exception as e:
+        logger.warning("Batch encoding failed, retrying per image: %s", e)
+
+    embeddings = []
+    for image in images:
+        try:
+            embeddings.append(model.encode(image))
+        except Exception as e:
+            logger.error("Error encoding image: %s", str(e))
+            embeddings.append(None)
+    return embeddings
+
+
+def decode_image(
+    image: bytes | Image.Image,
+    decode_size: int | None = None,
+) -> Image.Image:
+    """Decode an image partition into an RGB image.
+
+    Args:
+    ----
+        image: Encoded image bytes, or an already decoded PIL Image
+        decode_size: If set, JPEG images are decoded at the smallest DCT
+            scale that keeps both sides at least this large
+
+    Returns:
+    -------
+        Image.Image: RGB image
+    """
+    if isinstance(image, bytes):
+        image = Image.open(io.BytesIO(image))
+        if decode_size:
+            image.draft("RGB", (decode_size, decode_size))
+    return image.convert("RGB")
+
+
+def load_image(
+    partition_load_func: Callable[[], bytes | Image.Image],
+    reencode: bool = False,
+    decode_size: int | None = None,
+) -> tuple[Image.Image, bytes]:
+    """Load one image partition, decoding it once for encoding.
+
+    The original file bytes are kept for storage. They are only replaced by
+    a JPEG encoding of the decoded image when ``reencode`` is set or the
+    partition was loaded as a PIL Image.
+
+    Args:
+    ----
+        partition_load_func: Load function of the image partition
+        reencode: Store a normalised JPEG instead of the original bytes
+        decode_size: Minimum decoded size, see ``decode_image``
+
+    Returns:
+    -------
+        tuple: RGB image ready for encoding and the bytes to store
+    """
+    data = partition_load_func()
+    if not isinstance(data, bytes) or reencode:
+        # Normalised images are stored at full resolution
+        image = decode_image(data)
+        return image, image_to_bytes(image)
+    return decode_image(data, decode_size), data
+
+
+def content_hash(image: bytes | Image.Image) -> str:
+    """Hash the content of an image.
+
+    Args:
+    ----
+        image: Encoded image bytes, or a decoded PIL Image
+
+    Returns:
+    -------
+        str: Hex SHA-256 digest of the bytes, or of the image mode, size
+            and pixels for a decoded image
+    """
+    if isinstance(image, bytes):
+        return hashlib.sha256(image).hexdigest()
+
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def plan_image_updates(
+    partitioned_images: Partitions | Iterable[Partitions],
+    params: dict,
+    previous_manifest: dict | None,
+) -> dict:
+    """Work out which images must be embedded to bring the index up to date.
+
+    Every image is given a stable id: an image keeps the id recorded in
+    the previous manifest for its path, new images get the next free id.
+    With ``params["incremental"]`` every image is hashed, from its raw file
+    bytes when partitions are loaded as bytes, and only new images and
+    images whose content changed are marked for embedding, and images that
+    are no longer present are marked for deletion. Otherwise the previous
+    manifest is ignored, no image is read and every image is embedded,
+    numbered from ``params["sequence_id"]``. Its hashes are left empty, so
+    the first incremental run after it embeds every image again.
+
+    Args:
+    ----
+        partitioned_images: Dictionary mapping partition IDs to load functions,
+            or an iterator of such dictionaries when read in chunks
+        params: Embedding parameters with the 'incremental' flag, the
+            starting 'sequence_id' and the prefetch settings
+        previous_manifest: Manifest written by the previous run, or None
+
+    Returns:
+    -------
+        Manifest with the path to hash and id mapping of every image, the
+        next free id, and the 'upserted_ids' and 'deleted_ids' of this run
+    """
+    incremental = bool(params.get("incremental", False) and previous_manifest)
+    if incremental:
+        previous_images = previous_manifest["images"]
+        next_id = previous_manifest["next_id"]
+    else:
+        previous_images = {}
+        next_id = params["sequence_id"]
+
+    partitions = _iter_partitions(partitioned_images)
+    if params.get("incremental", False):
+        # Hashed on a first run too, for the next run to compare against
+        hashes = chain.from_iterable(
+            prefetch_batches(
+                partitions,
+                lambda load_func: content_hash(load_func()),
+                batch_size=params.get("batch_size", 32),
+                num_workers=params.get("prefetch_workers", 4),
+                max_prefetch=params.get("prefetch_batches", 2),
+            ),
+        )
+    else:
+        hashes = ((partition_id, None) for partition_id, _ in partitions)
+
+    images = {}
+    upserted_ids = []
+    for partition_id, digest in hashes:
+        previous = previous_images.get(partition_id)
+        if previous is None:
+            image_id = next_id
+            next_id += 1
+        else:
+            image_id = previous["image_id"]
+
+        images[partition_id] = {"hash": digest, "image_id": image_id}
+        if previous is None or previous["hash"] != digest:
+            upserted_ids.append(image_id)
+
+    deleted_ids = sorted(
+        entry["image_id"]
+        for partition_id, entry in previous_images.items()
+        if partition_id not in images
+    )
+
+    logger.info(
+        "%s update: %d of %d images to embed, %d to delete",
+        "Incremental" if incremental else "Full",
+        len(upserted_ids),
+        len(images),
+        len(deleted_ids),
+    )
+    return {
+        "incremental": incremental,
+        "next_id": next_id,
+        "images": images,
+        "upserted_ids": upserted_ids,
+        "deleted_ids": deleted_ids,
+    }
+
+
 def generate_clip_embeddings(
-    partitioned_images: OrderedDict[str, Callable[[], Any]],
+    partitioned_images: Partitions | Iterable[Partitions],
     params: dict,
-) -> pd.DataFrame:
+    image_manifest: dict | None = None,
+    checkpoint: ShardCheckpoint | None = None,
+) -> pd.DataFrame | DataFrameChunks:
     """Generate CLIP embeddings for a collection of images.
 
+    Images are encoded in batches of ``params["batch_size"]``. A corrupt
+    file only costs its own batch a per-image retry. Upcoming batches are
+    loaded and decoded by ``params["prefetch_workers"]`` threads while the
+    current batch is encoded, at most ``params["prefetch_batches"]`` ahead.
+
+    Each image is decoded once, optionally at a reduced
+    ``params["decode_size"]``. Its original file bytes are stored unless
+    ``params["reencode_images"]`` asks for normalised JPEGs.
+
+    With ``params["distributed"]`` and a Dask cluster available, e.g. under
+    ``DaskRunner``, the images are split into shards of
+    ``params["shard_size"]`` that are embedded in parallel on the workers,
+    each loading CLIP once. Without a cluster they are embedded locally.
+
+    Given a ``checkpoint`` the images are processed in shards of
+    ``params["shard_size"]`` and every completed shard is committed to it.
+    A rerun of the same work, e.g. after a crash, only embeds the shards
+    that were not committed yet and reads back the others.
+
+    With ``params["stream_output"]`` the rows are returned as a lazy stream
+    of ``params["chunk_size"]`` row chunks. Images are then processed while
+    the output dataset writes each chunk, so memory stays flat regardless
+    of the number of images.
+
+    Given an ``image_manifest`` only its 'upserted_ids' are embedded, under
+    the ids it assigns. Without one every image is embedded and numbered
+    from ``params["sequence_id"]``.
+
     Args:
     ----
-        partitioned_images: Dictionary mapping partition IDs to load functions
+        partitioned_images: Dictionary mapping partition IDs to load functions,
+            or an iterator of such dictionaries when read in chunks
+        params: Embedding parameters with the starting 'sequence_id', the
+            encoding 'batch_size', the decoding, prefetch and output settings
+        image_manifest: Manifest produced by ``plan_image_updates``
+        checkpoint: Checkpoint to resume from and commit shards to
 
     Returns:
     -------
-        tuple: (list of embeddings, list of file paths)
-        :param partitioned_images:
-        :param params:
+        DataFrame, or stream of DataFrame chunks, with one row per image
+        holding its id, embedding, serialized image and tag
     """
-    model = SentenceTransformer("clip-ViT-B-32")
-    logger.info("Initialized CLIP model")
+    chunks = _generate_embedding_chunks(
+        partitioned_images,
+        params,
+        image_manifest,
+        checkpoint,
+    )
+    if params.get("stream_output", False):
+        return DataFrameChunks(chunks)
 
-    embeddings = []
-    file_paths = []
-    data = []
+    frames = list(chunks)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def _generate_embedding_chunks(
+    partitioned_images: Partitions | Iterable[Partitions],
+    params: dict,
+    image_manifest: dict | None,
+    checkpoint: ShardCheckpoint | None,
+) -> Iterator[pd.DataFrame]:
+    if image_manifest is not None:
+        upserted_ids = set(image_manifest["upserted_ids"])
+        assigned_ids = {
+            partition_id: entry["image_id"]
+            for partition_id, entry in image_manifest["images"].items()
+            if entry["image_id"] in upserted_ids
+        }
+    partitions = (
+        (partition_id, load_func)
+        for partition_id, load_func in _iter_partitions(partitioned_images)
+        if image_manifest is None or partition_id in assigned_ids
+    )
+
+    logger.info(
+        "Processing images in batches of %d",
+        params.get("batch_size", 32),
+    )
     current_id = params["sequence_id"]
+    processed = 0
 
-    logger.info("Processing %d images", len(partitioned_images))
-    for partition_id, partition_load_func in partitioned_images.items():
-        try:
-            # Get the image data directly - this returns a PIL.Image object
-            image = partition_load_func()
-            file_paths.append(partition_id)
+    with dask_client() as cluster_client:
+        client = cluster_client if params.get("distributed", False) else None
+
+        if client is None and checkpoint is None:
+            model = SentenceTransformer("clip-ViT-B-32")
+            logger.info("Initialized CLIP model")
+            frames = _embed_partitions(model, partitions, params)
+        else:
+            shards = list(
+                split_shards(partitions, params.get("shard_size", 1024))
+            )
+            frames = _embed_shards(
+                shards,
+                params,
+                client,
+                checkpoint,
+                image_manifest,
+            )
+
+        for frame in frames:
+            if frame.empty:
+                continue
+
+            if image_manifest is None:
+                image_ids = range(current_id, current_id + len(frame))
+                current_id += len(frame)
+            else:
+                image_ids = frame["image_tag"].map(assigned_ids)
+
+            frame.insert(0, "image_id", list(image_ids))
+            processed += len(frame)
+            yield frame
+
+    logger.info("Successfully processed %d images", processed)
+
+
+def _embed_shards(
+    shards: list[list[tuple[str, Callable[[], Any]]]],
+    params: dict,
+    client: Client | None,
+    checkpoint: ShardCheckpoint | None,
+    image_manifest: dict | None,
+) -> Iterator[pd.DataFrame]:
+    completed = set()
+    if checkpoint is not None:
+        completed = checkpoint.resume(
+            _checkpoint_key(shards, params, image_manifest),
+        )
+        if completed:
+            logger.info(
+                "Resuming from checkpoint, %d of %d shards already embedded",
+                len(completed),
+                len(shards),
+            )
+
+    missing = [
+        shard for index, shard in enumerate(shards) if index not in completed
+    ]
+    if client is not None:
+        logger.info(
+            "Embedding %d shards of %d images on Dask",
+            len(missing),
+            params.get("shard_size", 1024),
+        )
+        computed = map_shards(client, embed_shard, missing, params=params)
+    elif missing:
+        model = SentenceTransformer("clip-ViT-B-32")
+        logger.info("Initialized CLIP model")
+        computed = (embed_shard(shard, params, model) for shard in missing)
+
+    for index in range(len(shards)):
+        if index in completed:
+            yield checkpoint.load_shard(index)
+            continue
 
-            # Generate embedding from the loaded image
-            embedding = model.encode(image)
-            embeddings.append(embedding)
+        frame = next(computed)
+        if checkpoint is not None:
+            checkpoint.commit_shard(index, frame)
+        yield frame
 
-            serialized_image = image_to_bytes(image)
+
+def _checkpoint_key(
+    shards: list[list[tuple[str, Callable[[], Any]]]],
+    params: dict,
+    image_manifest: dict | None,
+) -> str:
+    # Identifies the planned work: which images go into which shard, their
+    # content when known from the manifest, otherwise the size and
+    # modification time of their files, and how they are encoded
+    images = image_manifest["images"] if image_manifest is not None else {}
+    work = {
+        "shards": [
+            [
+                [
+                    partition_id,
+                    images.get(partition_id, {}).get("hash")
+                    or _partition_stat(load),
+                ]
+                for partition_id, load in shard
+            ]
+            for shard in shards
+        ],
+        "decode_size": params.get("decode_size"),
+        "reencode_images": params.get("reencode_images", False),
+    }
+    return hashlib.sha256(json.dumps(work).encode()).hexdigest()
+
+
+def _partition_stat(load: Callable[[], Any]) -> list[int] | None:
+    # Partitions load through their dataset, whose file a replaced image
+    # changes the size or modification time of
+    filepath = getattr(getattr(load, "__self__", None), "_filepath", None)
+    if filepath is None:
+        return None
+    try:
+        stat = Path(filepath).stat()
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _iter_partitions(
+    partitioned_images: Partitions | Iterable[Partitions],
+) -> Iterator[tuple[str, Callable[[], Any]]]:
+    if isinstance(partitioned_images, Mapping):
+        return iter(partitioned_images.items())
+    return chain.from_iterable(chunk.items() for chunk in partitioned_images)
+
+
+@lru_cache(maxsize=1)
+def _worker_clip_model() -> SentenceTransformer:
+    # Cached per process, so every Dask worker loads CLIP only once
+    model = SentenceTransformer("clip-ViT-B-32")
+    logger.info("Initialized CLIP model on worker")
+    return model
+
+
+def embed_shard(
+    partitions: list[tuple[str, Callable[[], Any]]],
+    params: dict,
+    model: SentenceTransformer | None = None,
+) -> pd.DataFrame:
+    """Embed one shard of image partitions, e.g. on a Dask worker.
+
+    Args:
+    ----
+        partitions: Pairs of partition ID and load function
+        params: Embedding parameters with the encoding 'batch_size', the
+            decoding and prefetch settings
+        model: CLIP model to encode with, defaults to the model cached by
+            the worker process
+
+    Returns:
+    -------
+        DataFrame with the embedding, serialized image and tag of every
+        image that could be embedded
+    """
+    if model is None:
+        model = _worker_clip_model()
+    frames = list(_embed_partitions(model, partitions, params))
+    if not frames:
+        return pd.DataFrame(columns=["embedding", "image_data", "image_tag"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _embed_partitions(
+    model: SentenceTransformer,
+    partitions: Iterable[tuple[str, Callable[[], Any]]],
+    params: dict,
+) -> Iterator[pd.DataFrame]:
+    chunk_size = params.get("chunk_size", 1024)
+    data = []
+
+    batches = prefetch_batches(
+        partitions,
+        partial(
+            load_image,
+            reencode=params.get("reencode_images", False),
+            decode_size=params.get("decode_size"),
+        ),
+        batch_size=params.get("batch_size", 32),
+        num_workers=params.get("prefetch_workers", 4),
+        max_prefetch=params.get("prefetch_batches", 2),
+    )
+    for batch in batches:
+        if not batch:
+            continue
+
+        embeddings = encode_images(model, [image for _, (image, _) in batch])
+        for (partition_id, (_, serialized_image)), embedding in zip(
+            batch,
+            embeddings,
+            strict=True,
+        ):
+            if embedding is None:
+                logger.error("Skipping image %s", partition_id)
+                continue
 
             data.append(
                 {
-                    "image_id": current_id,
                     "embedding": embedding,
                     "image_data": serialized_image,
                     "image_tag": partition_id,
                 },
             )
 
-            current_id += 1
-
-        except Exception as e:
-            logger.error("Error processing image %s: %s", partition_id, str(e))
-            continue
+        if len(data) >= chunk_size:
+            yield pd.DataFrame(data)
+            data = []
 
-    logger.info("Successfully processed %d images", len(data))
-    return pd.DataFrame(data)
+    if data:
+        yield pd.DataFrame(data)
@@ -1,19 +1,33 @@
 from kedro.pipeline import Pipeline, node, pipeline
 
-from .nodes import generate_clip_embeddings
+from .nodes import generate_clip_embeddings, plan_image_updates
 
 
 def create_pipeline(**kwargs) -> Pipeline:
     return pipeline(
         [
+            node(
+                func=plan_image_updates,
+                inputs=[
+                    "partitioned_images",
+                    "params:image_embedding_params",
+                    "image_manifest_previous",
+                ],
+                outputs="image_manifest",
+                name="plan_image_updates",
+                tags=["items.partitioned_images"],
+            ),
             node(
                 func=generate_clip_embeddings,
                 inputs=[
                     "partitioned_images",
                     "params:image_embedding_params",
+                    "image_manifest",
+                    "embedding_checkpoint",
                 ],
-                outputs="embeddings",
+                outputs="embeddings@parquet",
                 name="generate_embeddings",
+                tags=["items.embeddings"],
             ),
         ],
     )
@@ -0,0 +1,69 @@
+import logging
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import Any, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def prefetch_batches(
+    items: Iterable[tuple[str, Any]],
+    prepare: Callable[[Any], T],
+    batch_size: int,
+    num_workers: int = 4,
+    max_prefetch: int = 2,
+) -> Iterator[list[tuple[str, T]]]:
+    """Prepare batches of items in a thread pool ahead of their consumer.
+
+    Up to ``max_prefetch`` batches are prepared while the caller works on
+    the current one, so disk reads and image decoding overlap with model
+    inference. No more batches are submitted until the caller takes one,
+    which bounds the memory held by prepared items.
+
+    Args:
+    ----
+        items: Pairs of key and value to prepare, e.g. partition ids and
+            their load functions
+        prepare: Function turning a value into its prepared form
+        batch_size: Number of items per batch
+        num_workers: Number of preparation threads
+        max_prefetch: Number of batches prepared ahead of the consumer
+
+    Yields:
+    ------
+        Batches of (key, prepared value) pairs in input order. Items whose
+        preparation fails are logged and left out.
+    """
+    items = iter(items)
+    pending: deque[list[tuple[str, Future]]] = deque()
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+
+        def submit_next_batch() -> None:
+            batch = list(islice(items, batch_size))
+            if batch:
+                pending.append(
+                    [
+                        (key, executor.submit(prepare, value))
+                        for key, value in batch
+                    ],
+                )
+
+        for _ in range(max(max_prefetch, 1)):
+            submit_next_batch()
+
+        while pending:
+            futures = pending.popleft()
+            submit_next_batch()
+
+            batch = []
+            for key, future in futures:
+                try:
+                    batch.append((key, future.result()))
+                except Exception as e:
+                    logger.error("Error processing image %s: %s", key, str(e))
+            yield batch
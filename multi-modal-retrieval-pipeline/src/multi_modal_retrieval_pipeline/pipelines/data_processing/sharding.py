@@ -0,0 +1,102 @@
+import logging
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, TypeVar
+
+from distributed import Client, get_worker, worker_client
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+
+@contextmanager
+def dask_client() -> Iterator[Client | None]:
+    """Provide a client of the Dask cluster the pipeline is running on.
+
+    Inside a task scheduled by ``DaskRunner`` this is a worker client, which
+    secedes the task from the worker thread pool while it waits on the
+    tasks it submits. Outside a task it is the current client, if any.
+
+    Yields
+    ------
+        Dask client, or None when no cluster is available
+    """
+    try:
+        get_worker()
+    except ValueError:
+        pass
+    else:
+        with worker_client() as client:
+            yield client
+        return
+
+    try:
+        client = Client.current()
+    except ValueError:
+        client = None
+    yield client
+
+
+def split_shards(items: Iterable[Any], shard_size: int) -> Iterator[list]:
+    """Split items into consecutive shards of ``shard_size`` items.
+
+    Args:
+    ----
+        items: Items to split into shards
+        shard_size: Number of items per shard, the last shard may be smaller
+
+    Yields:
+    ------
+        List of the items of every shard, in order
+    """
+    items = iter(items)
+    yield from iter(lambda: list(islice(items, shard_size)), [])
+
+
+def map_shards(
+    client: Client,
+    func: Callable[..., R],
+    shards: Iterable[Sequence[Any]],
+    max_in_flight: int | None = None,
+    **kwargs: Any,
+) -> Iterator[R]:
+    """Apply a function to shards of items on Dask workers.
+
+    At most ``max_in_flight`` shards are submitted ahead of the consumer,
+    so finished shards do not pile up in worker memory.
+
+    Args:
+    ----
+        client: Client of the cluster running the shards
+        func: Function called as ``func(shard, **kwargs)`` on a worker
+        shards: Shards to process, e.g. from ``split_shards``
+        max_in_flight: Shards submitted ahead of the consumer, defaults to
+            twice the number of workers
+        **kwargs: Keyword arguments passed to every call of ``func``
+
+    Yields:
+    ------
+        The result of every shard, in shard order
+    """
+    if max_in_flight is None:
+        max_in_flight = 2 * max(len(client.scheduler_info()["workers"]), 1)
+
+    shards = iter(shards)
+    pending = deque()
+
+    def submit_next_shard() -> None:
+        for shard in islice(shards, 1):
+            pending.append(client.submit(func, shard, pure=False, **kwargs))
+
+    for _ in range(max(max_in_flight, 1)):
+        submit_next_shard()
+
+    while pending:
+        future = pending.popleft()
+        submit_next_shard()
+        result = future.result()
+        future.release()
+        yield result
@@ -0,0 +1,143 @@
+import logging
+from collections.abc import Iterable, Iterator, Sequence
+
+import faiss
+import numpy as np
+
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrix,
+)
+from multi_modal_retrieval_pipeline.io.faiss_dataset import as_float32
+
+logger = logging.getLogger(__name__)
+
+# Training points FAISS expects per inverted list, fewer images than this
+# per list are compared exhaustively instead
+MIN_POINTS_PER_LIST = 39
+
+
+def similar_pairs(
+    chunks: Sequence[EmbeddingMatrix],
+    threshold: float,
+    params: dict,
+) -> Iterator[tuple[int, int]]:
+    """Find the pairs of images with a cosine similarity above a threshold.
+
+    This is a self-join of the normalized vectors through an inverted file
+    index: every vector is range searched in batches against the vectors in
+    the 'nprobe' lists closest to it, out of 'nlist' lists, rather than
+    against every other vector. Collections too small to train the lists on
+    are compared exhaustively.
+
+    Args:
+    ----
+        chunks: Image ids and embedding matrices to join
+        threshold: Cosine similarity above which two images are paired
+        params: Deduplication parameters with 'nlist' and 'nprobe', and the
+            'batch_size' and 'train_size' of the index parameters
+
+    Yields:
+    ------
+        Ids of the images of every pair found, in either order
+    """
+    total = sum(len(chunk) for chunk in chunks)
+    if not total:
+        return
+    dimension = chunks[0].vectors.shape[1]
+    batch_size = params.get("batch_size") or 65536
+
+    nlist = params.get("nlist") or int(4 * np.sqrt(total))
+    if total < nlist * MIN_POINTS_PER_LIST:
+        index = faiss.IndexFlatIP(dimension)
+    else:
+        index = faiss.IndexIVFFlat(
+            faiss.IndexFlatIP(dimension),
+            dimension,
+            nlist,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        index.train(_training_sample(chunks, params.get("train_size", 65536)))
+        index.nprobe = params.get("nprobe", 8)
+    logger.info(
+        "Joining %d vectors with a %s index",
+        total,
+        type(index).__name__,
+    )
+
+    # Labels are row positions in the concatenated chunks
+    ids = np.concatenate([np.asarray(chunk.ids) for chunk in chunks])
+    for batch in _batches(chunks, batch_size):
+        index.add(batch)
+
+    start = 0
+    for batch in _batches(chunks, batch_size):
+        lims, _, rows = index.range_search(batch, threshold)
+        counts = np.diff(lims.astype(np.int64))
+        queries = np.repeat(np.arange(start, start + len(batch)), counts)
+        # Every vector finds itself
+        other = queries != rows
+        yield from zip(
+            ids[queries[other]].tolist(),
+            ids[rows[other]].tolist(),
+            strict=True,
+        )
+        start += len(batch)
+
+
+def group_pairs(pairs: Iterable[tuple[int, int]]) -> dict[int, list[int]]:
+    """Merge pairs of similar images into groups with a union-find.
+
+    Groups are connected components, so two images are in the same group
+    when a chain of pairs links them even if they were not paired directly.
+
+    Args:
+    ----
+        pairs: Ids of the images of every pair
+
+    Returns:
+    -------
+        Sorted ids of the other images of every group by its smallest id,
+        which represents the group
+    """
+    parent = {}
+
+    def find(image_id: int) -> int:
+        root = image_id
+        while parent.get(root, root) != root:
+            root = parent[root]
+        # Point the whole path at the root, so later finds are short
+        while image_id != root:
+            parent[image_id], image_id = root, parent[image_id]
+        return root
+
+    for a, b in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    # Only images that are not the root of their group have a parent
+    groups = {}
+    for image_id in parent:
+        groups.setdefault(find(image_id), []).append(image_id)
+    return {root: sorted(members) for root, members in sorted(groups.items())}
+
+
+def _training_sample(
+    chunks: Sequence[EmbeddingMatrix],
+    size: int,
+) -> np.ndarray:
+    sample = []
+    for batch in _batches(chunks, size):
+        sample.append(batch[: size - sum(len(part) for part in sample)])
+        if sum(len(part) for part in sample) == size:
+            break
+    return np.concatenate(sample)
+
+
+def _batches(
+    chunks: Sequence[EmbeddingMatrix],
+    size: int,
+) -> Iterator[np.ndarray]:
+    for chunk in chunks:
+        for start in range(0, len(chunk), size):
+            yield as_float32(chunk.vectors[start : start + size], True)
@@ -1,45 +1,685 @@
+import hashlib
+import json
 import logging
+from collections.abc import Iterable, Iterator
+from itertools import chain
 from typing import Any
 
 import faiss
 import numpy as np
-import pandas as pd
+
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrix,
+    EmbeddingMatrixChunks,
+)
+from multi_modal_retrieval_pipeline.io.faiss_dataset import (
+    IndexBatches,
+    as_float32,
+)
+from multi_modal_retrieval_pipeline.io.shard_checkpoint_dataset import (
+    ShardCheckpoint,
+)
+
+from .deduplication import group_pairs, similar_pairs
 
 logger = logging.getLogger(__name__)
 
+# Scalar quantizers selected by the 'quantization' parameter, storing every
+# vector component in 2 or 1 bytes instead of 4
+SCALAR_QUANTIZERS = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
 
-def create_faiss_index(data: pd.DataFrame) -> Any:
+
+def create_faiss_index(
+    data: EmbeddingMatrix | Iterable[EmbeddingMatrix],
+    image_manifest: dict | None = None,
+    previous_index: Any | None = None,
+    params: dict | None = None,
+    near_duplicates: dict | None = None,
+) -> tuple[IndexBatches, dict | None]:
     """Create embeddings array and dimension for FAISS index.
 
+    Vectors are stored under their image id so search results map directly
+    to images, and the ``IndexIDMap2`` wrapper keeps the reverse mapping so
+    the backend can reconstruct the vector of an image by its id. The
+    memory-mapped matrix, or the chunks read from it under ``DaskRunner``,
+    are not added here but returned with the index as ``IndexBatches``.
+    ``FaissDataset`` adds them when saving, in batches of
+    ``params["batch_size"]`` vectors so memory next to the index stays
+    bounded however many vectors there are. FAISS uses
+    ``params["omp_threads"]`` OpenMP threads while adding, by default one
+    per core.
+
+    With ``params["normalize"]`` vectors are scaled to unit length as they
+    are added, so inner product scores are cosine similarities, and the
+    sidecar records it for the backend to normalize queries alike.
+    ``params["quantization"]`` stores the vectors in a scalar quantized
+    index, ``"fp16"`` halving and ``"int8"`` quartering its memory, or with
+    ``"pq"`` as ``params["pq_subquantizers"]`` bytes in a product quantized
+    one. ``params["ivf_nlist"]`` partitions the vectors into that many
+    inverted lists, of which searches visit ``params["ivf_nprobe"]``, so
+    they no longer scan every vector. The int8 and product quantizers and
+    the inverted lists are trained on up to ``params["train_size"]``
+    vectors of the first chunk.
+
+    ``params["dimension_reduction"]``, ``"pca"`` or ``"opq"``, trains a
+    projection to ``params["reduced_dimension"]`` dimensions on the same
+    sample and indexes the projected vectors. The projection is saved in
+    the index as an ``IndexPreTransform``, so FAISS applies it to queries
+    as well. An incremental update keeps the type of the previous index,
+    changing any of these settings needs a run with 'incremental: false'.
+
+    For an incremental manifest the previous index is updated in place:
+    vectors of deleted and changed images are removed and the new
+    embeddings, which only cover the changed images, are added. Images
+    found by ``find_near_duplicates`` to duplicate another image are left
+    out, so only the representative of every group is indexed.
+
+    Images the manifest marks for embedding that have no embedding, e.g.
+    because they could not be decoded, are left out of the returned
+    manifest as the vectors are added. It is saved after the index, so the
+    next run sees them as new and retries them.
+
     Args:
     ----
-        data: DataFrame containing 'embeddings' column
+        data: Image ids and embedding matrix, or an iterator of chunks
+        image_manifest: Manifest produced by ``plan_image_updates``
+        previous_index: Index written by the previous run, or None
+        params: Index parameters with the add 'batch_size', the
+            'omp_threads' setting, 'normalize', 'quantization' with its
+            'pq_subquantizers', the 'ivf_nlist' and 'ivf_nprobe', the
+            'dimension_reduction' with its 'reduced_dimension' and
+            'opq_subquantizers', and the 'train_size'
+        near_duplicates: Groups found by ``find_near_duplicates``, or None
 
     Returns:
     -------
-       FAISS index
+       ``IndexBatches`` holding the FAISS index, the vectors to add to it
+       and the version of the source images, and the manifest of the
+       images the index holds once saved
     """
     logger.info("Starting to create FAISS index")
+    params = params or {}
+    normalize = params.get("normalize", False)
 
     try:
-        embeddings = np.stack(data["embedding"].values)
-        dimension = embeddings.shape[1]
-        # Convert to float32 as required by FAISS
-        embeddings = embeddings.astype(np.float32)
+        chunked = not isinstance(data, EmbeddingMatrix)
+        batches = iter(data) if chunked else iter([data])
 
-        index = faiss.IndexFlatIP(dimension)
-        index = faiss.IndexIDMap(index)
+        if image_manifest is not None and image_manifest["incremental"]:
+            if previous_index is None:
+                msg = (
+                    "Incremental update needs the previous FAISS index, "
+                    "run with 'incremental: false' to rebuild it"
+                )
+                raise ValueError(msg)
+            index = _remove_stale_vectors(previous_index, image_manifest)
+        else:
+            # The first chunk gives the dimension of the new index
+            first = next(batches, None)
+            if first is None or not len(first):
+                msg = "No embeddings to index"
+                raise ValueError(msg)
+            batches = chain([first], batches)
 
-        # Create index
-        vectors = np.array(embeddings).astype(np.float32)
+            index = _new_index(first, params)
+            if not _is_ivf(index):
+                index = faiss.IndexIDMap2(index)
 
-        # Add vectors to the index with IDs
-        index.add_with_ids(vectors, np.array(range(len(embeddings))))
+        metadata = {
+            "source_data_version": source_data_version(image_manifest),
+            "normalized": normalize,
+        }
+        indexed_manifest = image_manifest
+        if image_manifest is not None:
+            indexed_manifest = {
+                **image_manifest,
+                "images": dict(image_manifest["images"]),
+            }
+            batches = _forget_unembedded_images(
+                batches,
+                indexed_manifest,
+                metadata,
+            )
 
-        logger.info("Creating FAISS index with %d vectors", len(embeddings))
+        duplicate_ids = near_duplicate_ids(near_duplicates)
+        if len(duplicate_ids):
+            # Dropped images are not searchable, so say which ones they are
+            logger.info(
+                "Leaving %d near-duplicates out of the index (ids %s%s), "
+                "their groups are saved as near_duplicate_groups",
+                len(duplicate_ids),
+                ", ".join(str(i) for i in duplicate_ids[:10]),
+                ", ..." if len(duplicate_ids) > 10 else "",
+            )
+            batches = _drop_ids(
+                batches,
+                duplicate_ids,
+                params.get("batch_size") or 65536,
+            )
 
-        return index
+        return (
+            IndexBatches(
+                index,
+                batches,
+                batch_size=params.get("batch_size"),
+                num_threads=params.get("omp_threads"),
+                normalize=normalize,
+                metadata=metadata,
+            ),
+            indexed_manifest,
+        )
 
     except Exception as e:
         logger.error("Error creating FAISS index: %s", str(e))
         raise
+
+
+def build_rerank_matrix(
+    data: EmbeddingMatrix | Iterable[EmbeddingMatrix],
+    image_manifest: dict | None = None,
+    previous_matrix: EmbeddingMatrix | None = None,
+    params: dict | None = None,
+    near_duplicates: dict | None = None,
+) -> EmbeddingMatrixChunks:
+    """Keep full precision vectors of every indexed image for re-ranking.
+
+    The backend re-ranks candidates found in a compressed index with exact
+    inner products against this matrix, which it memory-maps. Vectors are
+    stored as float32 and normalized like the index with
+    ``params["normalize"]``, so exact scores are on the scale of the index
+    scores. They are streamed ``params["batch_size"]`` rows at a time.
+
+    For an incremental manifest the previous matrix is copied without the
+    rows of deleted and changed images and the new embeddings are appended.
+    Like the index, the matrix leaves out near-duplicates.
+
+    Args:
+    ----
+        data: Image ids and embedding matrix, or an iterator of chunks
+        image_manifest: Manifest produced by ``plan_image_updates``
+        previous_matrix: Matrix written by the previous run, or None
+        params: Index parameters with 'normalize' and the 'batch_size'
+        near_duplicates: Groups found by ``find_near_duplicates``, or None
+
+    Returns:
+    -------
+        Stream of the chunks of the matrix, covering every indexed image
+    """
+    params = params or {}
+    chunks = [data] if isinstance(data, EmbeddingMatrix) else data
+    batch_size = params.get("batch_size") or 65536
+    normalize = params.get("normalize", False)
+
+    kept = []
+    if image_manifest is not None and image_manifest["incremental"]:
+        if previous_matrix is None:
+            msg = (
+                "Incremental update needs the previous re-ranking matrix, "
+                "run with 'incremental: false' to rebuild it"
+            )
+            raise ValueError(msg)
+        stale_ids = (
+            image_manifest["deleted_ids"] + image_manifest["upserted_ids"]
+        )
+        kept = _without_ids(previous_matrix, stale_ids, batch_size)
+
+    duplicate_ids = near_duplicate_ids(near_duplicates)
+    added = (
+        EmbeddingMatrix(
+            ids=chunk.ids,
+            vectors=as_float32(chunk.vectors, normalize),
+        )
+        for chunk in _drop_ids(chunks, duplicate_ids, batch_size)
+    )
+    return EmbeddingMatrixChunks(chain(kept, added))
+
+
+def find_near_duplicates(
+    data: EmbeddingMatrix | Iterable[EmbeddingMatrix],
+    image_manifest: dict | None = None,
+    previous_groups: dict | None = None,
+    previous_index: Any | None = None,
+    params: dict | None = None,
+) -> dict:
+    """Group images whose embeddings are nearly identical.
+
+    Re-uploads and resized copies of an image embed within a cosine
+    similarity of ``params["deduplication"]["threshold"]`` of each other.
+    Such images are joined with an approximate range search instead of
+    comparing every pair, and pairs are merged into groups represented by
+    their smallest image id. Only representatives are indexed, so copies
+    neither take space in the index nor fill result pages.
+
+    For an incremental manifest the previous groups are kept without the
+    deleted and changed images. Every new image is first searched in the
+    previous index and joins the group of the indexed image it duplicates,
+    then the remaining new images are joined with each other. The members
+    of a group whose representative was deleted or changed stay out of the
+    index until a run with 'incremental: false'.
+
+    Args:
+    ----
+        data: Image ids and embedding matrix, or an iterator of chunks
+        image_manifest: Manifest produced by ``plan_image_updates``
+        previous_groups: Groups found by the previous run, or None
+        previous_index: Index written by the previous run, or None
+        params: Index parameters with 'normalize', the 'batch_size', the
+            'train_size' and the 'deduplication' 'threshold', 'nlist' and
+            'nprobe'
+
+    Returns:
+    -------
+        JSON serialisable groups with the ids of their representative and
+        of its near-duplicates, and the ids of every near-duplicate
+    """
+    params = params or {}
+    deduplication = {**params, **(params.get("deduplication") or {})}
+    threshold = deduplication.get("threshold")
+    if threshold is None:
+        return _near_duplicate_record(threshold, {})
+
+    chunks = [data] if isinstance(data, EmbeddingMatrix) else list(data)
+    groups = {}
+    if image_manifest is not None and image_manifest["incremental"]:
+        if previous_groups is None:
+            msg = (
+                "Incremental update needs the previous near-duplicate "
+                "groups, run with 'incremental: false' to rebuild them"
+            )
+            raise ValueError(msg)
+        stale_ids = (
+            image_manifest["deleted_ids"] + image_manifest["upserted_ids"]
+        )
+        groups = _without_stale_groups(previous_groups, stale_ids)
+        if previous_index is not None:
+            chunks = _match_indexed_images(
+                chunks,
+                previous_index,
+                stale_ids,
+                groups,
+                deduplication,
+            )
+
+    for representative, members in group_pairs(
+        similar_pairs(chunks, threshold, deduplication),
+    ).items():
+        groups[representative] = members
+    return _near_duplicate_record(threshold, groups)
+
+
+def clear_embedding_checkpoint(
+    checkpoint: ShardCheckpoint,
+    indexed_image_manifest: dict,
+) -> None:
+    """Delete the embedding shards once the index built from them is saved.
+
+    The shards duplicate the saved embeddings and are only needed to resume
+    an interrupted run. Taking the manifest saved after the index as input
+    makes this node run last, so a failed run keeps its checkpoint.
+
+    Args:
+    ----
+        checkpoint: Checkpoint the embedding shards were committed to
+        indexed_image_manifest: Manifest of the images in the saved index
+    """
+    checkpoint.clear()
+    logger.info(
+        "Cleared the embedding checkpoint, %d images are indexed",
+        len(indexed_image_manifest.get("images", {})),
+    )
+
+
+def near_duplicate_ids(near_duplicates: dict | None) -> np.ndarray:
+    """Ids of the images left out of the index as near-duplicates.
+
+    Args:
+    ----
+        near_duplicates: Groups found by ``find_near_duplicates``, or None
+
+    Returns:
+    -------
+        Sorted ids of every near-duplicate, empty without groups
+    """
+    if near_duplicates is None:
+        return np.empty(0, dtype=np.int64)
+    return np.asarray(near_duplicates["duplicate_ids"], dtype=np.int64)
+
+
+def _without_stale_groups(
+    previous_groups: dict,
+    stale_ids: list[int],
+) -> dict[int, list[int]]:
+    stale = set(stale_ids)
+    groups = {}
+    orphaned = 0
+    for group in previous_groups["groups"]:
+        members = [m for m in group["duplicates"] if m not in stale]
+        if group["representative"] in stale:
+            orphaned += len(members)
+        elif members:
+            groups[group["representative"]] = members
+
+    if orphaned:
+        logger.warning(
+            "%d near-duplicates lost the representative of their group and "
+            "are not indexed, run with 'incremental: false' to index them",
+            orphaned,
+        )
+    return groups
+
+
+def _match_indexed_images(
+    chunks: list[EmbeddingMatrix],
+    index: Any,
+    stale_ids: list[int],
+    groups: dict[int, list[int]],
+    params: dict,
+) -> list[EmbeddingMatrix]:
+    # Scores of the index are only cosine similarities for unit vectors
+    if not params.get("normalize", False):
+        logger.warning(
+            "The previous index holds vectors that are not normalized, new "
+            "images are not matched against it",
+        )
+        return chunks
+
+    search_params = _search_params(
+        index,
+        faiss.IDSelectorNot(
+            faiss.IDSelectorBatch(np.asarray(stale_ids, dtype=np.int64)),
+        ),
+    )
+    unmatched = []
+    matched = 0
+    size = params.get("batch_size") or 65536
+    for chunk in chain.from_iterable(_split(m, size) for m in chunks):
+        scores, labels = index.search(
+            as_float32(chunk.vectors, True),
+            1,
+            params=search_params,
+        )
+        found = scores[:, 0] > params["threshold"]
+        for image_id, label in zip(
+            chunk.ids[found].tolist(),
+            labels[found, 0].tolist(),
+            strict=True,
+        ):
+            groups.setdefault(label, []).append(image_id)
+        matched += int(found.sum())
+        unmatched.append(
+            EmbeddingMatrix(
+                ids=chunk.ids[~found],
+                vectors=chunk.vectors[~found],
+            ),
+        )
+
+    logger.info("Matched %d new images to indexed images", matched)
+    return unmatched
+
+
+def _near_duplicate_record(
+    threshold: float | None,
+    groups: dict[int, list[int]],
+) -> dict:
+    duplicate_ids = sorted(chain.from_iterable(groups.values()))
+    logger.info(
+        "Found %d near-duplicates of %d images",
+        len(duplicate_ids),
+        len(groups),
+    )
+    return {
+        "threshold": threshold,
+        "groups": [
+            {"representative": representative, "duplicates": sorted(members)}
+            for representative, members in sorted(groups.items())
+        ],
+        "duplicate_ids": duplicate_ids,
+    }
+
+
+def _drop_ids(
+    chunks: Iterable[EmbeddingMatrix],
+    ids: np.ndarray | list[int],
+    size: int,
+) -> Iterator[EmbeddingMatrix]:
+    for matrix in chunks:
+        for chunk in _split(matrix, size):
+            keep = ~np.isin(chunk.ids, ids)
+            if keep.all():
+                yield chunk
+            else:
+                yield EmbeddingMatrix(
+                    ids=chunk.ids[keep],
+                    vectors=chunk.vectors[keep],
+                )
+
+
+def _without_ids(
+    matrix: EmbeddingMatrix,
+    ids: list[int],
+    size: int,
+) -> Iterator[EmbeddingMatrix]:
+    for chunk in _split(matrix, size):
+        keep = ~np.isin(chunk.ids, ids)
+        yield EmbeddingMatrix(
+            ids=chunk.ids[keep],
+            vectors=as_float32(chunk.vectors[keep]),
+        )
+
+
+def _split(matrix: EmbeddingMatrix, size: int) -> Iterator[EmbeddingMatrix]:
+    for start in range(0, len(matrix), size):
+        yield EmbeddingMatrix(
+            ids=matrix.ids[start : start + size],
+            vectors=matrix.vectors[start : start + size],
+        )
+
+
+def _new_index(first: EmbeddingMatrix, params: dict) -> faiss.Index:
+    dimension = first.vectors.shape[1]
+    transform = _new_transform(dimension, params)
+    if transform is None:
+        index = _new_vector_index(dimension, params)
+    elif params.get("normalize", False):
+        # Reduced vectors are normalized again, so scores stay cosines
+        index = faiss.IndexPreTransform(
+            faiss.NormalizationTransform(transform.d_out, 2.0),
+            _new_vector_index(transform.d_out, params),
+        )
+        index.prepend_transform(transform)
+    else:
+        index = faiss.IndexPreTransform(
+            transform,
+            _new_vector_index(transform.d_out, params),
+        )
+
+    if not index.is_trained:
+        sample = first.vectors[: params.get("train_size", 65536)]
+        if transform is not None and len(sample) < transform.d_out:
+            msg = (
+                f"Reducing to {transform.d_out} dimensions needs at least "
+                f"as many vectors to train on, got {len(sample)}"
+            )
+            raise ValueError(msg)
+        # Transforms are trained first, then the index on their output
+        index.train(as_float32(sample, params.get("normalize", False)))
+        logger.info("Trained the FAISS index on %d vectors", len(sample))
+    return index
+
+
+def _new_transform(
+    dimension: int,
+    params: dict,
+) -> faiss.VectorTransform | None:
+    method = params.get("dimension_reduction")
+    if method is None:
+        return None
+
+    reduced_dimension = params["reduced_dimension"]
+    if not 0 < reduced_dimension < dimension:
+        msg = (
+            f"Reduced dimension {reduced_dimension} must be between 0 and "
+            f"the embedding dimension {dimension}"
+        )
+        raise ValueError(msg)
+
+    if method == "pca":
+        return faiss.PCAMatrix(dimension, reduced_dimension)
+    if method == "opq":
+        return faiss.OPQMatrix(
+            dimension,
+            params.get("opq_subquantizers", 16),
+            reduced_dimension,
+        )
+    msg = f"Unknown dimension reduction '{method}', expected pca, opq or null"
+    raise ValueError(msg)
+
+
+def _new_vector_index(dimension: int, params: dict) -> faiss.Index:
+    quantization = params.get("quantization")
+    if quantization not in {None, "pq", *SCALAR_QUANTIZERS}:
+        msg = (
+            f"Unknown quantization '{quantization}', expected one of "
+            f"{sorted([*SCALAR_QUANTIZERS, 'pq'])} or null"
+        )
+        raise ValueError(msg)
+    subquantizers = params.get("pq_subquantizers", 16)
+    if quantization == "pq" and dimension % subquantizers:
+        msg = (
+            f"{subquantizers} PQ subquantizers do not divide the "
+            f"dimension {dimension}"
+        )
+        raise ValueError(msg)
+
+    nlist = params.get("ivf_nlist")
+    metric = faiss.METRIC_INNER_PRODUCT
+    if nlist is None:
+        if quantization is None:
+            return faiss.IndexFlatIP(dimension)
+        if quantization == "pq":
+            return faiss.IndexPQ(dimension, subquantizers, 8, metric)
+        return faiss.IndexScalarQuantizer(
+            dimension,
+            SCALAR_QUANTIZERS[quantization],
+            metric,
+        )
+
+    quantizer = faiss.IndexFlatIP(dimension)
+    if quantization is None:
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+    elif quantization == "pq":
+        index = faiss.IndexIVFPQ(
+            quantizer,
+            dimension,
+            nlist,
+            subquantizers,
+            8,
+            metric,
+        )
+    else:
+        index = faiss.IndexIVFScalarQuantizer(
+            quantizer,
+            dimension,
+            nlist,
+            SCALAR_QUANTIZERS[quantization],
+            metric,
+        )
+    # Saved with the index and recorded in its sidecar
+    index.nprobe = params.get("ivf_nprobe", 16)
+    # IVF indexes keep the image ids themselves instead of in an
+    # IndexIDMap2, a hash table finds their vectors to reconstruct or remove
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+
+def _is_ivf(index: faiss.Index) -> bool:
+    try:
+        faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return False
+    return True
+
+
+def _search_params(
+    index: faiss.Index,
+    sel: faiss.IDSelector,
+) -> faiss.SearchParameters:
+    # IVF indexes reject any other parameters than IVF ones, which also
+    # need the nprobe the index was saved with or they search one list
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return faiss.SearchParameters(sel=sel)
+    return faiss.SearchParametersIVF(sel=sel, nprobe=ivf.nprobe)
+
+
+def source_data_version(image_manifest: dict | None) -> str | None:
+    """Identify the images described by a manifest.
+
+    Args:
+    ----
+        image_manifest: Manifest produced by ``plan_image_updates``
+
+    Returns:
+    -------
+        Hex SHA-256 digest of the path, hash and id of every image, or None
+        without a manifest
+    """
+    if image_manifest is None:
+        return None
+    images = json.dumps(image_manifest["images"], sort_keys=True)
+    return hashlib.sha256(images.encode()).hexdigest()
+
+
+def _forget_unembedded_images(
+    batches: Iterator[EmbeddingMatrix],
+    image_manifest: dict,
+    metadata: dict[str, Any],
+) -> Iterator[EmbeddingMatrix]:
+    # Runs while the index is saved, so the manifest and index metadata
+    # saved after it only record the images that were embedded
+    upserted_ids = np.sort(np.asarray(image_manifest["upserted_ids"], np.int64))
+    embedded = np.zeros(len(upserted_ids), dtype=bool)
+    for batch in batches:
+        positions = np.searchsorted(upserted_ids, batch.ids)
+        found = positions < len(upserted_ids)
+        found[found] = upserted_ids[positions[found]] == batch.ids[found]
+        embedded[positions[found]] = True
+        yield batch
+
+    failed = set(upserted_ids[~embedded].tolist())
+    if not failed:
+        return
+    logger.warning(
+        "%d images could not be embedded, the next run retries them",
+        len(failed),
+    )
+    image_manifest["images"] = {
+        path: entry
+        for path, entry in image_manifest["images"].items()
+        if entry["image_id"] not in failed
+    }
+    image_manifest["upserted_ids"] = [
+        image_id
+        for image_id in image_manifest["upserted_ids"]
+        if image_id not in failed
+    ]
+    metadata["source_data_version"] = source_data_version(image_manifest)
+
+
+def _remove_stale_vectors(index: Any, image_manifest: dict) -> Any:
+    stale_ids = np.array(
+        image_manifest["deleted_ids"] + image_manifest["upserted_ids"],
+        dtype=np.int64,
+    )
+    removed = index.remove_ids(stale_ids) if len(stale_ids) else 0
+
+    logger.info(
+        "Removed %d stale vectors from the FAISS index, %d left",
+        removed,
+        index.ntotal,
+    )
+    return index
@@ -1,16 +1,61 @@
 from kedro.pipeline import Pipeline, node, pipeline
 
-from .nodes import create_faiss_index
+from .nodes import (
+    build_rerank_matrix,
+    clear_embedding_checkpoint,
+    create_faiss_index,
+    find_near_duplicates,
+)
 
 
 def create_pipeline(**kwargs) -> Pipeline:
     return pipeline(
         [
+            node(
+                func=find_near_duplicates,
+                inputs=[
+                    "embeddings@matrix",
+                    "image_manifest",
+                    "near_duplicate_groups_previous",
+                    "vector_store_previous",
+                    "params:faiss_index_params",
+                ],
+                outputs="near_duplicate_groups",
+                name="find_near_duplicates",
+            ),
             node(
                 func=create_faiss_index,
-                inputs=["embeddings"],
-                outputs="vector_store",
+                inputs=[
+                    "embeddings@matrix",
+                    "image_manifest",
+                    "vector_store_previous",
+                    "params:faiss_index_params",
+                    "near_duplicate_groups",
+                ],
+                # The manifest is saved after the index, so a run that fails
+                # before the index is updated is planned again in full
+                outputs=["vector_store", "indexed_image_manifest"],
                 name="create_faiss_index",
+                tags=["items.embeddings"],
+            ),
+            node(
+                func=build_rerank_matrix,
+                inputs=[
+                    "embeddings@matrix",
+                    "image_manifest",
+                    "rerank_matrix_previous",
+                    "params:faiss_index_params",
+                    "near_duplicate_groups",
+                ],
+                outputs="rerank_matrix",
+                name="build_rerank_matrix",
+                tags=["items.rerank_matrix"],
+            ),
+            node(
+                func=clear_embedding_checkpoint,
+                inputs=["embedding_checkpoint", "indexed_image_manifest"],
+                outputs=None,
+                name="clear_embedding_checkpoint",
             ),
         ],
     )
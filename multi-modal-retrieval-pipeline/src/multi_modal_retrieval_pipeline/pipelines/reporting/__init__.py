@@ -0,0 +1,3 @@
+"""Reporting pipeline comparing the recall and latency of FAISS indexes."""
+
+from .pipeline import create_pipeline  # NOQA
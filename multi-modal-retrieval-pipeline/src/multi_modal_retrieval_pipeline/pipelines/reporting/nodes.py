@@ -0,0 +1,334 @@
+import logging
+import time
+from collections.abc import Iterable, Iterator
+
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrix,
+)
+from multi_modal_retrieval_pipeline.io.faiss_dataset import (
+    as_float32,
+    describe_index,
+    omp_threads,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def select_evaluation_queries(
+    embeddings: EmbeddingMatrix | Iterable[EmbeddingMatrix],
+    params: dict,
+) -> EmbeddingMatrix:
+    """Select the query set the index configurations are evaluated on.
+
+    With 'query_prompts' the queries are the prompts encoded by CLIP, the
+    way the backend encodes text searches. Otherwise 'num_queries' image
+    embeddings are sampled and held out, so they are left out of every
+    evaluated index and do not trivially find themselves. With 'normalize'
+    queries and indexed vectors are scaled to unit length, as
+    ``create_faiss_index`` does, so recall is measured for cosine
+    similarity.
+
+    Args:
+    ----
+        embeddings: Image ids and vectors of every indexed image, or an
+            iterator of chunks
+        params: Evaluation parameters with 'query_prompts', or
+            'num_queries' and the sampling 'seed', and 'normalize'
+
+    Returns:
+    -------
+        Query vectors with the ids of the held out images, -1 for prompts
+    """
+    embeddings = _as_matrix(embeddings)
+    normalize = params.get("normalize", False)
+    prompts = params.get("query_prompts") or []
+    if prompts:
+        model = SentenceTransformer("clip-ViT-B-32")
+        logger.info("Encoding %d text prompts as queries", len(prompts))
+        return EmbeddingMatrix(
+            ids=np.full(len(prompts), -1, dtype=np.int64),
+            vectors=as_float32(model.encode(prompts), normalize),
+        )
+
+    num_queries = params.get("num_queries", 1000)
+    if num_queries >= len(embeddings):
+        msg = (
+            f"Holding out {num_queries} queries needs more than the "
+            f"{len(embeddings)} embeddings available"
+        )
+        raise ValueError(msg)
+
+    rng = np.random.default_rng(params.get("seed"))
+    rows = np.sort(rng.choice(len(embeddings), num_queries, replace=False))
+    logger.info("Sampled %d embeddings as held out queries", num_queries)
+    return EmbeddingMatrix(
+        ids=np.asarray(embeddings.ids[rows], dtype=np.int64),
+        vectors=as_float32(embeddings.vectors[rows], normalize),
+    )
+
+
+def compute_ground_truth(
+    embeddings: EmbeddingMatrix | Iterable[EmbeddingMatrix],
+    queries: EmbeddingMatrix,
+    params: dict,
+) -> np.ndarray:
+    """Find the exact inner product neighbours of every query.
+
+    This is the search ``IndexFlatIP`` performs, run batch by batch over
+    the memory-mapped matrix so the vectors are not copied into an index.
+
+    Args:
+    ----
+        embeddings: Image ids and vectors of every indexed image, or an
+            iterator of chunks
+        queries: Query vectors from ``select_evaluation_queries``
+        params: Evaluation parameters with 'k' and the 'batch_size' of
+            vectors compared at a time
+
+    Returns:
+    -------
+        Image ids of the 'k' nearest neighbours of every query, best first
+    """
+    embeddings = _as_matrix(embeddings)
+    k = params.get("k", 10)
+    heap = faiss.ResultHeap(len(queries), k, keep_max=True)
+    every_query = np.arange(len(queries))
+    for ids, vectors in _iter_base(embeddings, queries, params):
+        # Every query is scored against the same batch of ids
+        heap.add_result_subset(every_query, queries.vectors @ vectors.T, ids)
+    heap.finalize()
+
+    logger.info(
+        "Computed exact top-%d neighbours of %d queries", k, len(queries)
+    )
+    return heap.I
+
+
+def evaluate_index_configurations(
+    embeddings: EmbeddingMatrix | Iterable[EmbeddingMatrix],
+    queries: EmbeddingMatrix,
+    ground_truth: np.ndarray,
+    params: dict,
+) -> dict:
+    """Measure recall@k and query latency of candidate index configurations.
+
+    Every configuration is built with ``faiss.index_factory`` from its
+    'factory' string, e.g. ``"IVF1024,PQ32"`` or ``"HNSW32"``, trained on
+    at most 'max_train_size' vectors when needed and filled with the same
+    vectors as the ground truth. It is then searched once for every entry
+    of its 'search_params', e.g. ``{"nprobe": 16}`` or
+    ``{"efSearch": 64}``, so a single build covers a sweep. Factories with
+    a projection, e.g. ``"PCA128,L2norm,Flat"``, report the reduced
+    'index_dimension' next to their recall. Queries are
+    searched one at a time for the latency percentiles and all at once for
+    the throughput. A configuration that fails to build is reported with
+    its error instead of stopping the evaluation.
+
+    Args:
+    ----
+        embeddings: Image ids and vectors of every indexed image, or an
+            iterator of chunks
+        queries: Query vectors from ``select_evaluation_queries``
+        ground_truth: Exact neighbours from ``compute_ground_truth``
+        params: Evaluation parameters with 'k', the index 'configurations'
+            and the 'omp_threads' FAISS searches with
+
+    Returns:
+    -------
+        JSON serialisable report with one result per configuration and
+        search parameter setting
+    """
+    embeddings = _as_matrix(embeddings)
+    k = params.get("k", 10)
+    results = []
+    with omp_threads(params.get("omp_threads")):
+        for configuration in params.get("configurations", []):
+            results.extend(
+                _evaluate_configuration(
+                    configuration,
+                    embeddings,
+                    queries,
+                    ground_truth,
+                    params,
+                ),
+            )
+
+    prompts = bool(params.get("query_prompts"))
+    return {
+        "k": k,
+        "num_queries": len(queries),
+        "query_source": "prompts" if prompts else "sampled",
+        "num_vectors": len(embeddings) - int(np.sum(queries.ids >= 0)),
+        "dimension": int(queries.vectors.shape[1]),
+        "results": results,
+    }
+
+
+def recall_at_k(retrieved: np.ndarray, ground_truth: np.ndarray) -> float:
+    """Average fraction of the exact neighbours found by a search.
+
+    Args:
+    ----
+        retrieved: Ids returned for every query, -1 for missing results
+        ground_truth: Exact neighbour ids of every query
+
+    Returns:
+    -------
+        Mean over the queries of the share of their exact neighbours that
+        were retrieved
+    """
+    recalls = []
+    for found, neighbours in zip(retrieved, ground_truth, strict=True):
+        expected = set(neighbours[neighbours >= 0].tolist())
+        if expected:
+            hits = len(expected & set(found.tolist()))
+            recalls.append(hits / len(expected))
+    return float(np.mean(recalls)) if recalls else 0.0
+
+
+def _evaluate_configuration(
+    configuration: dict,
+    embeddings: EmbeddingMatrix,
+    queries: EmbeddingMatrix,
+    ground_truth: np.ndarray,
+    params: dict,
+) -> list[dict]:
+    name = configuration.get("name", configuration["factory"])
+    summary = {"name": name, "factory": configuration["factory"]}
+    try:
+        start = time.perf_counter()
+        index, base_ids = _build_index(
+            configuration["factory"],
+            embeddings,
+            queries,
+            params,
+        )
+        build_seconds = time.perf_counter() - start
+    except Exception as e:
+        logger.warning("Could not build index '%s': %s", name, str(e))
+        return [{**summary, "error": str(e)}]
+
+    logger.info("Built index '%s' in %.2fs", name, build_seconds)
+    summary["build_seconds"] = round(build_seconds, 3)
+    summary["index_bytes"] = int(faiss.serialize_index(index).nbytes)
+    # Dimension of the vectors the index stores, after any projection
+    transforms = describe_index(index)["transforms"]
+    summary["index_dimension"] = (
+        transforms[-1]["d_out"] if transforms else index.d
+    )
+
+    k = params.get("k", 10)
+    results = []
+    parameter_space = faiss.ParameterSpace()
+    for search_params in configuration.get("search_params") or [{}]:
+        for parameter, value in search_params.items():
+            parameter_space.set_index_parameter(index, parameter, value)
+
+        # Warm up caches before timing
+        index.search(queries.vectors[:1], k)
+        latencies = []
+        labels = []
+        for query in queries.vectors:
+            start = time.perf_counter()
+            _, found = index.search(query[None, :], k)
+            latencies.append(time.perf_counter() - start)
+            labels.append(found[0])
+
+        start = time.perf_counter()
+        index.search(queries.vectors, k)
+        batch_seconds = time.perf_counter() - start
+
+        labels = np.stack(labels)
+        retrieved = np.where(labels >= 0, base_ids[labels], -1)
+        latencies_ms = np.array(latencies) * 1000
+        result = {
+            **summary,
+            "search_params": search_params,
+            "recall_at_k": round(recall_at_k(retrieved, ground_truth), 4),
+            "latency_ms": {
+                "mean": round(float(latencies_ms.mean()), 4),
+                "p50": round(float(np.percentile(latencies_ms, 50)), 4),
+                "p95": round(float(np.percentile(latencies_ms, 95)), 4),
+                "p99": round(float(np.percentile(latencies_ms, 99)), 4),
+            },
+            "queries_per_second": round(len(queries) / batch_seconds, 1),
+        }
+        logger.info(
+            "Index '%s' %s: recall@%d %.4f, p95 latency %.3fms",
+            name,
+            search_params,
+            k,
+            result["recall_at_k"],
+            result["latency_ms"]["p95"],
+        )
+        results.append(result)
+    return results
+
+
+def _build_index(
+    factory: str,
+    embeddings: EmbeddingMatrix,
+    queries: EmbeddingMatrix,
+    params: dict,
+) -> tuple[faiss.Index, np.ndarray]:
+    dimension = queries.vectors.shape[1]
+    index = faiss.index_factory(dimension, factory, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        index.train(_training_sample(embeddings, queries, params))
+
+    # Not every index type supports ids, so labels are row positions
+    base_ids = []
+    for ids, vectors in _iter_base(embeddings, queries, params):
+        index.add(vectors)
+        base_ids.append(ids)
+    return index, np.concatenate(base_ids)
+
+
+def _training_sample(
+    embeddings: EmbeddingMatrix,
+    queries: EmbeddingMatrix,
+    params: dict,
+) -> np.ndarray:
+    rows = np.flatnonzero(~np.isin(embeddings.ids, queries.ids))
+    max_train_size = params.get("max_train_size", 100000)
+    if len(rows) > max_train_size:
+        rng = np.random.default_rng(params.get("seed"))
+        rows = np.sort(rng.choice(rows, max_train_size, replace=False))
+    return as_float32(embeddings.vectors[rows], params.get("normalize", False))
+
+
+def _as_matrix(
+    embeddings: EmbeddingMatrix | Iterable[EmbeddingMatrix],
+) -> EmbeddingMatrix:
+    # ``DaskRunner`` passes the chunks of ``read_chunked``, but queries are
+    # sampled from all rows and the rows are read once per configuration
+    if isinstance(embeddings, EmbeddingMatrix):
+        return embeddings
+    chunks = list(embeddings)
+    if not chunks:
+        msg = "No embeddings to evaluate the index configurations on"
+        raise ValueError(msg)
+    logger.info("Reading %d embedding chunks into memory", len(chunks))
+    return EmbeddingMatrix(
+        ids=np.concatenate([chunk.ids for chunk in chunks]),
+        vectors=np.concatenate([chunk.vectors for chunk in chunks]),
+    )
+
+
+def _iter_base(
+    embeddings: EmbeddingMatrix,
+    queries: EmbeddingMatrix,
+    params: dict,
+) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    # The embedding rows without the held out queries, a batch at a time
+    batch_size = params.get("batch_size", 65536)
+    for start in range(0, len(embeddings), batch_size):
+        ids = np.asarray(embeddings.ids[start : start + batch_size])
+        keep = ~np.isin(ids, queries.ids)
+        vectors = embeddings.vectors[start : start + batch_size][keep]
+        yield ids[keep], as_float32(vectors, params.get("normalize", False))
@@ -0,0 +1,41 @@
+from kedro.pipeline import Pipeline, node, pipeline
+
+from .nodes import (
+    compute_ground_truth,
+    evaluate_index_configurations,
+    select_evaluation_queries,
+)
+
+
+def create_pipeline(**kwargs) -> Pipeline:
+    return pipeline(
+        [
+            node(
+                func=select_evaluation_queries,
+                inputs=["rerank_matrix", "params:index_evaluation_params"],
+                outputs="evaluation_queries",
+                name="select_evaluation_queries",
+            ),
+            node(
+                func=compute_ground_truth,
+                inputs=[
+                    "rerank_matrix",
+                    "evaluation_queries",
+                    "params:index_evaluation_params",
+                ],
+                outputs="evaluation_ground_truth",
+                name="compute_ground_truth",
+            ),
+            node(
+                func=evaluate_index_configurations,
+                inputs=[
+                    "rerank_matrix",
+                    "evaluation_queries",
+                    "evaluation_ground_truth",
+                    "params:index_evaluation_params",
+                ],
+                outputs="index_evaluation_report",
+                name="evaluate_index_configurations",
+            ),
+        ],
+    )
@@ -0,0 +1,3 @@
+"""Search metadata pipeline building the side indexes used for filtering."""
+
+from .pipeline import create_pipeline  # NOQA
@@ -0,0 +1,301 @@
+import io
+import logging
+import math
+import re
+from collections import Counter
+from collections.abc import Iterable
+
+import pandas as pd
+import torch
+from PIL import Image
+from transformers import (
+    AutoTokenizer,
+    VisionEncoderDecoderModel,
+    ViTImageProcessor,
+)
+
+logger = logging.getLogger(__name__)
+
+# Shared with the backend through the saved index so queries are tokenised
+# exactly like the indexed documents
+TOKEN_PATTERN = r"[a-z0-9]+"
+
+
+def tokenize(text: str, pattern: str = TOKEN_PATTERN) -> list[str]:
+    """Split text into lowercase alphanumeric tokens.
+
+    Tags are partition paths, so ``"beach/sunset_01"`` yields
+    ``["beach", "sunset", "01"]``.
+    """
+    return re.findall(pattern, text.lower())
+
+
+def list_image_tags(
+    image_manifest: dict,
+    near_duplicates: dict | None = None,
+) -> pd.DataFrame:
+    """List the tag of every indexed image from the image manifest.
+
+    The manifest covers all images, including those an incremental run did
+    not embed again, so the side indexes built from it stay complete.
+    Near-duplicates are left out like they are from the FAISS index, so tag
+    and keyword searches return only the representative of a group.
+
+    Args:
+    ----
+        image_manifest: Manifest produced by ``plan_image_updates``
+        near_duplicates: Groups found by ``find_near_duplicates``, or None
+
+    Returns:
+    -------
+        DataFrame with 'image_id' and 'image_tag' columns
+    """
+    images = image_manifest["images"]
+    duplicate_ids = set(
+        near_duplicates["duplicate_ids"] if near_duplicates else [],
+    )
+    images = {
+        tag: entry
+        for tag, entry in images.items()
+        if entry["image_id"] not in duplicate_ids
+    }
+    return pd.DataFrame(
+        {
+            "image_id": [entry["image_id"] for entry in images.values()],
+            "image_tag": list(images),
+        },
+    )
+
+
+def build_tag_index(data: pd.DataFrame) -> dict[str, list[int]]:
+    """Build an inverted index from image tag to image ids.
+
+    The index lets the backend restrict a FAISS search to the ids carrying a
+    tag, or a tag prefix such as a partition directory, without fetching
+    and filtering results after the search.
+
+    Args:
+    ----
+        data: DataFrame containing 'image_id' and 'image_tag' columns
+
+    Returns:
+    -------
+        Mapping from tag to the sorted ids of the images carrying it
+    """
+    logger.info("Building tag index for %d images", len(data))
+
+    grouped = data.groupby("image_tag", sort=True)["image_id"]
+    tag_index = {
+        str(tag): sorted(int(image_id) for image_id in image_ids)
+        for tag, image_ids in grouped
+    }
+
+    logger.info("Built tag index with %d tags", len(tag_index))
+    return tag_index
+
+
+def generate_image_captions(
+    data: pd.DataFrame | Iterable[pd.DataFrame],
+    params: dict,
+    image_manifest: dict | None = None,
+    previous_captions: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """Caption every image so captions can be searched lexically.
+
+    On an incremental run ``data`` only holds new and changed images. Their
+    captions are merged with the previous captions of the images left
+    untouched, and captions of deleted images are dropped. When a batch
+    fails, its images are captioned one by one, so only the images that
+    cannot be read or captioned are left without a caption.
+
+    Args:
+    ----
+        data: DataFrame containing 'image_id' and 'image_data' columns, or
+            an iterator of such DataFrames when read in chunks
+        params: Caption model name, batch size and generation settings.
+            Captioning is skipped when 'caption_images' is false.
+        image_manifest: Manifest produced by ``plan_image_updates``
+        previous_captions: Captions written by the previous run, or None
+
+    Returns:
+    -------
+        DataFrame with 'image_id' and 'caption' columns
+    """
+    if not params.get("caption_images", True):
+        logger.info("Image captioning disabled, indexing tags only")
+        return pd.DataFrame({"image_id": [], "caption": []})
+
+    model_reference = params["caption_model"]
+    feature_extractor = ViTImageProcessor.from_pretrained(model_reference)
+    tokenizer = AutoTokenizer.from_pretrained(model_reference)
+    model = VisionEncoderDecoderModel.from_pretrained(model_reference)
+    model.eval()
+    logger.info("Initialized caption model %s", model_reference)
+
+    gen_kwargs = {
+        "max_length": params.get("max_length", 50),
+        "num_beams": params.get("num_beams", 4),
+    }
+    batch_size = params.get("caption_batch_size", 16)
+
+    image_ids = []
+    captions = []
+    frames = [data] if isinstance(data, pd.DataFrame) else data
+    batches = (
+        frame.iloc[start : start + batch_size]
+        for frame in frames
+        for start in range(0, len(frame), batch_size)
+    )
+
+    def caption(images: list[Image.Image]) -> list[str]:
+        pixel_values = feature_extractor(
+            images=images,
+            return_tensors="pt",
+        ).pixel_values
+        with torch.no_grad():
+            output_ids = model.generate(pixel_values, **gen_kwargs)
+        return [
+            text.strip()
+            for text in tokenizer.batch_decode(
+                output_ids,
+                skip_special_tokens=True,
+            )
+        ]
+
+    def caption_alone(image_id: int, image: Image.Image) -> str | None:
+        try:
+            return caption([image])[0]
+        except Exception as e:
+            logger.error("Error captioning image %s: %s", image_id, str(e))
+            return None
+
+    for batch in batches:
+        batch_ids = []
+        images = []
+        for image_id, image_data in zip(
+            batch["image_id"],
+            batch["image_data"],
+            strict=True,
+        ):
+            try:
+                image = Image.open(io.BytesIO(image_data)).convert("RGB")
+            except Exception as e:
+                logger.error("Error reading image %s: %s", image_id, str(e))
+                continue
+            batch_ids.append(int(image_id))
+            images.append(image)
+        if not images:
+            continue
+
+        try:
+            batch_captions = caption(images)
+        except Exception as e:
+            logger.warning(
+                "Error captioning batch starting at image %s, captioning "
+                "its images one by one: %s",
+                batch_ids[0],
+                str(e),
+            )
+            # Only the images that fail on their own are left uncaptioned
+            batch_captions = [
+                caption_alone(image_id, image)
+                for image_id, image in zip(batch_ids, images, strict=True)
+            ]
+
+        for image_id, text in zip(batch_ids, batch_captions, strict=True):
+            if text is not None:
+                image_ids.append(image_id)
+                captions.append(text)
+
+    logger.info("Generated %d captions", len(captions))
+    new_captions = pd.DataFrame({"image_id": image_ids, "caption": captions})
+    if image_manifest is None or not image_manifest["incremental"]:
+        return new_captions
+
+    if previous_captions is None:
+        logger.warning("No previous captions, keeping new captions only")
+        return new_captions
+
+    stale_ids = image_manifest["deleted_ids"] + image_manifest["upserted_ids"]
+    kept = previous_captions[~previous_captions["image_id"].isin(stale_ids)]
+    return pd.concat([kept, new_captions], ignore_index=True)
+
+
+def build_lexical_index(
+    data: pd.DataFrame,
+    captions: pd.DataFrame,
+    params: dict,
+) -> dict:
+    """Build a BM25 inverted index over image tags and captions.
+
+    BM25 term weights are computed here, so scoring a query in the backend
+    is only a sum of the stored weights of its terms.
+
+    Args:
+    ----
+        data: DataFrame containing 'image_id' and 'image_tag' columns
+        captions: DataFrame containing 'image_id' and 'caption' columns
+        params: BM25 'k1' and 'b' parameters
+
+    Returns:
+    -------
+        JSON serialisable index with the token pattern, the BM25 parameters
+        and corpus statistics the backend weighs images it ingests with,
+        and, for every term, the ids of the images containing it and their
+        BM25 weights
+    """
+    k1 = params.get("k1", 1.2)
+    b = params.get("b", 0.75)
+
+    caption_by_id = dict(
+        zip(captions["image_id"], captions["caption"], strict=False),
+    )
+    term_counts = {}
+    for image_id, image_tag in zip(
+        data["image_id"],
+        data["image_tag"],
+        strict=False,
+    ):
+        text = f"{image_tag} {caption_by_id.get(image_id, '')}"
+        term_counts[int(image_id)] = Counter(tokenize(text))
+
+    doc_lengths = {
+        image_id: sum(counts.values())
+        for image_id, counts in term_counts.items()
+    }
+    n_docs = len(term_counts)
+    avgdl = sum(doc_lengths.values()) / n_docs if n_docs else 0.0
+
+    postings = {}
+    for image_id, counts in term_counts.items():
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((image_id, tf))
+
+    terms = {}
+    for term, docs in sorted(postings.items()):
+        idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+        weights = [
+            idf
+            * tf
+            * (k1 + 1)
+            / (tf + k1 * (1 - b + b * doc_lengths[image_id] / avgdl))
+            for image_id, tf in docs
+        ]
+        terms[term] = {
+            "ids": [image_id for image_id, _ in docs],
+            "weights": [round(weight, 4) for weight in weights],
+        }
+
+    logger.info(
+        "Built lexical index with %d terms over %d images",
+        len(terms),
+        n_docs,
+    )
+    return {
+        "token_pattern": TOKEN_PATTERN,
+        "k1": k1,
+        "b": b,
+        "n_docs": n_docs,
+        "avgdl": avgdl,
+        "terms": terms,
+    }
@@ -0,0 +1,49 @@
+from kedro.pipeline import Pipeline, node, pipeline
+
+from .nodes import (
+    build_lexical_index,
+    build_tag_index,
+    generate_image_captions,
+    list_image_tags,
+)
+
+
+def create_pipeline(**kwargs) -> Pipeline:
+    return pipeline(
+        [
+            node(
+                func=list_image_tags,
+                inputs=["image_manifest", "near_duplicate_groups"],
+                outputs="image_tags",
+                name="list_image_tags",
+            ),
+            node(
+                func=build_tag_index,
+                inputs=["image_tags"],
+                outputs="tag_index",
+                name="build_tag_index",
+            ),
+            node(
+                func=generate_image_captions,
+                inputs=[
+                    "embeddings@parquet",
+                    "params:lexical_index_params",
+                    "image_manifest",
+                    "image_captions_previous",
+                ],
+                outputs="image_captions",
+                name="generate_image_captions",
+                tags=["items.embeddings"],
+            ),
+            node(
+                func=build_lexical_index,
+                inputs=[
+                    "image_tags",
+                    "image_captions",
+                    "params:lexical_index_params",
+                ],
+                outputs="lexical_index",
+                name="build_lexical_index",
+            ),
+        ],
+    )
@@ -42,7 +42,7 @@ class _DaskDataset(AbstractDataset):
         except ValueError:
             # Upon successfully executing the pipeline, the runner loads
             # free outputs on the scheduler (as opposed to on a worker).
-            Client.current().get_dataset(self._name)
+            return Client.current().get_dataset(self._name)
 
     def _save(self, data: Any) -> None:
         with worker_client() as client:
@@ -65,7 +65,16 @@ class DaskRunner(AbstractRunner):
         self, client_args: dict[str, Any] | None = None, is_async: bool = False
     ) -> None:
         """Initialize with Dask client arguments."""
-        super().__init__(is_async=is_async)
+        # Unregistered datasets are published to the Dask scheduler
+        default_dataset_pattern = {
+            "{default}": {
+                "type": f"{__name__}._DaskDataset",
+                "name": "{default}",
+            }
+        }
+        super().__init__(
+            is_async=is_async, extra_dataset_patterns=default_dataset_pattern
+        )
         self._client_args = client_args or {}
         self._client = None
 
@@ -178,10 +187,12 @@ class DaskRunner(AbstractRunner):
                 batch_futures = {}
 
                 for node in batch_nodes:
+                    # Upstream nodes may have been submitted in this batch
+                    submitted = {**node_futures, **batch_futures}
                     dependencies = (
-                        node_futures[dependency]
+                        submitted[dependency]
                         for dependency in node_dependencies[node]
-                        if dependency in node_futures
+                        if dependency in submitted
                     )
                     batch_futures[node] = client.submit(
                         DaskRunner._run_node,
@@ -270,6 +281,8 @@ class DaskRunner(AbstractRunner):
         unregistered_ds = pipeline.datasets() - set(catalog.list())
         # Some of the unregistered datasets could have been published to
         # the scheduler in a previous run, so we need not recreate them.
+        # Checking needs the client, which `run` reuses and closes.
+        self._initialize_client()
         missing_unregistered_ds = {
             ds_name
             for ds_name in unregistered_ds
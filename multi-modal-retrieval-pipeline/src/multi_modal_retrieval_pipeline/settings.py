@@ -27,7 +27,10 @@ https://docs.kedro.org/en/stable/kedro_project_setup/settings.html.
 # Class that manages how configuration is loaded.
 from kedro.config import OmegaConfigLoader
 
-from multi_modal_retrieval_pipeline.hooks import PipelineLoggingHook
+from multi_modal_retrieval_pipeline.hooks import (
+    PipelineLoggingHook,
+    PipelinePerformanceHook,
+)
 
 CONFIG_LOADER_CLASS = OmegaConfigLoader
 # Keyword arguments to pass to the `CONFIG_LOADER_CLASS` constructor.
@@ -47,4 +50,4 @@ CONFIG_LOADER_ARGS = {
 # Class that manages the Data Catalog.
 # from kedro.io import DataCatalog
 # DATA_CATALOG_CLASS = DataCatalog
-HOOKS = (PipelineLoggingHook(),)
+HOOKS = (PipelineLoggingHook(), PipelinePerformanceHook())
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from multi_modal_retrieval_pipeline.io.chunked_parquet_dataset import (
+    ChunkedParquetDataset,
+    DataFrameChunks,
+)
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrixDataset,
+)
+
+
+def _chunk(start: int, size: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "image_id": range(start, start + size),
+            "embedding": [np.full(4, i, np.float32) for i in range(size)],
+            "image_data": [b"\xff\xd8" * (i + 1) for i in range(size)],
+        },
+    )
+
+
+@pytest.fixture()
+def dataset(tmp_path):
+    return ChunkedParquetDataset(filepath=str(tmp_path / "embeddings.pq"))
+
+
+def test_save_chunks_as_row_groups(dataset, tmp_path) -> None:
+    consumed = []
+
+    def chunks():
+        for start in (0, 3, 6):
+            consumed.append(start)
+            yield _chunk(start, 3)
+
+    dataset.save(DataFrameChunks(chunks()))
+
+    assert consumed == [0, 3, 6]
+    assert pq.ParquetFile(tmp_path / "embeddings.pq").num_row_groups == 3
+    loaded = dataset.load()
+    assert list(loaded["image_id"]) == list(range(9))
+    assert loaded["image_data"].iloc[1] == b"\xff\xd8" * 2
+
+
+def test_save_dataframe(dataset) -> None:
+    dataset.save(_chunk(0, 5))
+
+    assert dataset.exists()
+    assert len(dataset.load()) == 5
+
+
+def test_failed_stream_keeps_previous_file(dataset, tmp_path) -> None:
+    dataset.save(_chunk(0, 2))
+
+    def failing_chunks():
+        yield _chunk(0, 3)
+        msg = "encoding failed"
+        raise RuntimeError(msg)
+
+    with pytest.raises(Exception, match="encoding failed"):
+        dataset.save(DataFrameChunks(failing_chunks()))
+
+    assert len(dataset.load()) == 2
+    assert list(tmp_path.iterdir()) == [tmp_path / "embeddings.pq"]
+
+
+def test_save_splits_embedding_matrix(tmp_path) -> None:
+    matrix_path = tmp_path / "embedding_matrix"
+    dataset = ChunkedParquetDataset(
+        filepath=str(tmp_path / "embeddings.pq"),
+        matrix={"filepath": str(matrix_path)},
+    )
+
+    dataset.save(DataFrameChunks([_chunk(0, 3), _chunk(3, 2)]))
+
+    assert "embedding" not in dataset.load().columns
+    matrix = EmbeddingMatrixDataset(filepath=str(matrix_path)).load()
+    assert isinstance(matrix.vectors, np.memmap)
+    assert matrix.vectors.dtype == np.float32
+    assert matrix.vectors.flags.c_contiguous
+    assert matrix.vectors.shape == (5, 4)
+    assert list(matrix.ids) == [0, 1, 2, 3, 4]
+    assert matrix.vectors[4, 0] == 1
+
+
+def test_read_chunked_yields_row_groups(dataset) -> None:
+    dataset.write_chunked(DataFrameChunks([_chunk(0, 3), _chunk(3, 2)]))
+
+    chunks = list(dataset.read_chunked())
+
+    assert [len(chunk) for chunk in chunks] == [3, 2]
+    assert list(chunks[1]["image_id"]) == [3, 4]
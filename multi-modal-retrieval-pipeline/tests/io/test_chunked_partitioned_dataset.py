@@ -0,0 +1,19 @@
+from multi_modal_retrieval_pipeline.io.chunked_partitioned_dataset import (
+    ChunkedPartitionedDataset,
+)
+
+
+def test_read_chunked_yields_partition_chunks(tmp_path) -> None:
+    for i in range(5):
+        (tmp_path / f"{i}.jpg").write_bytes(bytes([i]))
+    dataset = ChunkedPartitionedDataset(
+        path=str(tmp_path),
+        dataset="multi_modal_retrieval_pipeline.io.raw_bytes_dataset.RawBytesDataset",
+        filename_suffix=".jpg",
+        chunk_size=2,
+    )
+
+    chunks = list(dataset.read_chunked())
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[2]["4"]() == bytes([4])
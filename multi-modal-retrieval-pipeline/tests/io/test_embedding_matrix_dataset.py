@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrix,
+    EmbeddingMatrixDataset,
+)
+
+
+def _matrix(start: int, size: int) -> EmbeddingMatrix:
+    return EmbeddingMatrix(
+        ids=np.arange(start, start + size),
+        vectors=np.full((size, 3), start, np.float64),
+    )
+
+
+@pytest.fixture()
+def dataset(tmp_path):
+    return EmbeddingMatrixDataset(filepath=str(tmp_path / "matrix"))
+
+
+def test_save_chunks_as_one_matrix(dataset) -> None:
+    dataset.save(iter([_matrix(0, 2), _matrix(2, 0), _matrix(2, 3)]))
+
+    matrix = dataset.load()
+    assert list(matrix.ids) == [0, 1, 2, 3, 4]
+    assert matrix.vectors.dtype == np.float32
+    np.testing.assert_array_equal(matrix.vectors[:, 0], [0, 0, 2, 2, 2])
+
+
+def test_save_float16_matrix(tmp_path) -> None:
+    dataset = EmbeddingMatrixDataset(
+        filepath=str(tmp_path / "matrix"),
+        dtype="float16",
+    )
+    dataset.save(_matrix(0, 2))
+
+    matrix = dataset.load()
+    assert matrix.vectors.dtype == np.float16
+    assert (tmp_path / "matrix" / "vectors.npy").stat().st_size == 128 + 12
+
+
+def test_save_empty_matrix(dataset) -> None:
+    dataset.save([])
+
+    assert dataset.exists()
+    assert len(dataset.load()) == 0
+
+
+def test_dimension_mismatch_keeps_previous_matrix(dataset, tmp_path) -> None:
+    dataset.save(_matrix(0, 2))
+    mismatched = EmbeddingMatrix(ids=np.arange(1), vectors=np.ones((1, 4)))
+
+    with pytest.raises(Exception, match="dimension"):
+        dataset.save([_matrix(5, 1), mismatched])
+
+    assert len(dataset.load()) == 2
+    assert sorted(path.name for path in (tmp_path / "matrix").iterdir()) == [
+        "ids.npy",
+        "vectors.npy",
+    ]
+
+
+def test_read_chunked_yields_views(tmp_path) -> None:
+    dataset = EmbeddingMatrixDataset(
+        filepath=str(tmp_path / "matrix"),
+        chunk_size=2,
+    )
+    dataset.write_chunked(_matrix(0, 5))
+
+    chunks = list(dataset.read_chunked())
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert list(chunks[2].ids) == [4]
+    assert isinstance(chunks[0].vectors, np.memmap)
@@ -0,0 +1,134 @@
+import hashlib
+from pathlib import Path
+
+import faiss
+import numpy as np
+import pytest
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrix,
+)
+from multi_modal_retrieval_pipeline.io.faiss_dataset import (
+    FaissDataset,
+    IndexBatches,
+)
+
+
+def test_write_chunked_adds_batches(tmp_path) -> None:
+    dataset = FaissDataset(filepath=str(tmp_path / "index.idx"))
+    batches = (
+        EmbeddingMatrix(
+            ids=np.arange(start, start + 3),
+            vectors=np.ones((3, 4)),
+        )
+        for start in (0, 3)
+    )
+    index = faiss.IndexIDMap(faiss.IndexFlatIP(4))
+
+    dataset.write_chunked(IndexBatches(index, batches))
+
+    loaded = dataset.load()
+    assert loaded.ntotal == 6
+    _, ids = loaded.search(np.ones((1, 4), np.float32), k=6)
+    assert sorted(ids[0]) == list(range(6))
+
+
+def test_exists_after_save(tmp_path) -> None:
+    dataset = FaissDataset(filepath=str(tmp_path / "index.idx"))
+    assert not dataset.exists()
+
+    dataset.save(faiss.IndexIDMap(faiss.IndexFlatIP(4)))
+
+    assert dataset.exists()
+
+
+def test_save_writes_metadata_sidecar(tmp_path) -> None:
+    dataset = FaissDataset(filepath=str(tmp_path / "index.idx"))
+    batches = IndexBatches(
+        faiss.IndexIDMap(faiss.IndexFlatIP(4)),
+        [EmbeddingMatrix(ids=np.arange(3), vectors=np.ones((3, 4)))],
+        metadata={"source_data_version": "abc", "normalized": True},
+    )
+
+    dataset.save(batches)
+
+    metadata = dataset.load_metadata()
+    assert metadata["dimension"] == 4
+    assert metadata["ntotal"] == 3
+    assert metadata["index_type"] == "IndexIDMap(IndexFlatIP)"
+    assert metadata["metric"] == "inner_product"
+    assert metadata["source_data_version"] == "abc"
+    assert metadata["normalized"] is True
+    assert metadata["transforms"] == []
+    checksum = hashlib.sha256((tmp_path / "index.idx").read_bytes())
+    assert metadata["checksum"] == f"sha256:{checksum.hexdigest()}"
+    # Nothing is left behind from the atomic writes
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "index.idx",
+        "index.meta.json",
+    ]
+
+
+def test_save_records_transforms(tmp_path) -> None:
+    dataset = FaissDataset(filepath=str(tmp_path / "index.idx"))
+    index = faiss.IndexPreTransform(
+        faiss.PCAMatrix(8, 4),
+        faiss.IndexFlatIP(4),
+    )
+    index.train(np.random.default_rng(0).random((16, 8), dtype=np.float32))
+
+    dataset.save(IndexBatches(faiss.IndexIDMap(index), []))
+
+    metadata = dataset.load_metadata()
+    assert metadata["dimension"] == 8
+    assert metadata["transforms"] == [
+        {"type": "PCAMatrix", "d_in": 8, "d_out": 4},
+    ]
+
+
+def test_versioned_save_moves_latest_pointer(tmp_path) -> None:
+    filepath = str(tmp_path / "index.idx")
+    for version, ntotal in [("2024-01-01T00.00.00.000Z", 1), (None, 2)]:
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(4))
+        index.add_with_ids(np.ones((ntotal, 4), np.float32), np.arange(ntotal))
+        FaissDataset(filepath, version=version, is_versioned=True).save(index)
+
+    latest = FaissDataset(filepath, is_versioned=True)
+    assert latest.load().ntotal == 2
+    assert latest.load_metadata()["ntotal"] == 2
+    pinned = FaissDataset(
+        filepath,
+        version="2024-01-01T00.00.00.000Z",
+        is_versioned=True,
+    )
+    assert pinned.load().ntotal == 1
+
+
+def test_failed_save_keeps_index_and_sidecar(tmp_path, monkeypatch) -> None:
+    dataset = FaissDataset(filepath=str(tmp_path / "index.idx"))
+    index = faiss.IndexIDMap(faiss.IndexFlatIP(4))
+    index.add_with_ids(np.ones((2, 4), np.float32), np.arange(2))
+    dataset.save(index)
+    replace = Path.replace
+    renamed = []
+
+    def fail_index_rename(self, target):
+        renamed.append(Path(target).name)
+        if Path(target).suffix == ".idx":
+            msg = "disk full"
+            raise OSError(msg)
+        return replace(self, target)
+
+    monkeypatch.setattr(Path, "replace", fail_index_rename)
+    index.add_with_ids(np.ones((3, 4), np.float32), np.arange(2, 5))
+    with pytest.raises(Exception, match="Error saving index: disk full"):
+        dataset.save(index)
+    monkeypatch.undo()
+
+    # The new sidecar went in first and was rolled back with the index
+    assert renamed == ["index.meta.json", "index.idx", "index.meta.json"]
+    assert dataset.load().ntotal == 2
+    assert dataset.load_metadata()["ntotal"] == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "index.idx",
+        "index.meta.json",
+    ]
@@ -0,0 +1,18 @@
+from multi_modal_retrieval_pipeline.io.optional_dataset import OptionalDataset
+
+
+def test_load_missing_dataset_returns_none(tmp_path) -> None:
+    dataset = OptionalDataset(
+        dataset={
+            "type": "json.JSONDataset",
+            "filepath": str(tmp_path / "manifest.json"),
+        },
+    )
+
+    assert not dataset.exists()
+    assert dataset.load() is None
+
+    dataset.save({"next_id": 3})
+
+    assert dataset.exists()
+    assert dataset.load() == {"next_id": 3}
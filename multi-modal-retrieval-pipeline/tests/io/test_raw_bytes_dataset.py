@@ -0,0 +1,10 @@
+from multi_modal_retrieval_pipeline.io.raw_bytes_dataset import RawBytesDataset
+
+
+def test_save_and_load_bytes(tmp_path) -> None:
+    dataset = RawBytesDataset(filepath=str(tmp_path / "images" / "a.jpg"))
+
+    assert not dataset.exists()
+    dataset.save(b"\xff\xd8\xff\xe0")
+
+    assert dataset.load() == b"\xff\xd8\xff\xe0"
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+from multi_modal_retrieval_pipeline.io.shard_checkpoint_dataset import (
+    ShardCheckpoint,
+    ShardCheckpointDataset,
+)
+
+
+def test_resume_returns_committed_shards(tmp_path) -> None:
+    checkpoint = ShardCheckpointDataset(path=str(tmp_path / "ckpt")).load()
+    assert checkpoint.resume("run-1") == set()
+
+    checkpoint.commit_shard(0, pd.DataFrame({"image_tag": ["a", "b"]}))
+    checkpoint.commit_shard(2, pd.DataFrame({"image_tag": ["e"]}))
+
+    resumed = ShardCheckpoint(tmp_path / "ckpt")
+    assert resumed.resume("run-1") == {0, 2}
+    assert list(resumed.load_shard(2)["image_tag"]) == ["e"]
+
+
+def test_resume_with_other_key_starts_over(tmp_path) -> None:
+    checkpoint = ShardCheckpoint(tmp_path / "ckpt")
+    checkpoint.resume("run-1")
+    checkpoint.commit_shard(0, pd.DataFrame({"image_tag": ["a"]}))
+
+    assert ShardCheckpoint(tmp_path / "ckpt").resume("run-2") == set()
+    assert not (tmp_path / "ckpt" / "shard-00000.pq").exists()
+
+
+def test_exists_while_shards_are_stored(tmp_path) -> None:
+    dataset = ShardCheckpointDataset(path=str(tmp_path / "ckpt"))
+    checkpoint = dataset.load()
+    checkpoint.resume("run-1")
+    assert not dataset.exists()
+
+    checkpoint.commit_shard(0, pd.DataFrame({"image_tag": ["a"]}))
+    assert dataset.exists()
+
+    checkpoint.clear()
+    assert not dataset.exists()
+    assert not (tmp_path / "ckpt").exists()
+
+
+def test_save_is_not_supported(tmp_path) -> None:
+    dataset = ShardCheckpointDataset(path=str(tmp_path / "ckpt"))
+
+    with pytest.raises(Exception, match="committed through"):
+        dataset.save(pd.DataFrame())
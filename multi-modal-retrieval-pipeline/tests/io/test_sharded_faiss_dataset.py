@@ -0,0 +1,101 @@
+import json
+
+import faiss
+import numpy as np
+import pytest
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrix,
+)
+from multi_modal_retrieval_pipeline.io.faiss_dataset import IndexBatches
+from multi_modal_retrieval_pipeline.io.sharded_faiss_dataset import (
+    ShardedFaissDataset,
+)
+
+
+def _batches(ids: np.ndarray) -> IndexBatches:
+    vectors = np.random.default_rng(0).random((len(ids), 4), np.float32)
+    return IndexBatches(
+        faiss.IndexIDMap(faiss.IndexFlatIP(4)),
+        [EmbeddingMatrix(ids=ids, vectors=vectors)],
+        batch_size=4,
+        metadata={"normalized": False},
+    )
+
+
+def test_save_splits_index_by_id(tmp_path) -> None:
+    dataset = ShardedFaissDataset(path=str(tmp_path), num_shards=3)
+
+    dataset.save(_batches(np.arange(10)))
+
+    assert sorted(p.name for p in tmp_path.glob("*.idx")) == [
+        "shard-000.idx",
+        "shard-001.idx",
+        "shard-002.idx",
+    ]
+    index = dataset.load()
+    assert index.ntotal == 10
+    assert [shard.ntotal for shard in index.shards] == [4, 3, 3]
+    _, ids = index.shards[1].search(np.ones((1, 4), np.float32), k=3)
+    assert sorted(ids[0]) == [1, 4, 7]
+    # Results of every shard are merged into the best k
+    _, ids = index.search(np.ones((1, 4), np.float32), k=10)
+    assert sorted(ids[0]) == list(range(10))
+    metadata = json.loads((tmp_path / "shard-002.meta.json").read_text())
+    assert metadata["ntotal"] == 3
+    assert metadata["shard"] == 2
+    assert metadata["num_shards"] == 3
+
+
+def test_incremental_save_only_writes_changed_shards(tmp_path) -> None:
+    dataset = ShardedFaissDataset(path=str(tmp_path), num_shards=3)
+    dataset.save(_batches(np.arange(10)))
+    unchanged = (tmp_path / "shard-000.idx").stat().st_mtime_ns
+
+    index = dataset.load()
+    assert index.remove_ids(np.array([4, 5])) == 2
+    dataset.save(
+        IndexBatches(
+            index,
+            [
+                EmbeddingMatrix(
+                    ids=np.array([10]),
+                    vectors=np.ones((1, 4), np.float32),
+                ),
+            ],
+            metadata={"source_data_version": "v2"},
+        ),
+    )
+
+    index = dataset.load()
+    assert [shard.ntotal for shard in index.shards] == [4, 3, 2]
+    assert (tmp_path / "shard-000.idx").stat().st_mtime_ns == unchanged
+    # The sidecar of the unchanged shard still describes the latest run
+    metadata = json.loads((tmp_path / "shard-000.meta.json").read_text())
+    assert metadata["source_data_version"] == "v2"
+    assert metadata["ntotal"] == 4
+
+
+def test_save_removes_extra_shards(tmp_path) -> None:
+    ShardedFaissDataset(path=str(tmp_path), num_shards=4).save(
+        _batches(np.arange(10)),
+    )
+
+    dataset = ShardedFaissDataset(path=str(tmp_path), num_shards=2)
+    dataset.save(_batches(np.arange(10)))
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "shard-000.idx",
+        "shard-000.meta.json",
+        "shard-001.idx",
+        "shard-001.meta.json",
+    ]
+    assert dataset.load().ntotal == 10
+
+
+def test_load_needs_every_shard(tmp_path) -> None:
+    ShardedFaissDataset(path=str(tmp_path), num_shards=2).save(
+        _batches(np.arange(10)),
+    )
+
+    with pytest.raises(Exception, match="Found 2 shards"):
+        ShardedFaissDataset(path=str(tmp_path), num_shards=3).load()
@@ -4,14 +4,30 @@ from collections import OrderedDict
 import numpy as np
 import pandas as pd
 import pytest
+from distributed import Client
 from kedro.pipeline import Pipeline
+from multi_modal_retrieval_pipeline.io.raw_bytes_dataset import RawBytesDataset
+from multi_modal_retrieval_pipeline.io.shard_checkpoint_dataset import (
+    ShardCheckpoint,
+)
+from multi_modal_retrieval_pipeline.pipelines.data_processing import nodes
 from multi_modal_retrieval_pipeline.pipelines.data_processing.nodes import (
+    encode_images,
     generate_clip_embeddings,
     image_to_bytes,
+    load_image,
+    plan_image_updates,
 )
 from multi_modal_retrieval_pipeline.pipelines.data_processing.pipeline import (
     create_pipeline,
 )
+from multi_modal_retrieval_pipeline.pipelines.data_processing.prefetch import (
+    prefetch_batches,
+)
+from multi_modal_retrieval_pipeline.pipelines.data_processing.sharding import (
+    map_shards,
+    split_shards,
+)
 from PIL import Image
 
 
@@ -28,40 +44,58 @@ def test_pipeline_structure() -> None:
     pipeline = create_pipeline()
 
     # Test number of nodes
-    assert len(pipeline.nodes) == 1, "Pipeline should have exactly one node"
+    assert len(pipeline.nodes) == 2, "Pipeline should have exactly two nodes"
+    nodes = {node.name: node for node in pipeline.nodes}
 
     # Test node properties
-    node = pipeline.nodes[0]
-    assert node.name == "generate_embeddings", "Node should have correct name"
+    node = nodes["plan_image_updates"]
+    assert node.inputs == [
+        "partitioned_images",
+        "params:image_embedding_params",
+        "image_manifest_previous",
+    ], "Node should have correct input"
+    assert node.outputs == ["image_manifest"], "Node should have correct output"
+
+    node = nodes["generate_embeddings"]
     assert node.inputs == [
         "partitioned_images",
         "params:image_embedding_params",
+        "image_manifest",
+        "embedding_checkpoint",
     ], "Node should have correct input"
-    assert node.outputs == ["embeddings"], "Node should have correct output"
+    assert node.outputs == [
+        "embeddings@parquet",
+    ], "Node should have correct output"
 
 
 @pytest.mark.cov()
 def test_pipeline_inputs_outputs() -> None:
     """Test pipeline inputs and outputs."""
     pipeline = create_pipeline()
-    PIPELINE_INPUTS = 2
+    PIPELINE_INPUTS = 4
     PIPELINE_OUTPUTS = 1
 
     # Test pipeline inputs
     inputs = pipeline.inputs()
-    assert len(inputs) == PIPELINE_INPUTS, "Pipeline should have two inputs"
+    assert len(inputs) == PIPELINE_INPUTS, "Pipeline should have four inputs"
     assert (
         "partitioned_images" in inputs
     ), "Pipeline should require partitioned_images as input"
     assert (
         "params:image_embedding_params" in inputs
     ), "Pipeline should require image_embedding_params as parameter input"
+    assert (
+        "image_manifest_previous" in inputs
+    ), "Pipeline should read the previous image manifest"
+    assert (
+        "embedding_checkpoint" in inputs
+    ), "Pipeline should resume embedding from the checkpoint"
 
     # Test pipeline outputs
     outputs = pipeline.outputs()
     assert len(outputs) == PIPELINE_OUTPUTS, "Pipeline should have one output"
     assert (
-        "embeddings" in outputs
+        "embeddings@parquet" in outputs
     ), "Pipeline should produce embeddings as output"
 
 
@@ -138,3 +172,369 @@ def test_generate_clip_embeddings(sample_partitioned_images) -> None:
     assert list(result_df["image_id"]) == list(
         range(len(sample_partitioned_images))
     )
+
+
+class FakeClipModel:
+    """Stands in for CLIP, failing on any batch holding a blue image."""
+
+    dimension = 4
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.calls = []
+
+    def _encode_one(self, image):
+        if image.getpixel((0, 0)) == (0, 0, 255):
+            msg = "cannot encode blue images"
+            raise ValueError(msg)
+        return np.full(self.dimension, image.getpixel((0, 0))[0], np.float32)
+
+    def encode(self, images, batch_size=32):
+        if isinstance(images, list):
+            self.calls.append(len(images))
+            return np.stack([self._encode_one(image) for image in images])
+        self.calls.append(1)
+        return self._encode_one(images)
+
+
+def test_encode_images_isolates_failures() -> None:
+    model = FakeClipModel()
+    images = [
+        Image.new("RGB", (4, 4), color="red"),
+        Image.new("RGB", (4, 4), color="blue"),
+        Image.new("RGB", (4, 4), color="white"),
+    ]
+
+    embeddings = encode_images(model, images)
+
+    assert embeddings[1] is None
+    assert embeddings[0][0] == 255
+    assert embeddings[2][0] == 255
+    # One failed batch call followed by a retry per image
+    assert model.calls == [3, 1, 1, 1]
+
+
+def test_generate_clip_embeddings_batches(monkeypatch) -> None:
+    model = FakeClipModel()
+    monkeypatch.setattr(nodes, "SentenceTransformer", lambda *_: model)
+
+    def load(color):
+        return lambda: Image.new("RGB", (4, 4), color=color)
+
+    def corrupt():
+        msg = "corrupt file"
+        raise OSError(msg)
+
+    partitions = OrderedDict(
+        [
+            ("a", load("red")),
+            ("b", corrupt),
+            ("c", load("blue")),
+            ("d", load("red")),
+            ("e", load("red")),
+        ],
+    )
+    result_df = generate_clip_embeddings(
+        partitions,
+        {"sequence_id": 10, "batch_size": 2},
+    )
+
+    assert list(result_df["image_tag"]) == ["a", "d", "e"]
+    assert list(result_df["image_id"]) == [10, 11, 12]
+    # Batches: [a] after b fails to load, [c, d] retried per image, [e]
+    assert model.calls == [1, 2, 1, 1, 1]
+
+
+def test_generate_clip_embeddings_streams_chunks(
+    monkeypatch,
+    sample_partitioned_images,
+) -> None:
+    model = FakeClipModel()
+    monkeypatch.setattr(nodes, "SentenceTransformer", lambda *_: model)
+
+    result = generate_clip_embeddings(
+        sample_partitioned_images,
+        {
+            "sequence_id": 0,
+            "batch_size": 1,
+            "chunk_size": 1,
+            "stream_output": True,
+        },
+    )
+
+    # Nothing is encoded until the output dataset consumes the stream
+    assert not isinstance(result, pd.DataFrame)
+    assert model.calls == []
+
+    chunks = list(result)
+    assert [len(chunk) for chunk in chunks] == [1, 1]
+    assert [chunk["image_id"].iloc[0] for chunk in chunks] == [0, 1]
+
+
+def test_prefetch_batches_keeps_order_and_skips_failures() -> None:
+    def prepare(value):
+        if value == 3:
+            msg = "corrupt file"
+            raise OSError(msg)
+        return value * 10
+
+    items = [(str(i), i) for i in range(7)]
+    batches = list(prefetch_batches(items, prepare, batch_size=3))
+
+    assert batches == [
+        [("0", 0), ("1", 10), ("2", 20)],
+        [("4", 40), ("5", 50)],
+        [("6", 60)],
+    ]
+
+
+def test_prefetch_batches_bounds_work_ahead() -> None:
+    prepared = []
+    items = [(str(i), i) for i in range(20)]
+    batches = prefetch_batches(
+        items,
+        prepared.append,
+        batch_size=2,
+        num_workers=2,
+        max_prefetch=2,
+    )
+
+    next(batches)
+
+    # The batch handed out plus at most two batches prepared ahead
+    assert len(prepared) <= 6
+
+
+def _solid(color):
+    return lambda: Image.new("RGB", (4, 4), color=color)
+
+
+def test_plan_image_updates_full_run() -> None:
+    partitions = OrderedDict([("a", _solid("red")), ("b", _solid("blue"))])
+
+    manifest = plan_image_updates(
+        partitions,
+        {"sequence_id": 5, "incremental": False},
+        {"next_id": 100, "images": {}},
+    )
+
+    assert not manifest["incremental"]
+    assert manifest["next_id"] == 7
+    assert manifest["upserted_ids"] == [5, 6]
+    assert manifest["deleted_ids"] == []
+    assert manifest["images"]["b"]["image_id"] == 6
+
+
+def test_plan_image_updates_full_run_reads_no_image() -> None:
+    def unreadable():
+        msg = "Images are only read by incremental runs"
+        raise AssertionError(msg)
+
+    manifest = plan_image_updates(
+        OrderedDict([("a", unreadable), ("b", unreadable)]),
+        {"sequence_id": 0, "incremental": False},
+        None,
+    )
+
+    assert manifest["images"] == {
+        "a": {"hash": None, "image_id": 0},
+        "b": {"hash": None, "image_id": 1},
+    }
+
+    # The first incremental run has no hashes to compare and embeds again
+    switched = plan_image_updates(
+        OrderedDict([("a", _solid("red")), ("b", _solid("blue"))]),
+        {"sequence_id": 0, "incremental": True},
+        manifest,
+    )
+    assert switched["upserted_ids"] == [0, 1]
+    assert switched["images"]["a"]["hash"] is not None
+
+
+def test_plan_image_updates_incremental_run() -> None:
+    first = plan_image_updates(
+        OrderedDict(
+            [
+                ("a", _solid("red")),
+                ("b", _solid("blue")),
+                ("c", _solid("red")),
+            ],
+        ),
+        {"sequence_id": 0, "incremental": True},
+        None,
+    )
+    assert first["upserted_ids"] == [0, 1, 2]
+
+    # a unchanged, b changed, c deleted, d added
+    manifest = plan_image_updates(
+        OrderedDict(
+            [
+                ("a", _solid("red")),
+                ("b", _solid("green")),
+                ("d", _solid("red")),
+            ],
+        ),
+        {"sequence_id": 0, "incremental": True},
+        first,
+    )
+
+    assert manifest["incremental"]
+    assert manifest["upserted_ids"] == [1, 3]
+    assert manifest["deleted_ids"] == [2]
+    assert manifest["next_id"] == 4
+    assert {
+        path: entry["image_id"] for path, entry in manifest["images"].items()
+    } == {"a": 0, "b": 1, "d": 3}
+
+
+def test_generate_clip_embeddings_embeds_only_upserted(monkeypatch) -> None:
+    model = FakeClipModel()
+    monkeypatch.setattr(nodes, "SentenceTransformer", lambda *_: model)
+    partitions = OrderedDict([("a", _solid("red")), ("b", _solid("white"))])
+    manifest = {
+        "incremental": True,
+        "images": {
+            "a": {"hash": "x", "image_id": 7},
+            "b": {"hash": "y", "image_id": 3},
+        },
+        "upserted_ids": [3],
+        "deleted_ids": [],
+    }
+
+    result_df = generate_clip_embeddings(
+        partitions,
+        {"sequence_id": 0},
+        manifest,
+    )
+
+    assert list(result_df["image_tag"]) == ["b"]
+    assert list(result_df["image_id"]) == [3]
+
+
+def test_load_image_keeps_original_bytes() -> None:
+    original = image_to_bytes(Image.new("RGB", (64, 32), color="red"))
+
+    image, stored = load_image(lambda: original, decode_size=8)
+
+    assert stored is original
+    assert image.mode == "RGB"
+    # Decoded at a reduced JPEG scale that still covers the requested size
+    assert image.size == (16, 8)
+
+
+def test_load_image_reencodes_on_request() -> None:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (64, 32), color="red").save(buffer, format="png")
+
+    image, stored = load_image(
+        lambda: buffer.getvalue(),
+        reencode=True,
+        decode_size=8,
+    )
+
+    # Normalised to a full resolution JPEG
+    assert stored.startswith(b"\xff\xd8")
+    assert image.size == (64, 32)
+
+
+@pytest.fixture()
+def dask_client():
+    with Client(processes=False, n_workers=2, threads_per_worker=1) as client:
+        yield client
+
+
+def test_map_shards_keeps_shard_order(dask_client) -> None:
+    shards = split_shards(range(10), shard_size=3)
+    results = list(map_shards(dask_client, sum, shards))
+
+    assert results == [3, 12, 21, 9]
+
+
+def test_generate_clip_embeddings_distributed(monkeypatch, dask_client) -> None:
+    built = []
+    monkeypatch.setattr(
+        nodes,
+        "SentenceTransformer",
+        lambda *_: built.append(FakeClipModel()) or built[-1],
+    )
+    nodes._worker_clip_model.cache_clear()
+    partitions = OrderedDict(
+        (str(i), _solid("red" if i != 3 else "blue")) for i in range(7)
+    )
+
+    result_df = generate_clip_embeddings(
+        partitions,
+        {
+            "sequence_id": 0,
+            "batch_size": 2,
+            "distributed": True,
+            "shard_size": 3,
+        },
+    )
+
+    assert list(result_df["image_tag"]) == ["0", "1", "2", "4", "5", "6"]
+    assert list(result_df["image_id"]) == list(range(6))
+    # In-process workers share one cached model across all three shards
+    assert len(built) == 1
+    nodes._worker_clip_model.cache_clear()
+
+
+def test_generate_clip_embeddings_reads_partition_chunks(monkeypatch) -> None:
+    model = FakeClipModel()
+    monkeypatch.setattr(nodes, "SentenceTransformer", lambda *_: model)
+    chunks = iter(
+        [
+            OrderedDict([("a", _solid("red")), ("b", _solid("white"))]),
+            OrderedDict([("c", _solid("red"))]),
+        ],
+    )
+
+    result_df = generate_clip_embeddings(chunks, {"sequence_id": 0})
+
+    assert list(result_df["image_tag"]) == ["a", "b", "c"]
+    assert list(result_df["image_id"]) == [0, 1, 2]
+
+
+def test_generate_clip_embeddings_resumes_from_checkpoint(
+    monkeypatch,
+    tmp_path,
+) -> None:
+    model = FakeClipModel()
+    monkeypatch.setattr(nodes, "SentenceTransformer", lambda *_: model)
+    partitions = OrderedDict((str(i), _solid("red")) for i in range(5))
+    params = {
+        "sequence_id": 0,
+        "batch_size": 1,
+        "shard_size": 2,
+        "stream_output": True,
+    }
+    checkpoint = ShardCheckpoint(tmp_path / "checkpoint")
+
+    # The run stops after its first shard has been written out
+    stream = generate_clip_embeddings(partitions, params, None, checkpoint)
+    stream = iter(stream)
+    next(stream)
+    stream.close()
+    assert model.calls == [1, 1]
+
+    model.calls.clear()
+    chunks = generate_clip_embeddings(partitions, params, None, checkpoint)
+    chunks = list(chunks)
+
+    # Only the two shards that were not committed are embedded again
+    assert model.calls == [1, 1, 1]
+    result_df = pd.concat(chunks, ignore_index=True)
+    assert list(result_df["image_tag"]) == ["0", "1", "2", "3", "4"]
+    assert list(result_df["image_id"]) == list(range(5))
+
+
+def test_checkpoint_key_changes_when_a_file_is_replaced(tmp_path) -> None:
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"first")
+    shards = [[("a", RawBytesDataset(filepath=str(path)).load)]]
+    key = nodes._checkpoint_key(shards, {}, None)
+    assert nodes._checkpoint_key(shards, {}, None) == key
+
+    # The partition keeps its name, but not its content
+    path.write_bytes(b"replaced")
+
+    assert nodes._checkpoint_key(shards, {}, None) != key
@@ -1,10 +1,26 @@
+import logging
+
 import faiss
 import numpy as np
 import pandas as pd
 import pytest
 from kedro.pipeline import Pipeline
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrix,
+    EmbeddingMatrixDataset,
+)
+from multi_modal_retrieval_pipeline.io.faiss_dataset import IndexBatches
+from multi_modal_retrieval_pipeline.io.shard_checkpoint_dataset import (
+    ShardCheckpoint,
+)
+from multi_modal_retrieval_pipeline.pipelines.data_science import (
+    deduplication,
+)
 from multi_modal_retrieval_pipeline.pipelines.data_science.nodes import (
+    build_rerank_matrix,
+    clear_embedding_checkpoint,
     create_faiss_index,
+    find_near_duplicates,
 )
 from multi_modal_retrieval_pipeline.pipelines.data_science.pipeline import (
     create_pipeline,
@@ -24,13 +40,23 @@ def test_pipeline_structure() -> None:
     pipeline = create_pipeline()
 
     # Test number of nodes
-    assert len(pipeline.nodes) == 1, "Pipeline should have exactly one node"
+    assert len(pipeline.nodes) == 4, "Pipeline should have four nodes"
 
     # Test node properties
-    node = pipeline.nodes[0]
+    node = next(n for n in pipeline.nodes if n.name == "create_faiss_index")
     assert node.name == "create_faiss_index", "Node should have correct name"
-    assert node.inputs == (["embeddings"]), "Node should have correct input"
-    assert node.outputs == (["vector_store"]), "Node should have correct output"
+    assert node.inputs == (
+        [
+            "embeddings@matrix",
+            "image_manifest",
+            "vector_store_previous",
+            "params:faiss_index_params",
+            "near_duplicate_groups",
+        ]
+    ), "Node should have correct input"
+    assert node.outputs == ["vector_store", "indexed_image_manifest"], (
+        "Node should have correct output"
+    )
 
 
 def test_pipeline_inputs_outputs() -> None:
@@ -39,15 +65,51 @@ def test_pipeline_inputs_outputs() -> None:
 
     # Test pipeline inputs
     inputs = pipeline.inputs()
-    assert len(inputs) == 1, "Pipeline should have one input"
-    assert "embeddings" in inputs, "Pipeline should require embeddings as input"
+    assert len(inputs) == 7, "Pipeline should have seven inputs"
+    assert "embeddings@matrix" in inputs, (
+        "Pipeline should require the embedding matrix as input"
+    )
+    assert "vector_store_previous" in inputs, (
+        "Pipeline should read the previous index for incremental updates"
+    )
+    assert "params:faiss_index_params" in inputs, (
+        "Pipeline should require faiss_index_params as parameter input"
+    )
+    assert "embedding_checkpoint" in inputs, (
+        "Pipeline should clear the embedding checkpoint after indexing"
+    )
 
     # Test pipeline outputs
     outputs = pipeline.outputs()
-    assert len(outputs) == 1, "Pipeline should have one output"
-    assert (
-        "vector_store" in outputs
-    ), "Pipeline should produce vector_store as output"
+    assert len(outputs) == 2, "Pipeline should have two outputs"
+    assert "vector_store" in outputs, (
+        "Pipeline should produce vector_store as output"
+    )
+    assert "indexed_image_manifest" in pipeline.all_outputs(), (
+        "Pipeline should record the manifest of the saved index"
+    )
+    assert "rerank_matrix" in outputs, (
+        "Pipeline should keep full precision vectors for re-ranking"
+    )
+
+
+def test_checkpoint_is_cleared_after_the_index_is_saved(tmp_path) -> None:
+    pipeline = create_pipeline()
+    (clear,) = [
+        n for n in pipeline.nodes if n.name == "clear_embedding_checkpoint"
+    ]
+    # Kedro orders nodes by data, the saved manifest comes last
+    assert "indexed_image_manifest" in clear.inputs
+    assert pipeline.nodes[-1] == clear
+
+    checkpoint = ShardCheckpoint(tmp_path / "ckpt")
+    checkpoint.resume("run-1")
+    checkpoint.commit_shard(0, pd.DataFrame({"image_tag": ["a"]}))
+
+    clear_embedding_checkpoint(checkpoint, {"images": {"a": {}}})
+
+    assert not (tmp_path / "ckpt").exists()
+    assert ShardCheckpoint(tmp_path / "ckpt").resume("run-1") == set()
 
 
 @pytest.mark.cov()
@@ -55,9 +117,9 @@ def test_pipeline_empty_kwargs() -> None:
     """Test pipeline creation with empty kwargs."""
     pipeline = create_pipeline()
     pipeline_with_kwargs = create_pipeline(random_kwargs="test")
-    assert (
-        pipeline.nodes == pipeline_with_kwargs.nodes
-    ), "Pipeline should be the same regardless of kwargs"
+    assert pipeline.nodes == pipeline_with_kwargs.nodes, (
+        "Pipeline should be the same regardless of kwargs"
+    )
 
 
 @pytest.fixture()
@@ -70,12 +132,16 @@ def sample_embeddings_df():
         for _ in range(n_samples)
     ]
 
-    return pd.DataFrame({"embedding": embeddings, "image_id": range(n_samples)})
+    return EmbeddingMatrix(
+        ids=np.arange(n_samples, dtype=np.int64),
+        vectors=np.stack(embeddings),
+    )
 
 
 def test_create_faiss_index(sample_embeddings_df) -> None:
     # Test index creation
-    index = create_faiss_index(sample_embeddings_df)
+    result, _ = create_faiss_index(sample_embeddings_df)
+    index = result.add_all()
 
     # Check if the index is of correct type
     assert isinstance(index, faiss.IndexIDMap)
@@ -87,7 +153,7 @@ def test_create_faiss_index(sample_embeddings_df) -> None:
     # Create a random query vector
     query = np.random.rand(
         1,
-        sample_embeddings_df["embedding"].iloc[0].shape[0],
+        sample_embeddings_df.vectors.shape[1],
     ).astype(np.float32)
     distance, indices = index.search(query, k=1)
 
@@ -98,7 +164,498 @@ def test_create_faiss_index(sample_embeddings_df) -> None:
 
 def test_create_faiss_index_empty_df() -> None:
     # Test with empty DataFrame
-    empty_df = pd.DataFrame(columns=["embedding"])
+    empty_df = EmbeddingMatrix(
+        ids=np.empty(0, np.int64),
+        vectors=np.empty((0, 0), np.float32),
+    )
 
     with pytest.raises(Exception):
         create_faiss_index(empty_df)
+
+
+def test_create_faiss_index_uses_image_ids(sample_embeddings_df) -> None:
+    data = EmbeddingMatrix(
+        ids=np.array([10, 20, 30, 40, 50], np.int64),
+        vectors=sample_embeddings_df.vectors,
+    )
+    result, _ = create_faiss_index(data)
+    index = result.add_all()
+
+    query = data.vectors[2:3]
+    _, indices = index.search(query / np.linalg.norm(query), k=5)
+    assert set(indices[0]) == {10, 20, 30, 40, 50}
+
+
+def test_create_faiss_index_incremental_update(sample_embeddings_df) -> None:
+    index = create_faiss_index(sample_embeddings_df)[0].add_all()
+    delta = EmbeddingMatrix(
+        ids=np.array([1, 5], np.int64),
+        vectors=np.ones((2, 10), np.float32),
+    )
+    manifest = {
+        "incremental": True,
+        "images": {"a.jpg": {"hash": "x", "image_id": 1}},
+        "upserted_ids": [1, 5],
+        "deleted_ids": [3],
+    }
+
+    result, indexed_manifest = create_faiss_index(delta, manifest, index)
+    updated = result.add_all()
+
+    # 5 vectors, 3 deleted, 1 replaced and 5 added
+    assert updated.ntotal == 5
+    _, indices = updated.search(np.ones((1, 10), np.float32), k=5)
+    assert set(indices[0]) == {0, 1, 2, 4, 5}
+    assert indexed_manifest == manifest
+    assert len(result.metadata["source_data_version"]) == 64
+
+
+def test_create_faiss_index_forgets_images_that_were_not_embedded(
+    sample_embeddings_df,
+) -> None:
+    manifest = {
+        "incremental": False,
+        "images": {
+            f"{image_id}.jpg": {"hash": None, "image_id": image_id}
+            for image_id in range(7)
+        },
+        "upserted_ids": list(range(7)),
+        "deleted_ids": [],
+    }
+
+    result, indexed_manifest = create_faiss_index(
+        sample_embeddings_df,
+        manifest,
+    )
+    version = result.metadata["source_data_version"]
+    result.add_all()
+
+    # Images 5 and 6 failed to embed, the next run sees them as new
+    assert sorted(indexed_manifest["images"]) == [
+        f"{image_id}.jpg" for image_id in range(5)
+    ]
+    assert indexed_manifest["upserted_ids"] == list(range(5))
+    assert len(manifest["images"]) == 7
+    assert result.metadata["source_data_version"] != version
+
+
+def test_create_faiss_index_incremental_needs_previous_index(
+    sample_embeddings_df,
+) -> None:
+    manifest = {"incremental": True, "upserted_ids": [], "deleted_ids": []}
+
+    with pytest.raises(ValueError, match="previous FAISS index"):
+        create_faiss_index(sample_embeddings_df, manifest, None)
+
+
+def test_create_faiss_index_from_chunks(sample_embeddings_df) -> None:
+    chunks = (
+        EmbeddingMatrix(
+            ids=sample_embeddings_df.ids[start : start + 2],
+            vectors=sample_embeddings_df.vectors[start : start + 2],
+        )
+        for start in range(0, 5, 2)
+    )
+
+    result, _ = create_faiss_index(chunks)
+
+    # Chunks are added batch by batch when the dataset saves the index
+    assert isinstance(result, IndexBatches)
+    assert result.index.ntotal == 0
+    assert result.add_all().ntotal == 5
+
+
+def test_create_faiss_index_reconstructs_by_id(sample_embeddings_df) -> None:
+    ids = sample_embeddings_df.ids + 100
+    result, _ = create_faiss_index(
+        EmbeddingMatrix(ids=ids, vectors=sample_embeddings_df.vectors),
+    )
+    index = result.add_all()
+
+    np.testing.assert_array_equal(
+        index.reconstruct(102),
+        sample_embeddings_df.vectors[2],
+    )
+
+
+def test_create_faiss_index_adds_in_batches(
+    monkeypatch,
+    sample_embeddings_df,
+) -> None:
+    added = []
+    add_with_ids = faiss.IndexIDMap2.add_with_ids
+
+    def record_add(self, x, ids):
+        added.append(len(ids))
+        return add_with_ids(self, x, ids)
+
+    monkeypatch.setattr(faiss.IndexIDMap2, "add_with_ids", record_add)
+    threads = faiss.omp_get_max_threads()
+
+    result, _ = create_faiss_index(
+        sample_embeddings_df,
+        params={"batch_size": 2, "omp_threads": 1},
+    )
+    index = result.add_all()
+
+    assert added == [2, 2, 1]
+    assert index.ntotal == 5
+    # The thread setting only applies while adding
+    assert faiss.omp_get_max_threads() == threads
+
+
+def test_create_faiss_index_normalizes_vectors(sample_embeddings_df) -> None:
+    result, _ = create_faiss_index(
+        sample_embeddings_df,
+        params={"normalize": True},
+    )
+    index = result.add_all()
+
+    query = sample_embeddings_df.vectors[:1] / np.linalg.norm(
+        sample_embeddings_df.vectors[:1],
+    )
+    scores, indices = index.search(query, k=1)
+    # A vector is its own nearest neighbour with a cosine similarity of 1
+    assert indices[0][0] == 0
+    assert scores[0][0] == pytest.approx(1.0, abs=1e-5)
+    assert result.metadata["normalized"] is True
+    # The memory-mapped source vectors are left untouched
+    assert np.linalg.norm(sample_embeddings_df.vectors[0]) != pytest.approx(1)
+
+
+@pytest.mark.parametrize(
+    ("quantization", "code_size"),
+    [("fp16", 20), ("int8", 10)],
+)
+def test_create_faiss_index_scalar_quantization(
+    sample_embeddings_df,
+    quantization,
+    code_size,
+) -> None:
+    result, _ = create_faiss_index(
+        sample_embeddings_df,
+        params={"normalize": True, "quantization": quantization},
+    )
+    index = result.add_all()
+
+    quantized = faiss.downcast_index(index.index)
+    assert isinstance(quantized, faiss.IndexScalarQuantizer)
+    # 2 bytes and 1 byte per component instead of 4
+    assert quantized.code_size == code_size
+    assert index.ntotal == 5
+    _, indices = index.search(
+        np.ascontiguousarray(sample_embeddings_df.vectors[2:3]),
+        k=1,
+    )
+    assert indices[0][0] == 2
+
+
+def test_create_faiss_index_unknown_quantization(sample_embeddings_df) -> None:
+    with pytest.raises(ValueError, match="Unknown quantization"):
+        create_faiss_index(
+            sample_embeddings_df,
+            params={"quantization": "int4"},
+        )
+
+
+@pytest.mark.parametrize(
+    ("quantization", "ivf_type"),
+    [
+        (None, faiss.IndexIVFFlat),
+        ("int8", faiss.IndexIVFScalarQuantizer),
+        ("pq", faiss.IndexIVFPQ),
+    ],
+)
+def test_create_faiss_index_ivf(quantization, ivf_type) -> None:
+    vectors = np.random.default_rng(0).random((300, 16), dtype=np.float32)
+    data = EmbeddingMatrix(ids=np.arange(100, 400), vectors=vectors)
+    params = {
+        "normalize": True,
+        "quantization": quantization,
+        "pq_subquantizers": 4,
+        "ivf_nlist": 4,
+        "ivf_nprobe": 4,
+    }
+
+    result, _ = create_faiss_index(data, params=params)
+    index = result.add_all()
+
+    # The inverted lists hold the image ids, without an IndexIDMap2
+    assert isinstance(faiss.downcast_index(index), ivf_type)
+    assert index.nprobe == 4
+    query = vectors[7:8] / np.linalg.norm(vectors[7])
+    _, indices = index.search(query, k=1)
+    assert indices[0][0] == 107
+    # Vectors are found by id to reconstruct and remove them
+    assert index.reconstruct(107).shape == (16,)
+    assert index.remove_ids(np.array([107, 108])) == 2
+    assert index.ntotal == 298
+
+
+def test_create_faiss_index_pq_subquantizers_divide_dimension(
+    sample_embeddings_df,
+) -> None:
+    with pytest.raises(ValueError, match="do not divide the dimension 10"):
+        create_faiss_index(
+            sample_embeddings_df,
+            params={"quantization": "pq", "pq_subquantizers": 4},
+        )
+
+
+@pytest.mark.parametrize(
+    ("method", "n_samples"),
+    # OPQ trains a product quantizer with 256 centroids per sub-vector
+    [("pca", 5), ("opq", 256)],
+)
+def test_create_faiss_index_dimension_reduction(method, n_samples) -> None:
+    vectors = np.random.default_rng(0).random((n_samples, 10), np.float32)
+    embeddings = EmbeddingMatrix(ids=np.arange(n_samples), vectors=vectors)
+    result, _ = create_faiss_index(
+        embeddings,
+        params={
+            "normalize": True,
+            "dimension_reduction": method,
+            "reduced_dimension": 4,
+            "opq_subquantizers": 2,
+        },
+    )
+    index = result.add_all()
+
+    transformed = faiss.downcast_index(index.index)
+    assert isinstance(transformed, faiss.IndexPreTransform)
+    # Queries keep the embedding dimension, the index stores 4
+    assert index.d == 10
+    assert transformed.index.d == 4
+    assert index.ntotal == n_samples
+    query = vectors[3:4] / np.linalg.norm(vectors[3:4])
+    scores, indices = index.search(query, k=1)
+    assert indices[0][0] == 3
+    # Projected vectors are normalized again
+    assert scores[0][0] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_create_faiss_index_reduced_dimension_too_large(
+    sample_embeddings_df,
+) -> None:
+    with pytest.raises(ValueError, match="Reduced dimension 10"):
+        create_faiss_index(
+            sample_embeddings_df,
+            params={"dimension_reduction": "pca", "reduced_dimension": 10},
+        )
+
+
+def test_create_faiss_index_dimension_reduction_needs_enough_vectors(
+    sample_embeddings_df,
+) -> None:
+    with pytest.raises(ValueError, match="at least as many vectors"):
+        create_faiss_index(
+            sample_embeddings_df,
+            params={"dimension_reduction": "pca", "reduced_dimension": 8},
+        )
+
+
+def test_create_faiss_index_unknown_dimension_reduction(
+    sample_embeddings_df,
+) -> None:
+    with pytest.raises(ValueError, match="Unknown dimension reduction"):
+        create_faiss_index(
+            sample_embeddings_df,
+            params={"dimension_reduction": "svd", "reduced_dimension": 4},
+        )
+
+
+def test_build_rerank_matrix(tmp_path, sample_embeddings_df) -> None:
+    dataset = EmbeddingMatrixDataset(filepath=str(tmp_path / "rerank"))
+
+    dataset.save(
+        build_rerank_matrix(
+            sample_embeddings_df,
+            params={"normalize": True, "batch_size": 2},
+        ),
+    )
+
+    matrix = dataset.load()
+    assert list(matrix.ids) == [0, 1, 2, 3, 4]
+    assert matrix.vectors.dtype == np.float32
+    np.testing.assert_allclose(
+        np.linalg.norm(matrix.vectors, axis=1),
+        1,
+        rtol=1e-6,
+    )
+
+
+def test_build_rerank_matrix_incremental_update(
+    tmp_path,
+    sample_embeddings_df,
+) -> None:
+    dataset = EmbeddingMatrixDataset(filepath=str(tmp_path / "rerank"))
+    dataset.save(build_rerank_matrix(sample_embeddings_df))
+    delta = EmbeddingMatrix(
+        ids=np.array([1, 5], np.int64),
+        vectors=np.ones((2, 10), np.float32),
+    )
+    manifest = {"incremental": True, "upserted_ids": [1, 5], "deleted_ids": [3]}
+
+    # The previous matrix is memory-mapped from the file being replaced
+    dataset.save(build_rerank_matrix(delta, manifest, dataset.load()))
+
+    matrix = dataset.load()
+    assert list(matrix.ids) == [0, 2, 4, 1, 5]
+    np.testing.assert_array_equal(matrix.vectors[3:], delta.vectors)
+    np.testing.assert_array_equal(
+        matrix.vectors[:3],
+        sample_embeddings_df.vectors[[0, 2, 4]],
+    )
+
+
+def test_build_rerank_matrix_incremental_needs_previous_matrix(
+    sample_embeddings_df,
+) -> None:
+    manifest = {"incremental": True, "upserted_ids": [], "deleted_ids": []}
+
+    with pytest.raises(ValueError, match="previous re-ranking matrix"):
+        build_rerank_matrix(sample_embeddings_df, manifest, None)
+
+
+@pytest.fixture()
+def near_duplicate_embeddings():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((40, 32)).astype(np.float32)
+    # Images 40 and 41 are copies of image 3, 42 of image 7, 43 of 42
+    copies = vectors[[3, 3, 7, 7]] + rng.normal(0, 0.01, (4, 32))
+    return EmbeddingMatrix(
+        ids=np.arange(44, dtype=np.int64),
+        vectors=np.concatenate([vectors, copies.astype(np.float32)]),
+    )
+
+
+def test_group_pairs() -> None:
+    pairs = [(9, 2), (5, 2), (7, 8), (2, 5)]
+
+    # The smallest id of a group represents it
+    assert deduplication.group_pairs(pairs) == {2: [5, 9], 7: [8]}
+
+
+@pytest.mark.parametrize("nlist", [None, 1])
+def test_find_near_duplicates(near_duplicate_embeddings, nlist) -> None:
+    groups = find_near_duplicates(
+        near_duplicate_embeddings,
+        params={
+            "batch_size": 16,
+            "deduplication": {"threshold": 0.97, "nlist": nlist, "nprobe": 1},
+        },
+    )
+
+    assert groups == {
+        "threshold": 0.97,
+        "groups": [
+            {"representative": 3, "duplicates": [40, 41]},
+            {"representative": 7, "duplicates": [42, 43]},
+        ],
+        "duplicate_ids": [40, 41, 42, 43],
+    }
+
+
+def test_find_near_duplicates_disabled(near_duplicate_embeddings) -> None:
+    groups = find_near_duplicates(near_duplicate_embeddings)
+
+    assert groups["groups"] == []
+    assert groups["duplicate_ids"] == []
+
+
+def test_near_duplicates_are_not_indexed(
+    near_duplicate_embeddings,
+    caplog,
+) -> None:
+    caplog.set_level(logging.INFO)
+    params = {"normalize": True, "deduplication": {"threshold": 0.97}}
+    groups = find_near_duplicates(near_duplicate_embeddings, params=params)
+
+    result, _ = create_faiss_index(
+        near_duplicate_embeddings,
+        params=params,
+        near_duplicates=groups,
+    )
+    index = result.add_all()
+    matrix = next(
+        iter(
+            build_rerank_matrix(
+                near_duplicate_embeddings,
+                params=params,
+                near_duplicates=groups,
+            ),
+        ),
+    )
+
+    assert index.ntotal == 40
+    assert list(matrix.ids) == list(range(40))
+    assert "4 near-duplicates out of the index (ids 40, 41, 42, 43)" in (
+        caplog.text
+    )
+    # A copy finds the image representing it
+    query = near_duplicate_embeddings.vectors[40:41]
+    _, indices = index.search(query / np.linalg.norm(query), k=1)
+    assert indices[0][0] == 3
+
+
+# Every list is searched, so the IVF index finds what the flat one does
+@pytest.mark.parametrize(
+    "index_params", [{}, {"ivf_nlist": 2, "ivf_nprobe": 2}]
+)
+def test_find_near_duplicates_incremental_update(
+    near_duplicate_embeddings,
+    index_params,
+) -> None:
+    params = {
+        "normalize": True,
+        **index_params,
+        "deduplication": {"threshold": 0.97},
+    }
+    base = EmbeddingMatrix(
+        ids=near_duplicate_embeddings.ids[:42],
+        vectors=near_duplicate_embeddings.vectors[:42],
+    )
+    previous_groups = find_near_duplicates(base, params=params)
+    result, _ = create_faiss_index(
+        base,
+        params=params,
+        near_duplicates=previous_groups,
+    )
+    previous_index = result.add_all()
+    # Image 7 changed, 42 and 43 are new copies of the old image 7 and of 5
+    vectors = near_duplicate_embeddings.vectors
+    delta = EmbeddingMatrix(
+        ids=np.array([7, 42, 43], np.int64),
+        vectors=np.stack([vectors[8], vectors[42], vectors[5] * 2]),
+    )
+    manifest = {"incremental": True, "upserted_ids": [7, 42, 43]}
+    manifest["deleted_ids"] = [41]
+
+    groups = find_near_duplicates(
+        delta,
+        manifest,
+        previous_groups,
+        previous_index,
+        params,
+    )
+
+    # 42 does not match the stale vector of image 7, but the new one does
+    # match image 8, which is indexed
+    assert groups["groups"] == [
+        {"representative": 3, "duplicates": [40]},
+        {"representative": 5, "duplicates": [43]},
+        {"representative": 8, "duplicates": [7]},
+    ]
+
+
+def test_find_near_duplicates_incremental_needs_previous_groups(
+    near_duplicate_embeddings,
+) -> None:
+    manifest = {"incremental": True, "upserted_ids": [], "deleted_ids": []}
+
+    with pytest.raises(ValueError, match="previous near-duplicate groups"):
+        find_near_duplicates(
+            near_duplicate_embeddings,
+            manifest,
+            params={"deduplication": {"threshold": 0.97}},
+        )
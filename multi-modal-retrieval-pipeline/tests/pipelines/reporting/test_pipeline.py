@@ -0,0 +1,190 @@
+import numpy as np
+import pytest
+from kedro.pipeline import Pipeline
+from multi_modal_retrieval_pipeline.io.embedding_matrix_dataset import (
+    EmbeddingMatrix,
+)
+from multi_modal_retrieval_pipeline.pipelines.reporting import nodes
+from multi_modal_retrieval_pipeline.pipelines.reporting.nodes import (
+    compute_ground_truth,
+    evaluate_index_configurations,
+    recall_at_k,
+    select_evaluation_queries,
+)
+from multi_modal_retrieval_pipeline.pipelines.reporting.pipeline import (
+    create_pipeline,
+)
+
+
+@pytest.fixture()
+def embeddings() -> EmbeddingMatrix:
+    rng = np.random.default_rng(0)
+    return EmbeddingMatrix(
+        ids=np.arange(100, 400, dtype=np.int64),
+        vectors=rng.standard_normal((300, 16)).astype(np.float32),
+    )
+
+
+@pytest.fixture()
+def params() -> dict:
+    return {
+        "k": 5,
+        "num_queries": 20,
+        "seed": 1,
+        "batch_size": 64,
+        "configurations": [
+            {"name": "flat", "factory": "Flat"},
+            {
+                "name": "ivf",
+                "factory": "IVF4,Flat",
+                "search_params": [{"nprobe": 1}, {"nprobe": 4}],
+            },
+        ],
+    }
+
+
+@pytest.mark.cov()
+def test_pipeline_structure() -> None:
+    """Test basic pipeline structure."""
+    pipeline = create_pipeline()
+
+    assert isinstance(pipeline, Pipeline), "Should create a Pipeline object"
+    assert pipeline.inputs() == {
+        "rerank_matrix",
+        "params:index_evaluation_params",
+    }
+    assert pipeline.outputs() == {"index_evaluation_report"}
+
+
+def test_select_evaluation_queries_holds_out_samples(
+    embeddings,
+    params,
+) -> None:
+    queries = select_evaluation_queries(embeddings, params)
+
+    assert len(queries) == 20
+    assert len(set(queries.ids)) == 20
+    rows = queries.ids - 100
+    np.testing.assert_array_equal(queries.vectors, embeddings.vectors[rows])
+
+
+def test_select_evaluation_queries_encodes_prompts(
+    monkeypatch,
+    embeddings,
+    params,
+) -> None:
+    class FakeClip:
+        def __init__(self, name: str) -> None:
+            pass
+
+        def encode(self, prompts: list[str]) -> np.ndarray:
+            return np.ones((len(prompts), 16))
+
+    monkeypatch.setattr(nodes, "SentenceTransformer", FakeClip)
+
+    queries = select_evaluation_queries(
+        embeddings,
+        {**params, "query_prompts": ["a dog", "a beach"]},
+    )
+
+    assert queries.vectors.shape == (2, 16)
+    assert queries.vectors.dtype == np.float32
+    assert list(queries.ids) == [-1, -1]
+
+
+def test_select_evaluation_queries_needs_enough_embeddings(
+    embeddings,
+    params,
+) -> None:
+    with pytest.raises(ValueError, match="Holding out"):
+        select_evaluation_queries(embeddings, {**params, "num_queries": 300})
+
+
+def test_compute_ground_truth_matches_exact_search(embeddings, params) -> None:
+    queries = select_evaluation_queries(embeddings, params)
+
+    ground_truth = compute_ground_truth(embeddings, queries, params)
+
+    held_out = np.isin(embeddings.ids, queries.ids)
+    scores = queries.vectors @ embeddings.vectors[~held_out].T
+    expected = embeddings.ids[~held_out][np.argsort(-scores, axis=1)[:, :5]]
+    np.testing.assert_array_equal(ground_truth, expected)
+
+
+def test_nodes_read_chunked_embeddings(embeddings, params) -> None:
+    def chunks():
+        # DaskRunner passes a fresh generator of chunks to every node
+        for start in range(0, 300, 70):
+            yield EmbeddingMatrix(
+                ids=embeddings.ids[start : start + 70],
+                vectors=embeddings.vectors[start : start + 70],
+            )
+
+    queries = select_evaluation_queries(chunks(), params)
+    ground_truth = compute_ground_truth(chunks(), queries, params)
+    report = evaluate_index_configurations(
+        chunks(),
+        queries,
+        ground_truth,
+        {**params, "configurations": [{"factory": "Flat"}]},
+    )
+
+    expected = select_evaluation_queries(embeddings, params)
+    np.testing.assert_array_equal(queries.ids, expected.ids)
+    np.testing.assert_array_equal(
+        ground_truth,
+        compute_ground_truth(embeddings, expected, params),
+    )
+    assert report["num_vectors"] == 280
+    assert report["results"][0]["recall_at_k"] == 1.0
+
+
+def test_recall_at_k() -> None:
+    retrieved = np.array([[1, 2, 3], [4, 5, -1]])
+    ground_truth = np.array([[1, 2, 3], [4, 6, 7]])
+
+    assert recall_at_k(retrieved, ground_truth) == pytest.approx(4 / 6)
+
+
+def test_evaluate_index_configurations(embeddings, params) -> None:
+    queries = select_evaluation_queries(embeddings, params)
+    ground_truth = compute_ground_truth(embeddings, queries, params)
+
+    report = evaluate_index_configurations(
+        embeddings,
+        queries,
+        ground_truth,
+        params,
+    )
+
+    assert report["num_queries"] == 20
+    assert report["num_vectors"] == 280
+    results = {
+        (result["name"], result["search_params"].get("nprobe")): result
+        for result in report["results"]
+    }
+    assert set(results) == {("flat", None), ("ivf", 1), ("ivf", 4)}
+    # Exhaustive searches find the exact neighbours
+    assert results["flat", None]["recall_at_k"] == 1.0
+    assert results["ivf", 4]["recall_at_k"] == 1.0
+    assert results["ivf", 1]["recall_at_k"] <= 1.0
+    assert results["ivf", 1]["latency_ms"]["p95"] > 0
+
+
+def test_evaluate_index_configurations_reports_build_errors(
+    embeddings,
+    params,
+) -> None:
+    queries = select_evaluation_queries(embeddings, params)
+    ground_truth = compute_ground_truth(embeddings, queries, params)
+
+    report = evaluate_index_configurations(
+        embeddings,
+        queries,
+        ground_truth,
+        {**params, "configurations": [{"factory": "IVF4096,Flat"}]},
+    )
+
+    [result] = report["results"]
+    assert result["name"] == "IVF4096,Flat"
+    assert "error" in result
@@ -0,0 +1,248 @@
+import io
+
+import pandas as pd
+import pytest
+from kedro.pipeline import Pipeline
+from multi_modal_retrieval_pipeline.pipelines.search_metadata import nodes
+from multi_modal_retrieval_pipeline.pipelines.search_metadata.nodes import (
+    build_lexical_index,
+    build_tag_index,
+    generate_image_captions,
+    list_image_tags,
+    tokenize,
+)
+from multi_modal_retrieval_pipeline.pipelines.search_metadata.pipeline import (
+    create_pipeline,
+)
+from PIL import Image
+
+
+def image_to_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color="red").save(buffer, format="jpeg")
+    return buffer.getvalue()
+
+
+@pytest.mark.cov()
+def test_pipeline_creation() -> None:
+    """Test basic pipeline creation."""
+    pipeline = create_pipeline()
+    assert isinstance(pipeline, Pipeline), "Should create a Pipeline object"
+
+
+@pytest.mark.cov()
+def test_pipeline_structure() -> None:
+    """Test basic pipeline structure."""
+    pipeline = create_pipeline()
+    nodes = {node.name: node for node in pipeline.nodes}
+
+    assert set(nodes) == {
+        "list_image_tags",
+        "build_tag_index",
+        "generate_image_captions",
+        "build_lexical_index",
+    }, "Pipeline should have the tag, caption and lexical index nodes"
+    assert nodes["list_image_tags"].inputs == [
+        "image_manifest",
+        "near_duplicate_groups",
+    ]
+    assert nodes["build_tag_index"].inputs == ["image_tags"]
+    assert nodes["build_tag_index"].outputs == ["tag_index"]
+    assert nodes["build_lexical_index"].inputs == [
+        "image_tags",
+        "image_captions",
+        "params:lexical_index_params",
+    ]
+    assert nodes["build_lexical_index"].outputs == ["lexical_index"]
+
+
+@pytest.fixture()
+def sample_tagged_df():
+    return pd.DataFrame(
+        {
+            "image_id": [3, 1, 2, 0],
+            "image_tag": ["cats/a", "dogs/b", "cats/a", "cats/c"],
+        },
+    )
+
+
+def test_build_tag_index(sample_tagged_df) -> None:
+    tag_index = build_tag_index(sample_tagged_df)
+
+    assert tag_index == {
+        "cats/a": [2, 3],
+        "cats/c": [0],
+        "dogs/b": [1],
+    }
+    # Keys must be JSON serialisable strings with plain int ids
+    assert all(isinstance(i, int) for ids in tag_index.values() for i in ids)
+
+
+def test_build_tag_index_empty_df() -> None:
+    empty_df = pd.DataFrame(columns=["image_id", "image_tag"])
+
+    assert build_tag_index(empty_df) == {}
+
+
+def test_list_image_tags() -> None:
+    manifest = {
+        "images": {
+            "cats/a": {"hash": "x", "image_id": 3},
+            "dogs/b": {"hash": "y", "image_id": 1},
+        },
+    }
+
+    tags = list_image_tags(manifest)
+
+    assert build_tag_index(tags) == {"cats/a": [3], "dogs/b": [1]}
+
+
+def test_list_image_tags_without_near_duplicates() -> None:
+    manifest = {
+        "images": {
+            "cats/a": {"hash": "x", "image_id": 3},
+            "cats/a_copy": {"hash": "z", "image_id": 4},
+            "dogs/b": {"hash": "y", "image_id": 1},
+        },
+    }
+
+    tags = list_image_tags(manifest, {"duplicate_ids": [4]})
+
+    assert build_tag_index(tags) == {"cats/a": [3], "dogs/b": [1]}
+
+
+def test_tokenize() -> None:
+    assert tokenize("Beach/Sunset_01 at dusk") == [
+        "beach",
+        "sunset",
+        "01",
+        "at",
+        "dusk",
+    ]
+
+
+def test_generate_image_captions_disabled(sample_tagged_df) -> None:
+    captions = generate_image_captions(
+        sample_tagged_df,
+        {"caption_images": False},
+    )
+
+    assert list(captions.columns) == ["image_id", "caption"]
+    assert captions.empty
+
+
+class FakeCaptioner:
+    """Stands in for the processor, tokenizer and captioning model."""
+
+    pixel_values = None
+
+    @classmethod
+    def from_pretrained(cls, *args, **kwargs):
+        return cls()
+
+    def __call__(self, images, return_tensors):
+        return self
+
+    def eval(self) -> None:
+        pass
+
+    def generate(self, pixel_values, **kwargs):
+        return pixel_values
+
+    def batch_decode(self, output_ids, skip_special_tokens):
+        return ["new b"]
+
+
+class FailingCaptioner(FakeCaptioner):
+    """Captions images by width and fails on images 8 pixels wide."""
+
+    batches: list[int] = []
+    failing_width = 8
+
+    def __call__(self, images, return_tensors):
+        self.batches.append(len(images))
+        if any(image.width == self.failing_width for image in images):
+            msg = "Cannot caption"
+            raise RuntimeError(msg)
+        self.pixel_values = [image.width for image in images]
+        return self
+
+    def batch_decode(self, output_ids, skip_special_tokens):
+        return [f"{width} pixels wide " for width in output_ids]
+
+
+def test_generate_image_captions_falls_back_to_single_images(
+    monkeypatch,
+) -> None:
+    for name in (
+        "ViTImageProcessor",
+        "AutoTokenizer",
+        "VisionEncoderDecoderModel",
+    ):
+        monkeypatch.setattr(nodes, name, FailingCaptioner)
+    monkeypatch.setattr(FailingCaptioner, "batches", [])
+    images = []
+    for width in (4, 8, 6):
+        buffer = io.BytesIO()
+        Image.new("RGB", (width, 4)).save(buffer, format="JPEG")
+        images.append(buffer.getvalue())
+
+    captions = generate_image_captions(
+        pd.DataFrame(
+            {
+                "image_id": [0, 1, 2, 3],
+                "image_data": [*images, b"not an image"],
+            },
+        ),
+        {"caption_model": "fake"},
+    )
+
+    # The batch failed, then every readable image was captioned on its own
+    assert FailingCaptioner.batches == [3, 1, 1, 1]
+    assert dict(zip(captions["image_id"], captions["caption"])) == {
+        0: "4 pixels wide",
+        2: "6 pixels wide",
+    }
+
+
+def test_generate_image_captions_keeps_unchanged_captions(monkeypatch) -> None:
+    for name in (
+        "ViTImageProcessor",
+        "AutoTokenizer",
+        "VisionEncoderDecoderModel",
+    ):
+        monkeypatch.setattr(nodes, name, FakeCaptioner)
+    previous = pd.DataFrame(
+        {"image_id": [0, 1, 2], "caption": ["old a", "old b", "old c"]},
+    )
+    manifest = {"incremental": True, "upserted_ids": [1], "deleted_ids": [2]}
+
+    captions = generate_image_captions(
+        pd.DataFrame({"image_id": [1], "image_data": [image_to_bytes()]}),
+        {"caption_model": "fake"},
+        manifest,
+        previous,
+    )
+
+    assert dict(zip(captions["image_id"], captions["caption"])) == {
+        0: "old a",
+        1: "new b",
+    }
+
+
+def test_build_lexical_index(sample_tagged_df) -> None:
+    captions = pd.DataFrame(
+        {"image_id": [1, 2], "caption": ["a dog on grass", "a cat asleep"]},
+    )
+    index = build_lexical_index(sample_tagged_df, captions, {})
+    terms = index["terms"]
+
+    assert index["token_pattern"]
+    assert (index["k1"], index["b"]) == (1.2, 0.75)
+    assert index["n_docs"] == len(sample_tagged_df)
+    assert index["avgdl"] > 0
+    assert terms["dogs"]["ids"] == [1]
+    assert sorted(terms["cats"]["ids"]) == [0, 2, 3]
+    assert terms["asleep"]["ids"] == [2]
+    # Rare terms weigh more than terms shared by most images
+    assert terms["dogs"]["weights"][0] > max(terms["cats"]["weights"])
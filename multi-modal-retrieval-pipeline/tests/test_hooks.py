@@ -0,0 +1,86 @@
+import json
+
+import pandas as pd
+import pytest
+from kedro.framework.hooks.manager import _create_hook_manager
+from kedro.io import DataCatalog, MemoryDataset
+from kedro.pipeline import node, pipeline
+from kedro.runner import SequentialRunner
+from kedro_datasets.pandas import CSVDataset
+from kedro_datasets.partitions import PartitionedDataset
+from multi_modal_retrieval_pipeline.hooks import PipelinePerformanceHook
+
+
+def _double(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame * 2
+
+
+@pytest.mark.parametrize("trace_memory", [False, True])
+def test_performance_hook_writes_report(tmp_path, trace_memory) -> None:
+    source = tmp_path / "numbers.csv"
+    pd.DataFrame({"n": range(10)}).to_csv(source, index=False)
+    catalog = DataCatalog(
+        {
+            "numbers": CSVDataset(filepath=str(source)),
+            "doubled": MemoryDataset(),
+        },
+    )
+    hook = PipelinePerformanceHook(
+        report_dir=str(tmp_path / "reports"),
+        trace_memory=trace_memory,
+    )
+    hook_manager = _create_hook_manager()
+    hook_manager.register(hook)
+
+    # Hooks are called by the session, invoke the pipeline level ones here
+    run_params = {"session_id": "test", "pipeline_name": "__default__"}
+    test_pipeline = pipeline(
+        [
+            node(
+                _double,
+                "numbers",
+                "doubled",
+                name="double",
+                tags=["items.numbers"],
+            ),
+        ],
+    )
+    hook.before_pipeline_run(catalog=catalog)
+    SequentialRunner().run(test_pipeline, catalog, hook_manager)
+    hook.after_pipeline_run(run_params=run_params, pipeline=test_pipeline)
+
+    (report_path,) = (tmp_path / "reports").glob("performance_*.json")
+    report = json.loads(report_path.read_text())
+
+    assert report["status"] == "success"
+    (node_report,) = report["nodes"]
+    assert node_report["node"] == "double"
+    assert node_report["items"] == 10
+    assert node_report["items_per_second"] > 0
+    assert node_report["peak_rss_bytes"] > 0
+    assert ("tracemalloc_delta_bytes" in node_report) == trace_memory
+
+    io = {(e["dataset"], e["operation"]) for e in report["datasets"]}
+    assert io == {("numbers", "load"), ("doubled", "save")}
+    load = next(e for e in report["datasets"] if e["operation"] == "load")
+    assert load["bytes"] == source.stat().st_size
+
+
+def test_performance_hook_does_not_size_partitioned_datasets(tmp_path) -> None:
+    (tmp_path / "parts").mkdir()
+    pd.DataFrame({"n": range(3)}).to_csv(tmp_path / "parts" / "a.csv")
+    catalog = DataCatalog(
+        {
+            "parts": PartitionedDataset(
+                path=str(tmp_path / "parts"),
+                dataset="pandas.CSVDataset",
+                filename_suffix=".csv",
+            ),
+            "folder": CSVDataset(filepath=str(tmp_path / "parts")),
+        },
+    )
+    hook = PipelinePerformanceHook(report_dir=str(tmp_path / "reports"))
+    hook.before_pipeline_run(catalog=catalog)
+
+    assert hook._dataset_bytes("parts") is None
+    assert hook._dataset_bytes("folder") > 0